@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# Binance exports -> ledger.LedgerRow, the row schema the FIFO engine reads.
+#
+#   spot order trade history.csv  each fill becomes a base leg, a quote leg and
+#                                 a 'Trading fee' leg, described like Luno
+#                                 trades ('Sold 5.18 ETC/USDT @ 39')
+#   asset history.csv             every other balance change (deposits,
+#                                 airdrops, staking, converts, ZAR purchases);
+#                                 spot fills come from the trade history and
+#                                 moves between own wallets are dropped
+#   <Month Year>.xlsx             card purchase statements, streamed from the
+#                                 sheet XML (no spreadsheet library needed)
+#
+# Amounts such as '5.18ETC' or '5000.00 ZAR' are split into number and coin,
+# and BTC becomes XBT as in the Luno exports. ZAR is not a ledger currency: a
+# ZAR leg sets the Value amount of the coin leg it paid for; everything else
+# has no ZAR value in these files and is imported with 0.
+#
+# load_binance caches the merged rows next to the Luno ones (ledger.py), so
+# repeat runs cost one pickle load. Or write them out as a data/*.csv style
+# export and let the normal scripts pick it up:
+#
+#   python binance_import.py ../../Binance/crypto ../data/binance.csv
+import csv
+import glob
+import hashlib
+import os
+import re
+import sys
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import attrgetter
+from xml.etree.ElementTree import iterparse
+
+from descriptions import CURRENCY_ALIASES, parse_description
+from ledger import (CACHE_VERSION, DEFAULT_CACHE_DIR, EXPORT_HEADER, LedgerRow, _cache_path, _pack_rows,
+                    _read_cache, _unpack_rows, _write_cache, file_digest)
+
+# Part of the cache key: bump when the rows produced for the same files change
+IMPORT_VERSION = 1
+SPOT_TRADES_FILE = 'spot order trade history.csv'
+ASSET_HISTORY_FILE = 'asset history.csv'
+WALLET = 'Binance Spot'
+FIAT = 'ZAR'
+ZERO = Decimal('0')
+
+# Asset history operations that are fills already in the spot trade history
+SPOT_TRADE_OPERATIONS = {
+    'Buy', 'Sell', 'Fee',
+    'Transaction Buy', 'Transaction Spend', 'Transaction Sold', 'Transaction Revenue', 'Transaction Fee',
+}
+INTERNAL_TRANSFER_PREFIX = 'Transfer Between'
+# The asset history books a card purchase a few seconds after the statement
+CARD_MATCH_WINDOW = timedelta(minutes=10)
+
+_AMOUNT = re.compile(r'^\s*(\d[\d,]*(?:\.\d+)?)\s*([A-Za-z][A-Za-z0-9]*)\s*$')
+_UTC_OFFSET = re.compile(r'UTC([+-]\d+)')
+_SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def split_amount(text, coins=()):
+    # '5.18ETC' / '5000.00 ZAR' -> (Decimal('5.18'), 'ETC'). Coins that start
+    # with digits ('1000DGB' of DGB) need the candidates in coins.
+    for coin in coins:
+        if coin and text.upper().endswith(coin):
+            return Decimal(text[:-len(coin)].strip().replace(',', '')), coin
+    m = _AMOUNT.match(text)
+    if m is None:
+        raise ValueError(f"not an amount with a coin suffix: {text!r}")
+    return Decimal(m.group(1).replace(',', '')), m.group(2).upper()
+
+
+def _ccy(coin):
+    return CURRENCY_ALIASES.get(coin, coin)
+
+
+def _reference(source, line):
+    return hashlib.sha1(f"{source}:{line}".encode('utf-8')).hexdigest()[:8]
+
+
+def _row(ts, dt, coin, desc, ref, delta, value, wallet, line):
+    return LedgerRow(ts, dt, _ccy(coin), desc, ref, delta, value, wallet, line, parse_description(desc))
+
+
+def _zar(amount):
+    return f"{amount:,.2f}"
+
+
+def _qty(amount):
+    return f"{amount:f}"
+
+
+def iter_spot_trades(path):
+    # File order (Binance writes newest first); load_binance sorts
+    source = os.path.basename(path)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line, rec in enumerate(csv.DictReader(f), start=1):
+            ts = rec['Date(UTC)']
+            dt = datetime.fromisoformat(ts)
+            amount, quote = split_amount(rec['Amount'])
+            pair = rec['Pair'].upper()
+            qty, base = split_amount(rec['Executed'], [pair[:-len(quote)]] if pair.endswith(quote) else ())
+            fee, fee_coin = split_amount(rec['Fee'], (base, quote))
+            ref = _reference(source, line)
+            buy = rec['Side'].upper() == 'BUY'
+            verb = 'Bought' if buy else 'Sold'
+            sign = 1 if buy else -1
+            if quote == FIAT:
+                desc = f"{verb} {base} {_qty(qty)} for ZAR {_zar(amount)}"
+                yield _row(ts, dt, base, desc, ref, sign * qty, amount, WALLET, line)
+            else:
+                desc = f"{verb} {_qty(qty)} {base}/{quote} @ {rec['Price']}"
+                yield _row(ts, dt, base, desc, ref, sign * qty, ZERO, WALLET, line)
+                yield _row(ts, dt, quote, desc, ref, -sign * amount, ZERO, WALLET, line)
+            if fee and fee_coin != FIAT:
+                yield _row(ts, dt, fee_coin, 'Trading fee', ref, -fee, ZERO, WALLET, line)
+
+
+def _asset_group(source, legs):
+    # legs: (line, record) of one timestamp and operation
+    line, first = legs[0]
+    ts = first['UTC_Time']
+    dt = datetime.fromisoformat(ts)
+    op = first['Operation']
+    ref = first['Remark'] or _reference(source, line)
+    zar = sum((-Decimal(rec['Change']) for _, rec in legs if rec['Coin'] == FIAT), ZERO)
+    coins = [(line, rec, Decimal(rec['Change'])) for line, rec in legs if rec['Coin'] != FIAT]
+    wallet = f"Binance {first['Account']}"
+    if len(coins) == 1 and zar:
+        # Bought (or sold) for ZAR: the ZAR leg is the coin's value
+        line, rec, delta = coins[0]
+        verb = 'Bought' if delta > 0 else 'Sold'
+        desc = f"{verb} {rec['Coin']} {_qty(abs(delta))} for ZAR {_zar(abs(zar))}"
+        yield _row(ts, dt, rec['Coin'], desc, ref, delta, abs(zar), wallet, line)
+        return
+    ins = [c for c in coins if c[2] > 0]
+    outs = [c for c in coins if c[2] < 0]
+    if len(ins) == 1 and len(outs) == 1:
+        # A conversion; both legs carry the trade so trade_linker pairs them
+        (in_line, in_rec, in_qty), (out_line, out_rec, out_qty) = ins[0], outs[0]
+        desc = f"Bought {in_rec['Coin']} {_qty(in_qty)} for {out_rec['Coin']} {_qty(-out_qty)}"
+        yield _row(ts, dt, in_rec['Coin'], desc, ref, in_qty, ZERO, wallet, in_line)
+        yield _row(ts, dt, out_rec['Coin'], desc, ref, out_qty, ZERO, wallet, out_line)
+        return
+    for line, rec, delta in coins:
+        yield _row(ts, dt, rec['Coin'], op, ref, delta, ZERO, wallet, line)
+
+
+def _is_card_purchase(legs, cards):
+    # cards: rows from iter_card_purchases. A match is by transaction id (the
+    # asset history cuts some short, so a prefix is enough) or, without one,
+    # by coin and quantity within CARD_MATCH_WINDOW.
+    remark = legs[0][1]['Remark']
+    if remark:
+        return any(card.reference.startswith(remark) for card in cards)
+    coins = [rec for _, rec in legs if rec['Coin'] != FIAT]
+    if len(coins) != 1:
+        return False
+    ccy, qty = _ccy(coins[0]['Coin']), Decimal(coins[0]['Change'])
+    dt = datetime.fromisoformat(coins[0]['UTC_Time'])
+    return any(card.currency == ccy and card.balance_delta == qty and abs(card.dt - dt) <= CARD_MATCH_WINDOW
+               for card in cards)
+
+
+def iter_asset_history(path, cards=()):
+    # cards: purchases already imported from the card statements
+    source = os.path.basename(path)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        records = ((line, rec) for line, rec in enumerate(csv.DictReader(f), start=1)
+                   if rec['Operation'] not in SPOT_TRADE_OPERATIONS
+                   and not rec['Operation'].startswith(INTERNAL_TRANSFER_PREFIX))
+        for _, same_time in groupby(records, key=lambda item: item[1]['UTC_Time']):
+            # Legs of one operation need not be adjacent within a timestamp
+            by_operation = {}
+            for item in same_time:
+                by_operation.setdefault(item[1]['Operation'], []).append(item)
+            for legs in by_operation.values():
+                if all(rec['Coin'] == FIAT for _, rec in legs):
+                    continue
+                if cards and _is_card_purchase(legs, cards):
+                    continue
+                yield from _asset_group(source, legs)
+
+
+def iter_sheet(path):
+    # Cell values of the first worksheet, row by row, as strings; elements are
+    # cleared as soon as their row is read
+    with zipfile.ZipFile(path) as z:
+        shared = []
+        if 'xl/sharedStrings.xml' in z.namelist():
+            with z.open('xl/sharedStrings.xml') as f:
+                for _, el in iterparse(f):
+                    if el.tag == f'{_SHEET_NS}si':
+                        shared.append(''.join(t.text or '' for t in el.iter(f'{_SHEET_NS}t')))
+                        el.clear()
+        sheet = sorted(n for n in z.namelist() if n.startswith('xl/worksheets/sheet'))[0]
+        with z.open(sheet) as f:
+            for _, el in iterparse(f):
+                if el.tag != f'{_SHEET_NS}row':
+                    continue
+                values = {}
+                for cell in el.iter(f'{_SHEET_NS}c'):
+                    col = re.match(r'[A-Z]+', cell.get('r')).group(0)
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        text = ''.join(t.text or '' for t in cell.iter(f'{_SHEET_NS}t'))
+                    else:
+                        v = cell.find(f'{_SHEET_NS}v')
+                        text = '' if v is None else v.text or ''
+                        if kind == 's':
+                            text = shared[int(text)]
+                    values[col] = text
+                el.clear()
+                width = max((_column_index(col) for col in values), default=-1) + 1
+                row = [''] * width
+                for col, text in values.items():
+                    row[_column_index(col)] = text
+                yield row
+
+
+def _column_index(col):
+    n = 0
+    for ch in col:
+        n = n * 26 + ord(ch) - ord('A') + 1
+    return n - 1
+
+
+def iter_card_purchases(path):
+    source = os.path.basename(path)
+    rows = iter_sheet(path)
+    header = next(rows, None)
+    if header is None:
+        return
+    date_col = next(h for h in header if h.startswith('Date'))
+    m = _UTC_OFFSET.search(date_col)
+    offset = timedelta(hours=int(m.group(1))) if m else timedelta(0)
+    for line, values in enumerate(rows, start=2):
+        rec = dict(zip(header, values))
+        if rec.get('Status') != 'Successful':
+            continue
+        dt = datetime.fromisoformat(rec[date_col]) - offset
+        spend, spend_coin = split_amount(rec['Spend Amount'])
+        qty, coin = split_amount(rec['Receive Amount'])
+        ref = rec.get('Transaction ID') or _reference(source, line)
+        value = spend if spend_coin == FIAT else ZERO
+        desc = f"Bought {coin} {_qty(qty)} for {spend_coin} {_zar(spend) if spend_coin == FIAT else _qty(spend)}"
+        yield _row(dt.strftime('%Y-%m-%d %H:%M:%S'), dt, coin, desc, ref, qty, value, WALLET, line)
+
+
+def binance_files(binance_dir):
+    spot = os.path.join(binance_dir, SPOT_TRADES_FILE)
+    assets = os.path.join(binance_dir, ASSET_HISTORY_FILE)
+    return ([spot] if os.path.exists(spot) else []) + ([assets] if os.path.exists(assets) else []) + \
+        sorted(glob.glob(os.path.join(binance_dir, '*.xlsx')))
+
+
+def parse_binance(paths):
+    cards = []
+    rows = []
+    for path in paths:
+        if path.endswith('.xlsx'):
+            cards.extend(iter_card_purchases(path))
+    for path in paths:
+        name = os.path.basename(path)
+        if name == SPOT_TRADES_FILE:
+            rows.extend(iter_spot_trades(path))
+        elif name == ASSET_HISTORY_FILE:
+            rows.extend(iter_asset_history(path, cards))
+    rows.extend(cards)
+    rows.sort(key=attrgetter('dt'))
+    return rows
+
+
+def load_binance(binance_dir, cache_dir=DEFAULT_CACHE_DIR):
+    # Merged, time-ordered rows of every Binance export in binance_dir, cached
+    # like ledger.load_file (sizes and mtimes, then content hashes)
+    paths = binance_files(binance_dir)
+    if cache_dir is None:
+        return parse_binance(paths)
+    stats = [(os.path.abspath(p), os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in paths]
+    cache_file = _cache_path(os.path.join(binance_dir, 'binance'), cache_dir)
+    entry = _read_cache(cache_file)
+    if entry is not None and entry.get('version') == (CACHE_VERSION, IMPORT_VERSION) and \
+            [f[:2] for f in entry.get('files', [])] == [s[:2] for s in stats]:
+        if [f[2] for f in entry['files']] == [s[2] for s in stats]:
+            return _unpack_rows(entry['columns'])
+        digests = [file_digest(p) for p in paths]
+        if digests == [f[3] for f in entry['files']]:
+            entry['files'] = [s + (d,) for s, d in zip(stats, digests)]
+            _write_cache(cache_file, entry)
+            return _unpack_rows(entry['columns'])
+    digests = [file_digest(p) for p in paths]
+    rows = parse_binance(paths)
+    _write_cache(cache_file, {
+        'version': (CACHE_VERSION, IMPORT_VERSION),
+        'files': [s + (d,) for s, d in zip(stats, digests)],
+        'columns': _pack_rows(rows),
+    })
+    return rows
+
+
+def write_export(rows, output_csv):
+    # rows as a data/*.csv style export: running balances per currency
+    balances = {}
+    with open(output_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_HEADER)
+        for n, row in enumerate(rows, start=1):
+            balance = balances[row.currency] = balances.get(row.currency, ZERO) + row.balance_delta
+            writer.writerow((row.wallet_id, n, row.timestamp, row.description, row.currency, row.balance_delta,
+                             row.balance_delta, balance, balance, '', '', FIAT, row.value_amount, row.reference))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: binance_import.py BINANCE_DIR OUTPUT_CSV")
+    binance_dir, output_csv = sys.argv[1:]
+    rows = load_binance(binance_dir)
+    write_export(rows, output_csv)
+    currencies = sorted({row.currency for row in rows})
+    print(f"Wrote {output_csv} with {len(rows)} rows in {len(currencies)} currencies.")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Fixed-point integer arithmetic for the FIFO hot loop. Quantities are held
+# as integer base units (1e-8 of a coin, the q8 precision) and ZAR amounts as
+# integer sub-cents (1e-10 ZAR); unit costs are sub-cents per whole coin.
+# Values are only turned into display strings (matching q8/s2) at write time.
+#
+# Run this file directly for the differential check against the Decimal
+# engine on every CSV in ../data (the NumPy vector engine too, if installed),
+# and of FixedFYEngine against FYEngine on every report they render.
+from decimal import Decimal, ROUND_HALF_UP
+
+QTY_SCALE = 10 ** 8
+AMT_SCALE = 10 ** 10
+CENT = AMT_SCALE // 100
+HALF_CENT = CENT // 2
+
+
+def to_units(x: Decimal) -> int:
+    return int(x.scaleb(8).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_amt(x: Decimal) -> int:
+    return int(x.scaleb(10).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def unit_cost(amt: int, units: int) -> int:
+    # Sub-cents per whole coin for amt spread over units
+    if units == 0:
+        return 0
+    return amt * QTY_SCALE // units
+
+
+def qty_decimal(units: int) -> Decimal:
+    return Decimal(units).scaleb(-8)
+
+
+def amt_decimal(amt: int) -> Decimal:
+    return Decimal(amt).scaleb(-10)
+
+
+def share(amt: int, part: int, whole: int) -> int:
+    # amt * part / whole to the nearest sub-cent. Flooring would bias every
+    # split the same way, which adds up along a running balance.
+    return (2 * amt * part + whole) // (2 * whole)
+
+
+def round_cents(amt: int) -> int:
+    # amt rounded to whole cents as r2() rounds: ROUND_HALF_UP, away from zero
+    if amt < 0:
+        return -((HALF_CENT - amt) // CENT * CENT)
+    return (amt + HALF_CENT) // CENT * CENT
+
+
+def lot_cost(units: int, uc: int) -> int:
+    # Amount of units at uc sub-cents per whole coin
+    return units * uc // QTY_SCALE
+
+
+def fmt_qty(units: int) -> str:
+    # Same string as q8(): Decimal keeps the 1e-8 exponent, e.g. '6.6E-7'
+    return str(Decimal(units).scaleb(-8))
+
+
+def fmt_amt(amt: int) -> str:
+    # Same string as s2(): ROUND_HALF_UP to cents, sign kept on '-0.00'
+    if amt < 0:
+        cents = (HALF_CENT - amt) // CENT
+        return f"-{cents // 100}.{cents % 100:02d}"
+    cents = (amt + HALF_CENT) // CENT
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+def _differential_check():
+    import filecmp
+    import glob
+    import os
+    import shutil
+    import tempfile
+    import fifo_report
+    import report_sinks
+    import vector_fifo
+    from ledger import load_file, load_ledger
+
+    data_dir = '../data'
+    mismatches = 0
+    for csv_file in sorted(glob.glob(os.path.join(data_dir, '*.csv'))):
+        rows = load_file(csv_file)
+        expected = fifo_report.build_fifo_rows(rows)
+        actual = fifo_report.build_fifo_rows_fixed(rows)
+        bad = sum(1 for e, a in zip(expected, actual) if e != a) + abs(len(expected) - len(actual))
+        mismatches += bad
+        print(f"{os.path.basename(csv_file)}: {len(expected)} rows, {bad} mismatches")
+        if vector_fifo.available():
+            actual = fifo_report.build_fifo_rows_vector(rows)
+            bad = sum(1 for e, a in zip(expected, actual) if e != a) + abs(len(expected) - len(actual))
+            mismatches += bad
+            print(f"{os.path.basename(csv_file)} (vector): {len(expected)} rows, {bad} mismatches")
+        if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simple_fifo.py')):
+            import simple_fifo
+            expected, _ = simple_fifo.build_rows(rows)
+            actual, _ = simple_fifo.build_rows_fixed(rows)
+            bad = sum(1 for e, a in zip(expected, actual) if e != a) + abs(len(expected) - len(actual))
+            mismatches += bad
+            print(f"{os.path.basename(csv_file)} (simple_fifo): {len(expected)} rows, {bad} mismatches")
+            if vector_fifo.available():
+                actual, _ = simple_fifo.build_rows_vector(rows)
+                bad = sum(1 for e, a in zip(expected, actual) if e != a) + abs(len(expected) - len(actual))
+                mismatches += bad
+                print(f"{os.path.basename(csv_file)} (simple_fifo vector): {len(expected)} rows, {bad} mismatches")
+
+    csv_files = sorted(glob.glob(os.path.join(data_dir, '*.csv')))
+    rows = load_ledger(csv_files)
+    mapping = fifo_report.load_buys_for_others_mapping()
+    dirs = []
+    try:
+        for fixed in (False, True):
+            dirs.append(tempfile.mkdtemp())
+            fifo_report.process_fy(csv_files, dirs[-1], 'check', checkpoint_file=None, buys_for_others_mapping=mapping,
+                                   rows=rows, sinks=report_sinks.default_sinks(), fixed=fixed)
+        for name in sorted(os.listdir(dirs[0])):
+            if name.endswith('.csv'):
+                bad = 0 if filecmp.cmp(os.path.join(dirs[0], name), os.path.join(dirs[1], name), shallow=False) else 1
+                mismatches += bad
+                print(f"{name} (FY engine): {'differs' if bad else 'same'}")
+    finally:
+        for d in dirs:
+            shutil.rmtree(d)
+    return mismatches
+
+
+if __name__ == '__main__':
+    raise SystemExit(1 if _differential_check() else 0)
@@ -1,114 +1,157 @@
 #!/usr/bin/env python3
-import csv
 import os
+import sys
 import glob
 import json
 from decimal import Decimal
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import timedelta
+from bisect import bisect_left, bisect_right
+from collections import deque
 
-def parse_dt(s):
-    return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+from ledger import load_by_currency, iter_by_currency
+from classifier import classify
+import run_metrics
 
-def dec(x):
-    if isinstance(x, Decimal):
-        return x
-    s = str(x).strip()
-    if s == '':
-        return Decimal('0')
-    return Decimal(s)
+MATCH_WINDOW = timedelta(days=7)
+MIN_QTY_RATIO = Decimal('0.90')
 
-def main():
-    data_dir = '../data'
-    csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
-    
-    rows_by_ccy = defaultdict(list)
-    for csv_file in csv_files:
-        with open(csv_file, newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                row['Balance delta'] = dec(row['Balance delta'])
-                row['Value amount'] = dec(row['Value amount'])
-                row['_dt'] = parse_dt(row['Timestamp (UTC)'])
-                ccy = row['Currency']
-                rows_by_ccy[ccy].append(row)
-    
-    for ccy in rows_by_ccy:
-        rows_by_ccy[ccy].sort(key=lambda r: r['_dt'])
-    
+def _find_unmatched(parent, i):
+    # Largest unmatched buy index <= i, or -1. Matched buys point at their
+    # left neighbour; paths are halved as they are walked.
+    while i >= 0 and parent[i] != i:
+        parent[i] = parent[parent[i]] if parent[i] >= 0 else -1
+        i = parent[i]
+    return i
+
+class _BuyWindow:
+    # Bought rows still within MATCH_WINDOW of a pending Other. Buys that fall
+    # out of the window are dropped in batches, so a long history never keeps
+    # more than a window's worth of buys.
+    COMPACT_MIN = 64
+
+    def __init__(self):
+        self.refs = []
+        self.qtys = []
+        self.dts = []
+        # Union-find over buy indexes: parent[i] == i while buy i is unmatched
+        self.parent = []
+        self.candidates = 0
+
+    def add(self, ref, qty, dt):
+        self.parent.append(len(self.refs))
+        self.refs.append(ref)
+        self.qtys.append(qty)
+        self.dts.append(dt)
+
+    def evict_before(self, cutoff):
+        k = bisect_left(self.dts, cutoff)
+        if k < self.COMPACT_MIN or k * 2 < len(self.dts):
+            return
+        self.parent = [p - k if p >= k else -1 for p in self.parent[k:]]
+        del self.refs[:k], self.qtys[:k], self.dts[:k]
+
+    def match(self, other_qty, other_dt):
+        # Index of the buy this Other takes (now marked matched), or -1
+        buy_dts = self.dts
+        parent = self.parent
+        lo = bisect_left(buy_dts, other_dt - MATCH_WINDOW)
+        hi = bisect_right(buy_dts, other_dt)
+        best = -1
+        j = _find_unmatched(parent, hi - 1)
+        while j >= lo:
+            if best >= 0 and buy_dts[j] != buy_dts[best]:
+                break
+            self.candidates += 1
+            if other_qty / self.qtys[j] >= MIN_QTY_RATIO:
+                best = j
+            j = _find_unmatched(parent, j - 1)
+        if best >= 0:
+            parent[best] = best - 1
+        return best
+
+
+def find_buys_for_others(rows_by_ccy):
+    # Greedy match of each Other (in time order) to the closest earlier
+    # unmatched Bought within MATCH_WINDOW whose quantity it covers to at
+    # least MIN_QTY_RATIO; ties on time go to the earlier buy.
+    # rows_by_ccy values only need to be time-ordered iterables: an Other is
+    # settled once the stream moves past its timestamp (a Bought at the same
+    # second still counts), so ledger.iter_by_currency streams work too.
     mapping = {}
     
     for ccy, rows in rows_by_ccy.items():
-        buys = []
-        others = []
+        window = _BuyWindow()
+        pending = deque()
+        n_buys = 0
+        n_others = 0
+        ccy_mapping = {}
+
+        def settle(before_dt):
+            while pending and (before_dt is None or pending[0][1] < before_dt):
+                other_qty, other_dt, other_timestamp, other_desc = pending.popleft()
+                best = window.match(other_qty, other_dt)
+                if best >= 0:
+                    ccy_mapping[window.refs[best]] = {
+                        'other_timestamp': other_timestamp,
+                        'other_desc': other_desc,
+                        'buy_qty': str(window.qtys[best]),
+                        'other_qty': str(other_qty)
+                    }
         
         for row in rows:
-            qty_delta = row['Balance delta']
-            desc = row['Description']
-            ref = row['Reference']
+            qty_delta = row.balance_delta
+            desc = row.description
             
-            if qty_delta == 0 or 'fee' in desc.lower():
+            if qty_delta == 0:
+                continue
+            kind = classify(desc)
+            if kind.fee:
                 continue
             
-            if qty_delta > 0 and desc.startswith('Bought'):
-                buys.append({
-                    'ref': ref,
-                    'qty': qty_delta,
-                    'dt': row['_dt'],
-                    'timestamp': row['Timestamp (UTC)'],
-                    'matched': False
-                })
-            elif qty_delta < 0 and not desc.startswith('Sold'):
-                others.append({
-                    'qty': abs(qty_delta),
-                    'dt': row['_dt'],
-                    'timestamp': row['Timestamp (UTC)'],
-                    'desc': desc
-                })
-        
-        ccy_mapping = {}
-        
-        for other in others:
-            best_match = None
-            best_time_diff = None
-            
-            for buy in buys:
-                if buy['matched']:
-                    continue
-                
-                time_diff = other['dt'] - buy['dt']
-                if time_diff < timedelta(0):
-                    continue
-                if time_diff > timedelta(days=7):
-                    continue
-                
-                qty_ratio = other['qty'] / buy['qty'] if buy['qty'] > 0 else Decimal('0')
-                if qty_ratio < Decimal('0.90'):
-                    continue
-                
-                if best_match is None or time_diff < best_time_diff:
-                    best_match = buy
-                    best_time_diff = time_diff
-            
-            if best_match:
-                best_match['matched'] = True
-                ccy_mapping[best_match['ref']] = {
-                    'other_timestamp': other['timestamp'],
-                    'other_desc': other['desc'],
-                    'buy_qty': str(best_match['qty']),
-                    'other_qty': str(other['qty'])
-                }
+            settle(row.dt)
+            window.evict_before((pending[0][1] if pending else row.dt) - MATCH_WINDOW)
+            if qty_delta > 0 and kind.buy:
+                window.add(row.reference, qty_delta, row.dt)
+                n_buys += 1
+            elif qty_delta < 0 and not kind.sell:
+                pending.append((abs(qty_delta), row.dt, row.timestamp, desc))
+                n_others += 1
+        settle(None)
         
+        print(f"  {ccy}: evaluated {window.candidates} candidate buys for {n_others} others ({n_buys} buys)")
         if ccy_mapping:
             mapping[ccy] = ccy_mapping
     
-    output_file = os.path.join(data_dir, 'buys_for_others.json')
-    with open(output_file, 'w') as f:
-        json.dump(mapping, f, indent=2)
+    return mapping
+
+def mapping_file(data_dir):
+    return os.path.join(data_dir, 'buys_for_others.json')
+
+def read_mapping(data_dir):
+    with open(mapping_file(data_dir), 'r') as f:
+        return json.load(f)
+
+def write_mapping(mapping, data_dir):
+    output_file = mapping_file(data_dir)
+    with run_metrics.writing(output_file):
+        with open(output_file, 'w') as f:
+            json.dump(mapping, f, indent=2)
     
     print(f"Wrote {output_file}")
     for ccy in mapping:
         print(f"  {ccy}: {len(mapping[ccy])} buys matched to others")
 
+def main():
+    data_dir = '../data'
+    csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
+    
+    # --stream: read the exports lazily instead of loading them whole
+    if '--stream' in sys.argv:
+        rows_by_ccy = iter_by_currency(csv_files)
+    else:
+        rows_by_ccy = load_by_currency(csv_files)
+    mapping = find_buys_for_others(rows_by_ccy)
+    write_mapping(mapping, data_dir)
+
 if __name__ == '__main__':
     main()
@@ -1,14 +1,11 @@
 #!/usr/bin/env python3
-import csv
 import os
 import glob
 import json
 from collections import defaultdict
-from decimal import Decimal
 
-def parse_dt(s):
-    from datetime import datetime
-    return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+from ledger import load_file
+from classifier import classify
 
 def main():
     data_dir = '../data'
@@ -19,29 +16,28 @@ def main():
     other_descriptions = defaultdict(list)
     
     for csv_file in csv_files:
-        with open(csv_file, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                desc = row['Description'].strip()
-                qty_delta = Decimal(row['Balance delta'])
-                
-                # Check if this is an "Other" transaction
-                # Positive but not "Bought" = incoming Other
-                # Negative but not "Sold" = outgoing Other
-                is_other = False
-                
-                if qty_delta > 0:
-                    # Incoming
-                    if not desc.startswith('Bought') and 'Received' not in desc:
-                        is_other = True
-                elif qty_delta < 0:
-                    # Outgoing
-                    if not desc.startswith('Sold') and 'fee' not in desc.lower():
-                        is_other = True
-                
-                if is_other:
-                    ccy = row['Currency']
-                    other_descriptions[ccy].append(desc)
+        for row in load_file(csv_file):
+            desc = row.description.strip()
+            qty_delta = row.balance_delta
+            kind = classify(desc)
+            
+            # Check if this is an "Other" transaction
+            # Positive but not "Bought" = incoming Other
+            # Negative but not "Sold" = outgoing Other
+            is_other = False
+            
+            if qty_delta > 0:
+                # Incoming
+                if not kind.buy and not kind.receive:
+                    is_other = True
+            elif qty_delta < 0:
+                # Outgoing
+                if not kind.sell and not kind.fee:
+                    is_other = True
+            
+            if is_other:
+                ccy = row.currency
+                other_descriptions[ccy].append(desc)
     
     # Deduplicate descriptions per currency
     for ccy in other_descriptions:
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# Shared ledger loader: each exchange export is parsed once into compact
+# LedgerRow tuples and cached under <root>/.cache/ledger, keyed by file path,
+# size, mtime and content hash, so unchanged exports skip csv/Decimal parsing.
+# The cache holds columns rather than pickled rows: amounts as integer
+# coefficients and exponents, and strings (timestamps included) as indexes
+# into a table of distinct values, from which the rows are rebuilt.
+import csv
+import gc
+import hashlib
+import heapq
+import os
+import pickle
+from array import array
+from collections import namedtuple
+from itertools import repeat, starmap
+from operator import attrgetter
+from datetime import datetime
+from decimal import Context, Decimal, MAX_PREC
+
+from descriptions import Trade, parse_description
+
+CACHE_VERSION = 4
+# LEDGER_CACHE_DIR overrides the location (benchmark.py points it at a scratch dir)
+DEFAULT_CACHE_DIR = os.environ.get('LEDGER_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'ledger')
+
+# Column order of the exchange exports in data/ (synth_ledger.py and
+# binance_import.py write the same layout)
+EXPORT_HEADER = [
+    'Wallet ID', 'Row', 'Timestamp (UTC)', 'Description', 'Currency', 'Balance delta',
+    'Available balance delta', 'Balance', 'Available balance', 'Cryptocurrency transaction ID',
+    'Cryptocurrency address', 'Value currency', 'Value amount', 'Reference',
+]
+
+# Only the columns the scripts actually use are kept.
+LedgerRow = namedtuple('LedgerRow', [
+    'timestamp',      # 'Timestamp (UTC)' as written in the export
+    'dt',             # parsed datetime
+    'currency',
+    'description',
+    'reference',
+    'balance_delta',  # Decimal
+    'value_amount',   # Decimal
+    'wallet_id',
+    'row_number',     # 'Row' column, int (0 when missing)
+    'trade',          # descriptions.Trade parsed from the description, or None
+])
+
+
+def _dec(s):
+    s = s.strip()
+    if s == '':
+        return Decimal('0')
+    return Decimal(s)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _ledger_row(row):
+    ts = row['Timestamp (UTC)']
+    row_no = row.get('Row') or ''
+    return LedgerRow(
+        ts,
+        datetime.fromisoformat(ts),
+        row['Currency'],
+        row['Description'],
+        row['Reference'],
+        _dec(row['Balance delta']),
+        _dec(row['Value amount']),
+        row.get('Wallet ID', ''),
+        int(row_no) if row_no.strip() else 0,
+        parse_description(row['Description']),
+    )
+
+
+def parse_file(csv_file):
+    with open(csv_file, newline='') as f:
+        rows = [_ledger_row(row) for row in csv.DictReader(f)]
+    rows.sort(key=lambda r: r.dt)
+    return rows
+
+
+def scan_file(csv_file):
+    # (in timestamp order?, currencies in the order they first appear once
+    # sorted) from the Timestamp and Currency columns only
+    in_order = True
+    first_seen = {}
+    prev = None
+    with open(csv_file, newline='') as f:
+        for pos, row in enumerate(csv.DictReader(f)):
+            dt = datetime.fromisoformat(row['Timestamp (UTC)'])
+            if prev is not None and dt < prev:
+                in_order = False
+            prev = dt
+            ccy = row['Currency']
+            if ccy not in first_seen or dt < first_seen[ccy][0]:
+                first_seen[ccy] = (dt, pos)
+    return in_order, sorted(first_seen, key=first_seen.get)
+
+
+def iter_file(csv_file, currency=None, in_order=None):
+    # Rows of one export in the same order as parse_file, parsed lazily.
+    # Exports are written in Row order, which is timestamp order; a file that
+    # is not gets parsed and sorted on its own instead.
+    if in_order is None:
+        in_order = scan_file(csv_file)[0]
+    if not in_order:
+        for row in parse_file(csv_file):
+            if currency is None or row.currency == currency:
+                yield row
+        return
+    with open(csv_file, newline='') as f:
+        for row in csv.DictReader(f):
+            if currency is None or row['Currency'] == currency:
+                yield _ledger_row(row)
+
+
+# Rebuilding a Decimal from its coefficient must not round it
+_EXACT = Context(prec=MAX_PREC)
+
+
+def _typed(kind, values):
+    # values as array(kind) when they all fit, else the list itself
+    try:
+        return array(kind, values)
+    except OverflowError:
+        return values
+
+
+def _pack_decimals(values):
+    # (coefficients, exponents), or ('text', strings) for a column holding
+    # -0, NaN or Infinity, which a coefficient cannot carry
+    values = list(values)
+    coefs = []
+    exps = []
+    for d in values:
+        exp = d.as_tuple().exponent
+        if not isinstance(exp, int) or (d.is_signed() and d.is_zero()):
+            return 'text', [str(d) for d in values]
+        coefs.append(int(d.scaleb(-exp, _EXACT)))
+        exps.append(exp)
+    return _typed('q', coefs), _typed('b', exps)
+
+
+def _unpack_decimals(packed):
+    coefs, exps = packed
+    if coefs == 'text':
+        return list(map(Decimal, exps))
+    return list(map(Decimal.scaleb, map(Decimal, coefs), exps, repeat(_EXACT)))
+
+
+def _pack_strings(values):
+    # (distinct values, index of each value)
+    index = {}
+    codes = [index.setdefault(v, len(index)) for v in values]
+    return list(index), _typed('I', codes)
+
+
+def _unpack_strings(packed):
+    distinct, codes = packed
+    return list(map(distinct.__getitem__, codes))
+
+
+def _pack_rows(rows):
+    trades = [(pos, r.trade) for pos, r in enumerate(rows) if r.trade is not None]
+    # dt is parsed again from the timestamp text, which is cheaper than
+    # unpickling it; only rows built otherwise (binance_import's card
+    # purchases) need it stored
+    try:
+        dts = None if all(r.dt == datetime.fromisoformat(r.timestamp) for r in rows) else [r.dt for r in rows]
+    except ValueError:
+        dts = [r.dt for r in rows]
+    return {
+        'count': len(rows),
+        'timestamp': _pack_strings(r.timestamp for r in rows),
+        'dt': dts,
+        'currency': _pack_strings(r.currency for r in rows),
+        'description': _pack_strings(r.description for r in rows),
+        'reference': _pack_strings(r.reference for r in rows),
+        'balance_delta': _pack_decimals(r.balance_delta for r in rows),
+        'value_amount': _pack_decimals(r.value_amount for r in rows),
+        'wallet_id': _pack_strings(r.wallet_id for r in rows),
+        'row_number': _typed('q', [r.row_number for r in rows]),
+        'trade_pos': _typed('I', [pos for pos, _ in trades]),
+        'trade_side': _pack_strings(t.side for _, t in trades),
+        'trade_base': _pack_strings(t.base for _, t in trades),
+        'trade_quote': _pack_strings(t.quote for _, t in trades),
+        'trade_qty': _pack_decimals(t.qty for _, t in trades),
+        'trade_price': _pack_decimals(t.price for _, t in trades),
+        'trade_counter': _pack_decimals(t.counter for _, t in trades),
+    }
+
+
+def _unpack_rows(columns):
+    # The rows hold no reference cycles, so the cyclic GC passes that
+    # hundreds of thousands of new objects would set off are skipped
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _build_rows(columns)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _build_rows(columns):
+    timestamps = _unpack_strings(columns['timestamp'])
+    dts = columns['dt']
+    if dts is None:
+        dts = map(datetime.fromisoformat, timestamps)
+    trades = [None] * columns['count']
+    for pos, trade in zip(columns['trade_pos'], starmap(Trade, zip(
+            _unpack_strings(columns['trade_side']), _unpack_strings(columns['trade_base']),
+            _unpack_strings(columns['trade_quote']), _unpack_decimals(columns['trade_qty']),
+            _unpack_decimals(columns['trade_price']), _unpack_decimals(columns['trade_counter'])))):
+        trades[pos] = trade
+    return list(starmap(LedgerRow, zip(
+        timestamps, dts, _unpack_strings(columns['currency']), _unpack_strings(columns['description']),
+        _unpack_strings(columns['reference']), _unpack_decimals(columns['balance_delta']),
+        _unpack_decimals(columns['value_amount']), _unpack_strings(columns['wallet_id']),
+        columns['row_number'], trades)))
+
+
+def _cache_path(csv_file, cache_dir):
+    abspath = os.path.abspath(csv_file)
+    key = hashlib.sha1(abspath.encode('utf-8')).hexdigest()[:16]
+    base = os.path.basename(abspath).rsplit('.', 1)[0]
+    return os.path.join(cache_dir, f"{base}-{key}.pickle")
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, TypeError, ValueError):
+        return None
+
+
+def _write_cache(cache_file, entry):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_file)
+
+
+def load_file(csv_file, cache_dir=DEFAULT_CACHE_DIR):
+    # Rows of one export, stably sorted by timestamp
+    if cache_dir is None:
+        return parse_file(csv_file)
+
+    st = os.stat(csv_file)
+    cache_file = _cache_path(csv_file, cache_dir)
+    entry = _read_cache(cache_file)
+    digest = None
+    if entry is not None and entry.get('version') == CACHE_VERSION and entry.get('path') == os.path.abspath(csv_file):
+        if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return _unpack_rows(entry['columns'])
+        # Touched but possibly unchanged: the content hash decides.
+        if entry['size'] == st.st_size:
+            digest = file_digest(csv_file)
+            if digest == entry['sha256']:
+                entry['mtime_ns'] = st.st_mtime_ns
+                _write_cache(cache_file, entry)
+                return _unpack_rows(entry['columns'])
+
+    if digest is None:
+        digest = file_digest(csv_file)
+    rows = parse_file(csv_file)
+    _write_cache(cache_file, {
+        'version': CACHE_VERSION,
+        'path': os.path.abspath(csv_file),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': digest,
+        'columns': _pack_rows(rows),
+    })
+    return rows
+
+
+def merge_rows(row_lists):
+    # Per-file row lists merged by timestamp; ties keep file order, same as a
+    # stable sort of the concatenated files
+    rows = []
+    for file_rows in row_lists:
+        rows.extend(file_rows)
+    rows.sort(key=lambda r: r.dt)
+    return rows
+
+
+def group_by_currency(row_lists):
+    # {currency: rows sorted by timestamp}, currencies in order of first
+    # appearance when reading the files in the given order
+    rows_by_ccy = {}
+    for file_rows in row_lists:
+        for row in file_rows:
+            rows_by_ccy.setdefault(row.currency, []).append(row)
+    for ccy in rows_by_ccy:
+        rows_by_ccy[ccy].sort(key=lambda r: r.dt)
+    return rows_by_ccy
+
+
+def iter_ledger(csv_files):
+    # Streaming merge_rows: heapq.merge also keeps file order on ties
+    return heapq.merge(*(iter_file(f) for f in csv_files), key=attrgetter('dt'))
+
+
+def iter_by_currency(csv_files):
+    # Streaming group_by_currency: {currency: lazy time-ordered row iterator}.
+    # Only the two cheap column scans run up front.
+    scans = [(f, scan_file(f)) for f in csv_files]
+    streams = {}
+    for csv_file, (in_order, currencies) in scans:
+        for ccy in currencies:
+            streams.setdefault(ccy, []).append(iter_file(csv_file, ccy, in_order))
+    return {ccy: heapq.merge(*its, key=attrgetter('dt')) for ccy, its in streams.items()}
+
+
+def load_ledger(csv_files, cache_dir=DEFAULT_CACHE_DIR):
+    return merge_rows(load_file(f, cache_dir) for f in csv_files)
+
+
+def load_by_currency(csv_files, cache_dir=DEFAULT_CACHE_DIR):
+    return group_by_currency(load_file(f, cache_dir) for f in csv_files)
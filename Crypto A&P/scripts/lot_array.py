@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# FIFO lot queue for the per-file fixed-point ledgers (fifo_report.main and
+# simple_fifo.py; the FY engine's FixedLot holds Python ints), held as
+# parallel typed arrays (units left, lot amount, lot units) plus a list of lot
+# refs, with a head pointer instead of per-lot objects. Consumed lots are
+# dropped by an amortized slice delete once the dead prefix outweighs the
+# live lots.
+#
+# Units are 1e-8 coin and amounts 1e-10 ZAR (fixed_point.py); signed 64-bit
+# slots hold lots worth up to about R920 million. Past that append() raises
+# OverflowError, and the callers redo the ledger in Decimal.
+#
+# With coalesce=True a new lot is merged into the newest open lot when both
+# come from the same kind of row (description with the numbers removed) at an
+# exactly equal unit cost. Costs are unchanged, since the merged lot keeps the
+# same amount/units ratio, but consumption reports the older lot's ref and
+# takes one split where it would have taken several.
+import re
+import sys
+from array import array
+
+COMPACT_MIN_DEAD = 1024
+_NUMBERS = re.compile(r'[\d.,]+')
+
+
+def lot_source(desc):
+    # 'Bought 554.00 XRP/ZAR @ 4.00' -> 'Bought # XRP/ZAR @ #'
+    return _NUMBERS.sub('#', desc)
+
+
+class LotArray:
+    __slots__ = ('units', 'amts', 'lot_units', 'refs', 'head', 'coalesce', 'merged', 'peak', '_tail_source')
+
+    def __init__(self, coalesce=False):
+        self.units = array('q')
+        self.amts = array('q')
+        self.lot_units = array('q')
+        self.refs = []
+        self.head = 0
+        self.coalesce = coalesce
+        self.merged = 0
+        self.peak = 0
+        self._tail_source = None
+
+    def __len__(self):
+        return len(self.units) - self.head
+
+    def append(self, units, amt, ref, desc=''):
+        if self.coalesce:
+            source = lot_source(desc)
+            tail = len(self.units) - 1
+            if (tail >= self.head and source == self._tail_source and units > 0 and self.lot_units[tail] > 0
+                    and amt * self.lot_units[tail] == self.amts[tail] * units):
+                self.units[tail] += units
+                self.amts[tail] += amt
+                self.lot_units[tail] += units
+                self.merged += 1
+                return
+            self._tail_source = source
+        self.units.append(units)
+        self.amts.append(amt)
+        self.lot_units.append(units)
+        self.refs.append(ref)
+        live = len(self.units) - self.head
+        if live > self.peak:
+            self.peak = live
+
+    def consume(self, remaining):
+        # FIFO-consume up to remaining units. Returns ([(ref, units, amount,
+        # lot units)], units not covered). A zero-unit head lot stops
+        # consumption, as in the scalar engines.
+        units = self.units
+        splits = []
+        head = self.head
+        end = len(units)
+        while remaining > 0 and head < end:
+            left = units[head]
+            consume = left if left <= remaining else remaining
+            if consume <= 0:
+                break
+            splits.append((self.refs[head], consume, self.amts[head], self.lot_units[head]))
+            left -= consume
+            units[head] = left
+            remaining -= consume
+            if left <= 0:
+                head += 1
+        self.head = head
+        if head >= COMPACT_MIN_DEAD and head * 2 > end:
+            self._compact()
+        return splits, remaining
+
+    def _compact(self):
+        head = self.head
+        del self.units[:head]
+        del self.amts[:head]
+        del self.lot_units[:head]
+        del self.refs[:head]
+        self.head = 0
+
+    def memory(self):
+        # Bytes held by the queue (array buffers and the ref list's slots; the
+        # ref strings themselves belong to the ledger rows)
+        arrays = sum(a.buffer_info()[1] * a.itemsize for a in (self.units, self.amts, self.lot_units))
+        return {
+            'open_lots': len(self),
+            'peak_lots': self.peak,
+            'merged_lots': self.merged,
+            'bytes': arrays + sys.getsizeof(self.refs),
+        }
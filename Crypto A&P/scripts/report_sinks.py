@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# Sinks for the FIFO engine's lot events (fifo_report.LotEvent). FYEngine
+# renders the FY reports itself; these render the other outputs from the same
+# run: the per-currency ledgers (<ccy>_fifo.csv), the Go tool's
+# inventory.csv, transfers.csv and financial_year_profit_loss.csv, and the
+# point-in-time holdings index (holdings.pickle).
+#
+# Every sink has:
+#   event(ev)           called for each lot event, in ledger order
+#   snapshot()          picklable rows added since the last snapshot plus
+#                       running state, stored with each FY checkpoint
+#   restore(snapshots)  rebuild from the snapshots of all resumed checkpoints
+#   merge(other)        fold in a worker's sink (process_fy_parallel)
+#   flush(output_dir)   write out the rows so far and drop them
+#                       (process_fy_stream, at each FY boundary)
+#   write(output_dir)   write the output file(s)
+#
+# Records are tuples in the layout of the module's *_COLUMNS list; a sink
+# given another column order writes them through a formatter compiled once
+# (row_formatter). Event numbers are read through the engine's Numbers
+# (sink.numbers, set by the engine), as the fixed-point engine's are integers.
+import csv
+import os
+from collections import defaultdict
+from decimal import Decimal
+from operator import itemgetter
+
+import holdings
+import run_metrics
+from classifier import classify
+from fifo_report import q8, s2, FIFO_COLUMNS, DECIMAL_NUMBERS
+
+LEDGER_COLUMNS = FIFO_COLUMNS
+# Same column orders as config/config.yaml's report_column_order
+INVENTORY_COLUMNS = [
+    'Financial Year', 'Coin', 'Lot Reference', 'Quantity', 'Date of Original Purchase',
+    'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Pool',
+]
+PROFIT_LOSS_COLUMNS = [
+    'Financial Year', 'Coin', 'Sale Reference', 'Lot Reference', 'Quantity Sold', 'Unit Cost (ZAR)',
+    'Total Cost (ZAR)', 'Selling Price (ZAR)', 'Proceeds (ZAR)', 'Profit/Loss (ZAR)', 'Fee Reference',
+    'Fee Amount (ZAR)',
+]
+TRANSFERS_COLUMNS = [
+    'Financial Year', 'Coin', 'Date', 'Description', 'Type', 'Qty Change', 'Value (ZAR)',
+    'Unit Cost (ZAR) / Unit Cost Value', 'Lot Reference', 'Pool',
+]
+
+LEDGER_TYPES = {'open': 'Buy', 'consume': 'Sell', 'other': 'Other'}
+# Transfer type of a fee, by the type of the trade it belongs to
+FEE_TYPES = {
+    'in_buy': 'out_fee_buy',
+    'in_buy_for_other': 'out_fee_buy_for_other',
+    'in_other': 'out_fee_in_other',
+    'out_sell': 'out_fee_sell',
+    'out_other': 'out_fee_out_other',
+}
+ZERO = Decimal('0')
+ZERO2 = s2(ZERO)
+
+
+def row_formatter(layout, columns):
+    # Maps a record in layout order to a row in columns order, or None when
+    # the two are the same; columns the layout lacks are written empty
+    if list(columns) == list(layout):
+        return None
+    index = {name: i for i, name in enumerate(layout)}
+    picks = [index.get(name) for name in columns]
+    if None in picks:
+        return lambda record: [record[i] if i is not None else '' for i in picks]
+    if len(picks) == 1:
+        i = picks[0]
+        return lambda record: (record[i],)
+    return itemgetter(*picks)
+
+
+def write_rows(path, columns, rows, layout=None, append=False):
+    # append: add to a file an earlier call started (a sink's flush)
+    formatter = None if layout is None else row_formatter(layout, columns)
+    if formatter is not None:
+        rows = map(formatter, rows)
+    with run_metrics.writing(path):
+        with open(path, 'a' if append else 'w', newline='') as f:
+            writer = csv.writer(f)
+            if not append:
+                writer.writerow(columns)
+            writer.writerows(rows)
+
+
+def ledger_names(currencies_by_file):
+    # {csv file: [currencies]} -> {currency: ledger file name}; a single
+    # currency export keeps the old <file>_fifo.csv name
+    names = {}
+    for csv_file, currencies in currencies_by_file.items():
+        base = os.path.basename(csv_file).rsplit('.', 1)[0]
+        for ccy in currencies:
+            if len(currencies) == 1:
+                names.setdefault(ccy, f"{base}_fifo.csv")
+            else:
+                names.setdefault(ccy, f"{base}_{ccy.lower()}_fifo.csv")
+    return names
+
+
+class _RowSink:
+    # Rows are kept as (ledger position, row) so worker outputs can be put
+    # back in ledger order
+    NAME = None
+    numbers = DECIMAL_NUMBERS
+
+    def __init__(self):
+        self.rows = []
+        self._saved = 0
+
+    def state(self):
+        return None
+
+    def set_state(self, state):
+        pass
+
+    def snapshot(self):
+        chunk = self.rows[self._saved:]
+        self._saved = len(self.rows)
+        return {'rows': chunk, 'state': self.state()}
+
+    def restore(self, snapshots):
+        self.rows = [row for snap in snapshots for row in snap['rows']]
+        self._saved = len(self.rows)
+        if snapshots:
+            self.set_state(snapshots[-1]['state'])
+
+    def merge(self, other):
+        self.rows.extend(other.rows)
+        self.rows.sort(key=itemgetter(0))
+
+    def flush(self, output_dir):
+        pass
+
+    def _flushed(self):
+        # Rows are written out; the checkpoint snapshots start over
+        self.rows = []
+        self._saved = 0
+
+
+class LedgerSink(_RowSink):
+    # One running FIFO ledger per currency, as fifo_report.main wrote them,
+    # but from the shared engine, so buys matched to Others are consumed by
+    # those Others here too
+    NAME = 'ledger'
+
+    def __init__(self, names=None, columns=LEDGER_COLUMNS):
+        super().__init__()
+        self.names = dict(names or {})
+        self.columns = columns
+        # ccy -> rows written by flush
+        self.written = {}
+
+    def event(self, ev):
+        row = ev.row
+        ccy = row.currency
+        num = self.numbers
+        if ev.kind == 'fee':
+            record = (ev.fy, ev.trans_id, row.timestamp, f"Fee for {ev.note}", 'Fee', '',
+                      num.qty_str(ev.qty), '', '', '', '', s2(row.value_amount), num.qty_str(ev.balance_units),
+                      num.amt_str(ev.balance_value))
+        else:
+            record = (ev.fy, ev.trans_id, row.timestamp, row.description, LEDGER_TYPES[ev.kind], ev.lot_ref,
+                      num.qty_str(ev.qty), num.amt_str(ev.unit_cost), num.amt_str(abs(ev.total_cost)),
+                      num.amt_str(ev.proceeds), num.amt_str(ev.profit), ZERO2, num.qty_str(ev.balance_units),
+                      num.amt_str(ev.balance_value))
+        self.rows.append((ev.pos, ccy, record))
+
+    def merge(self, other):
+        super().merge(other)
+        for ccy, name in other.names.items():
+            self.names.setdefault(ccy, name)
+
+    def path(self, output_dir, ccy):
+        return os.path.join(output_dir, self.names.get(ccy) or f"{ccy.lower()}_fifo.csv")
+
+    def flush(self, output_dir):
+        by_ccy = defaultdict(list)
+        for _, ccy, record in self.rows:
+            by_ccy[ccy].append(record)
+        for ccy, records in by_ccy.items():
+            write_rows(self.path(output_dir, ccy), self.columns, records, LEDGER_COLUMNS, append=ccy in self.written)
+            self.written[ccy] = self.written.get(ccy, 0) + len(records)
+        self._flushed()
+
+    def write(self, output_dir):
+        self.flush(output_dir)
+        for ccy in self.names:
+            if ccy not in self.written:
+                write_rows(self.path(output_dir, ccy), self.columns, [], LEDGER_COLUMNS)
+                self.written[ccy] = 0
+        for ccy, n in self.written.items():
+            print(f"Wrote {self.path(output_dir, ccy)} with {n} rows.")
+
+
+class InventorySink:
+    # Lots still open at the end of the run, by purchase FY, with a Total row
+    # per FY and coin (the Go tool's inventory.csv)
+    NAME = 'inventory'
+    numbers = DECIMAL_NUMBERS
+
+    def __init__(self, columns=INVENTORY_COLUMNS):
+        self.columns = columns
+        # ccy -> {lot ref: [[qty, unit cost, date, pool, fy], ...]} in open order
+        self.lots = {}
+
+    def event(self, ev):
+        if ev.kind == 'fee':
+            return
+        ccy = ev.row.currency
+        if ev.kind == 'open':
+            pool = 'in_buy_for_other' if ev.for_other else ('in_buy' if classify(ev.row.description).buy else 'in_other')
+            self.lots.setdefault(ccy, {}).setdefault(ev.lot_ref, []).append(
+                [ev.qty, ev.unit_cost, ev.row.timestamp, pool, ev.fy])
+            return
+        lots = self.lots.get(ccy, {})
+        entries = lots.get(ev.lot_ref)
+        if not entries:
+            return
+        entry = entries[0]
+        entry[0] += ev.qty
+        if entry[0] <= self.numbers.dust:
+            entries.pop(0)
+            if not entries:
+                del lots[ev.lot_ref]
+
+    def snapshot(self):
+        return {'rows': [], 'state': self.lots}
+
+    def restore(self, snapshots):
+        if snapshots:
+            self.lots = snapshots[-1]['state']
+
+    def merge(self, other):
+        self.lots.update(other.lots)
+
+    def flush(self, output_dir):
+        # Only the open lots are held
+        pass
+
+    def write(self, output_dir):
+        groups = defaultdict(list)
+        for ccy, lots in self.lots.items():
+            for ref, entries in lots.items():
+                for qty, unit_cost, date, pool, fy in entries:
+                    groups[(fy, ccy)].append((date, ref, qty, unit_cost, pool))
+        num = self.numbers
+        rows = []
+        for fy, ccy in sorted(groups):
+            label = f"FY{fy}"
+            total_qty = num.zero
+            total_cost = num.zero
+            for date, ref, qty, unit_cost, pool in sorted(groups[(fy, ccy)], key=itemgetter(0)):
+                cost = num.cost(qty, unit_cost)
+                total_qty += qty
+                total_cost += cost
+                rows.append((label, ccy, ref, num.qty_str(qty), date, num.amt_str(unit_cost), num.amt_str(cost), pool))
+            rows.append((label, ccy, 'Total', num.qty_str(total_qty), '', '', num.amt_str(total_cost), ''))
+        output_csv = os.path.join(output_dir, 'inventory.csv')
+        write_rows(output_csv, self.columns, rows, INVENTORY_COLUMNS)
+        print(f"Wrote {output_csv}")
+
+
+class TransfersSink(_RowSink):
+    # Every movement that is not a plain buy or sale: buys for others, other
+    # inflows and outflows, and fees typed by the trade they belong to (the Go
+    # tool's transfers.csv)
+    NAME = 'transfers'
+
+    def __init__(self, columns=TRANSFERS_COLUMNS):
+        super().__init__()
+        self.columns = columns
+        self._last_row = None
+        self._started = False
+
+    def event(self, ev):
+        row = ev.row
+        ccy = row.currency
+        lot_ref = ''
+        if ev.kind == 'fee':
+            # The fee event's trans ref (B_ inflow, S_ outflow) and note are
+            # its trade's
+            if ev.for_other:
+                kind = 'in_buy_for_other'
+            elif ev.trans_id.startswith('B_'):
+                kind = 'in_buy' if classify(ev.note).buy else 'in_other'
+            else:
+                kind = 'out_sell' if classify(ev.note).sell else 'out_other'
+            kind = FEE_TYPES[kind]
+            unit_cost = s2(row.value_amount)
+        elif ev.kind == 'open':
+            kind = 'in_buy_for_other' if ev.for_other else ('in_buy' if classify(row.description).buy else 'in_other')
+            if kind == 'in_buy':
+                return
+            lot_ref = ev.lot_ref
+            unit_cost = self.numbers.amt_str(ev.unit_cost)
+        else:
+            kind = 'out_sell' if ev.kind == 'consume' else 'out_other'
+            if kind == 'out_sell' or row is self._last_row:
+                return
+            self._last_row = row
+            lot_ref = ev.lot_ref if ev.for_other else ''
+            unit_cost = s2(row.value_amount)
+        self.rows.append((ev.pos, (f"FY{ev.fy}", ccy, row.timestamp, row.description, kind, q8(row.balance_delta),
+                                   s2(row.value_amount), unit_cost, lot_ref, kind)))
+
+    def flush(self, output_dir):
+        write_rows(os.path.join(output_dir, 'transfers.csv'), self.columns, [record for _, record in self.rows],
+                   TRANSFERS_COLUMNS, append=self._started)
+        self._started = True
+        self._flushed()
+
+    def write(self, output_dir):
+        self.flush(output_dir)
+        print(f"Wrote {os.path.join(output_dir, 'transfers.csv')}")
+
+
+class ProfitLossSink(_RowSink):
+    # One row per sale split and per fee, then per FY the Combined, Losses
+    # Total and Profits Total lines (the Go tool's
+    # financial_year_profit_loss.csv)
+    NAME = 'profit_loss'
+
+    def __init__(self, columns=PROFIT_LOSS_COLUMNS):
+        super().__init__()
+        self.columns = columns
+        # fy -> {'Combined' | 'Losses Total' | 'Profits Total': [sales, cost,
+        # proceeds, profit]} of the sales flushed so far
+        self.totals = {}
+        self._started = False
+
+    def event(self, ev):
+        row = ev.row
+        if ev.kind == 'consume':
+            self.rows.append((ev.pos, (ev.fy, row.currency, ev.trans_id, row.reference, ev.lot_ref, -ev.qty,
+                                       ev.unit_cost, ev.total_cost, row.value_amount.copy_abs() / row.balance_delta.copy_abs(),
+                                       ev.proceeds, ev.profit)))
+        elif ev.kind == 'fee':
+            self.rows.append((ev.pos, (ev.fy, row.currency, None, row.reference, '', abs(ev.qty), ZERO, ZERO, ZERO, ZERO,
+                                       row.value_amount.copy_abs())))
+
+    def flush(self, output_dir):
+        num = self.numbers
+        rows = []
+        # (fy, ccy, trans id) -> [cost, proceeds, profit]; a sale's splits all
+        # come from one engine step, so its totals are final by any flush
+        sales = {}
+        for _, (fy, ccy, trans_id, ref, lot_ref, qty, unit_cost, cost, price, proceeds, amount) in self.rows:
+            label = f"FY{fy}"
+            if trans_id is None:
+                rows.append((fy, (label, ccy, '', '', num.qty_str(qty), ZERO2, ZERO2, ZERO2, ZERO2, ZERO2, ref, s2(amount))))
+                continue
+            totals = sales.setdefault((fy, ccy, trans_id), [num.zero, num.zero, num.zero])
+            totals[0] += cost
+            totals[1] += proceeds
+            totals[2] += amount
+            rows.append((fy, (label, ccy, ref, lot_ref, num.qty_str(qty), num.amt_str(unit_cost), num.amt_str(cost),
+                              s2(price), num.amt_str(proceeds), num.amt_str(amount), '', ZERO2)))
+        rows.sort(key=itemgetter(0))
+        write_rows(os.path.join(output_dir, 'financial_year_profit_loss.csv'), self.columns,
+                   [record for _, record in rows], PROFIT_LOSS_COLUMNS, append=self._started)
+        self._started = True
+        for (fy, _, _), totals in sales.items():
+            groups = self.totals.setdefault(fy, {})
+            for name in ('Combined', 'Losses Total' if totals[2] < 0 else 'Profits Total'):
+                group = groups.setdefault(name, [0, num.zero, num.zero, num.zero])
+                group[0] += 1
+                for j, total in enumerate(totals, 1):
+                    group[j] += total
+        self._flushed()
+
+    def write(self, output_dir):
+        self.flush(output_dir)
+        num = self.numbers
+        records = []
+        for fy in sorted(self.totals):
+            for name in ('Combined', 'Losses Total', 'Profits Total'):
+                if name in self.totals[fy]:
+                    n, cost, proceeds, profit = self.totals[fy][name]
+                    records.append((f"FY{fy}", '', name, '', n, ZERO2, num.amt_str(cost), ZERO2, num.amt_str(proceeds),
+                                    num.amt_str(profit), '', ZERO2))
+        output_csv = os.path.join(output_dir, 'financial_year_profit_loss.csv')
+        write_rows(output_csv, self.columns, records, PROFIT_LOSS_COLUMNS, append=True)
+        print(f"Wrote {output_csv}")
+
+
+class HoldingsSink(_RowSink):
+    # Every lot movement and fee with its running balance, indexed by
+    # holdings.HoldingsWriter for point-in-time queries (holdings.py)
+    NAME = 'holdings'
+    KINDS = {'open': holdings.OPEN, 'consume': holdings.TAKE, 'other': holdings.TAKE, 'fee': holdings.BALANCE}
+
+    def __init__(self):
+        super().__init__()
+        self._writer = None
+
+    def event(self, ev):
+        row = ev.row
+        kind = holdings.BALANCE if ev.lot_ref == 'N/A' else self.KINDS[ev.kind]
+        self.rows.append((ev.pos, row.currency, (row.timestamp, kind, ev.lot_ref, ev.qty, ev.unit_cost, ev.balance_units,
+                                                 ev.balance_value)))
+
+    def flush(self, output_dir):
+        # holdings.py works in Decimals
+        qty, amt = self.numbers.qty_decimal, self.numbers.amt_decimal
+        by_ccy = defaultdict(list)
+        for _, ccy, (ts, kind, ref, units, unit_cost, balance_units, balance_value) in self.rows:
+            by_ccy[ccy].append((ts, kind, ref, qty(units), amt(unit_cost), qty(balance_units), amt(balance_value)))
+        if self._writer is None:
+            self._writer = holdings.HoldingsWriter(os.path.join(output_dir, holdings.HOLDINGS_FILE))
+        for ccy, events in by_ccy.items():
+            self._writer.add(ccy, events)
+        self._flushed()
+
+    def write(self, output_dir):
+        self.flush(output_dir)
+        self._writer.close()
+        self._writer = None
+        print(f"Wrote {os.path.join(output_dir, holdings.HOLDINGS_FILE)}")
+
+
+def default_sinks(names=None, columns=None):
+    # columns: {'fifo' | 'inventory' | 'transfers' | 'profit_loss': column
+    # order}, as in config/config.yaml's report_column_order
+    columns = columns or {}
+    return [LedgerSink(names, columns.get('fifo') or LEDGER_COLUMNS),
+            InventorySink(columns.get('inventory') or INVENTORY_COLUMNS),
+            TransfersSink(columns.get('transfers') or TRANSFERS_COLUMNS),
+            ProfitLossSink(columns.get('profit_loss') or PROFIT_LOSS_COLUMNS), HoldingsSink()]
+
+
+def write_sinks(sinks, output_dir):
+    for sink in sinks:
+        sink.write(output_dir)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# Content-addressed store for the report folders. Every file a run writes
+# becomes a hardlink to one object per distinct content, so identical reports
+# across runs take the disk space of one copy. The store also keeps an index of
+# runs, so the latest run (or any named one) is found without listing reports/:
+#
+#   reports/.store/objects/ab/<sha256>  one copy of each distinct file
+#   reports/.store/runs/<run>.json      a run's input and output file digests
+#   reports/.store/index.jsonl          the same, one line per run, appended
+#   reports/.store/LATEST               name of the last run committed
+#
+#   python report_store.py latest       # folder of the latest run
+#   python report_store.py show RUN     # digests of one run
+#   python report_store.py import       # add (and deduplicate) older runs
+#   python report_store.py gc           # drop objects no run folder uses
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+
+from ledger import file_digest
+
+STORE_DIR = '.store'
+
+
+def store_dir(reports_dir):
+    return os.path.join(reports_dir, STORE_DIR)
+
+
+def _object_path(store, digest):
+    return os.path.join(store, 'objects', digest[:2], digest)
+
+
+def _write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def detach(path):
+    # A file about to be rewritten in place must not be a link to an object
+    # (or to an older run); unlinking it leaves them untouched
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def put(store, path, digest=None):
+    # Adds the content of path to the store and makes path a link to that
+    # object; returns the digest. Where hardlinks are not supported the object
+    # is a copy and path is left alone.
+    digest = digest or file_digest(path)
+    obj = _object_path(store, digest)
+    if not os.path.exists(obj):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            os.link(path, obj)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copy2(path, obj)
+        else:
+            return digest
+    if not os.path.samefile(obj, path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            return digest
+        os.replace(tmp, path)
+    return digest
+
+
+def commit_run(output_dir, inputs=None, digests=None, latest=True):
+    # Stores every file of a finished run folder and indexes the run.
+    # inputs: {input file: sha256}; digests: {file name: sha256} already known
+    # for files of this folder (the stage manifests'), to save hashing them
+    reports_dir, run = os.path.split(os.path.abspath(output_dir))
+    store = store_dir(reports_dir)
+    digests = digests or {}
+    files = {}
+    for entry in sorted(os.scandir(output_dir), key=lambda e: e.name):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            files[entry.name] = put(store, entry.path, digests.get(entry.name))
+    record = {'run': run, 'created': datetime.now().isoformat(timespec='seconds'), 'inputs': inputs or {},
+              'files': files}
+    line = json.dumps(record, sort_keys=True)
+    _write_file(os.path.join(store, 'runs', f"{run}.json"), line)
+    with open(os.path.join(store, 'index.jsonl'), 'a') as f:
+        f.write(line + '\n')
+    if latest:
+        _write_file(os.path.join(store, 'LATEST'), run)
+    return record
+
+
+def load_run(reports_dir, run):
+    try:
+        with open(os.path.join(store_dir(reports_dir), 'runs', f"{run}.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def latest_run(reports_dir):
+    # Folder of the last committed run, or None if there is none (or it has
+    # been deleted since)
+    try:
+        with open(os.path.join(store_dir(reports_dir), 'LATEST'), 'r') as f:
+            run = f.read().strip()
+    except OSError:
+        return None
+    run_dir = os.path.join(reports_dir, run)
+    return run_dir if run and os.path.isdir(run_dir) else None
+
+
+def run_folders(reports_dir):
+    return sorted(d for d in os.listdir(reports_dir)
+                  if not d.startswith('.') and os.path.isdir(os.path.join(reports_dir, d)))
+
+
+def import_runs(reports_dir):
+    # Commits run folders from before the store, oldest first; LATEST is only
+    # set if no run has been committed yet
+    had_latest = latest_run(reports_dir) is not None
+    imported = [run for run in run_folders(reports_dir) if load_run(reports_dir, run) is None]
+    for run in imported:
+        commit_run(os.path.join(reports_dir, run), latest=False)
+    if imported and not had_latest:
+        _write_file(os.path.join(store_dir(reports_dir), 'LATEST'), run_folders(reports_dir)[-1])
+    return imported
+
+
+def gc(reports_dir):
+    # Drops the records of deleted run folders and the objects that no
+    # remaining run uses; returns (records dropped, objects removed)
+    store = store_dir(reports_dir)
+    runs_dir = os.path.join(store, 'runs')
+    used = set()
+    dropped = 0
+    for name in os.listdir(runs_dir) if os.path.isdir(runs_dir) else ():
+        run = name[:-len('.json')]
+        if not os.path.isdir(os.path.join(reports_dir, run)):
+            os.unlink(os.path.join(runs_dir, name))
+            dropped += 1
+            continue
+        record = load_run(reports_dir, run)
+        if record is not None:
+            used.update(record['files'].values())
+    removed = 0
+    objects_dir = os.path.join(store, 'objects')
+    for prefix in os.listdir(objects_dir) if os.path.isdir(objects_dir) else ():
+        for digest in os.listdir(os.path.join(objects_dir, prefix)):
+            if digest not in used:
+                os.unlink(os.path.join(objects_dir, prefix, digest))
+                removed += 1
+    return dropped, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed report store.')
+    parser.add_argument('--reports', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reports'))
+    parser.add_argument('command', choices=['latest', 'show', 'import', 'gc'])
+    parser.add_argument('run', nargs='?')
+    args = parser.parse_args()
+    reports_dir = os.path.abspath(args.reports)
+
+    if args.command == 'latest':
+        run_dir = latest_run(reports_dir)
+        if run_dir is None:
+            raise SystemExit(f"no runs in the store at {store_dir(reports_dir)}")
+        print(run_dir)
+    elif args.command == 'show':
+        run = args.run or os.path.basename(latest_run(reports_dir) or '')
+        record = load_run(reports_dir, run)
+        if record is None:
+            raise SystemExit(f"run {run!r} is not in the store")
+        print(json.dumps(record, indent=2))
+    elif args.command == 'import':
+        imported = import_runs(reports_dir)
+        print(f"Imported {len(imported)} runs into {store_dir(reports_dir)}")
+    else:
+        dropped, removed = gc(reports_dir)
+        print(f"Dropped {dropped} deleted runs and {removed} unused objects")
+
+
+if __name__ == '__main__':
+    main()
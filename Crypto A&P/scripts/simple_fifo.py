@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import csv
+import sys
 from decimal import Decimal, getcontext, ROUND_HALF_UP
-from datetime import datetime
 from collections import deque
 
+from ledger import load_file
+from classifier import classify
+from fixed_point import to_units, to_amt, unit_cost, fmt_qty, fmt_amt
+import vector_fifo
+from lot_array import LotArray
+
 getcontext().prec = 28
 
 class Lot:
@@ -14,14 +20,6 @@ class Lot:
         self.ref = ref
         self.date = date
 
-def dec(x):
-    if isinstance(x, Decimal):
-        return x
-    s = str(x).strip()
-    if s == '':
-        return Decimal('0')
-    return Decimal(s)
-
 def q8(x: Decimal) -> str:
     return f"{x.quantize(Decimal('0.00000001'), rounding=ROUND_HALF_UP)}"
 
@@ -34,44 +32,30 @@ def s2(x: Decimal) -> str:
 def financial_year(dt):
     return dt.year + 1 if dt.month >= 3 else dt.year
 
-def main():
-    input_file = '../data/xbt.csv'
-    output_file = 'simple_fifo_xbt.csv'
-    
-    rows = []
-    with open(input_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            row['Balance delta'] = dec(row['Balance delta'])
-            row['Value amount'] = dec(row['Value amount'])
-            row['_dt'] = datetime.strptime(row['Timestamp (UTC)'], '%Y-%m-%d %H:%M:%S')
-            rows.append(row)
-    
-    rows.sort(key=lambda r: r['_dt'])
-    
+def build_rows(rows):
     lots = deque()
     
     output_rows = []
     trans_count = {'buy': 0, 'sell': 0, 'other': 0, 'fee': 0}
     
     for row in rows:
-        dt = row['_dt']
+        dt = row.dt
         fy = financial_year(dt)
-        qty_delta = row['Balance delta']
-        desc = row['Description']
-        ref = row['Reference']
-        value_amount = row['Value amount']
+        qty_delta = row.balance_delta
+        desc = row.description
+        ref = row.reference
+        value_amount = row.value_amount
         
         if qty_delta == 0:
             continue
         
-        if 'fee' in desc.lower():
+        if classify(desc).fee:
             trans_count['fee'] += 1
             fee_id = f'F_{trans_count["fee"]:03d}'
             output_rows.append({
                 'FY': fy,
                 'Trans Ref': fee_id,
-                'Date': row['Timestamp (UTC)'],
+                'Date': row.timestamp,
                 'Description': desc,
                 'Type': 'Fee',
                 'Lot Ref': '',
@@ -90,13 +74,13 @@ def main():
             unit_cost = value_amount / qty if qty != 0 else Decimal('0')
             total_cost = qty * unit_cost
             
-            lot = Lot(qty=qty, unit_cost=unit_cost, ref=ref, date=row['Timestamp (UTC)'])
+            lot = Lot(qty=qty, unit_cost=unit_cost, ref=ref, date=row.timestamp)
             lots.append(lot)
             
             output_rows.append({
                 'FY': fy,
                 'Trans Ref': trans_id,
-                'Date': row['Timestamp (UTC)'],
+                'Date': row.timestamp,
                 'Description': desc,
                 'Type': 'Buy',
                 'Lot Ref': ref,
@@ -110,7 +94,7 @@ def main():
             sell_qty = -qty_delta
             proceeds_total = value_amount
             
-            if desc.startswith('Sold'):
+            if classify(desc).sell:
                 trans_count['sell'] += 1
                 trans_id = f'S_{trans_count["sell"]:03d}'
                 trans_type = 'Sell'
@@ -143,7 +127,7 @@ def main():
                 output_rows.append({
                     'FY': fy,
                     'Trans Ref': trans_id,
-                    'Date': row['Timestamp (UTC)'],
+                    'Date': row.timestamp,
                     'Description': desc,
                     'Type': trans_type,
                     'Lot Ref': lot.ref,
@@ -170,7 +154,7 @@ def main():
                 output_rows.append({
                     'FY': fy,
                     'Trans Ref': trans_id,
-                    'Date': row['Timestamp (UTC)'],
+                    'Date': row.timestamp,
                     'Description': desc,
                     'Type': trans_type,
                     'Lot Ref': 'N/A',
@@ -181,6 +165,225 @@ def main():
                     'Profit': s2(profit),
                 })
     
+    return output_rows, len(lots)
+
+def build_rows_fixed(rows, coalesce=False):
+    # Same rows as build_rows on fixed-point integers (see fixed_point.py);
+    # coalesce merges same-cost dust lots (see lot_array.py)
+    lots = LotArray(coalesce)
+    
+    output_rows = []
+    trans_count = {'buy': 0, 'sell': 0, 'other': 0, 'fee': 0}
+    zero = fmt_amt(0)
+    
+    for row in rows:
+        qty_delta = row.balance_delta
+        if qty_delta == 0:
+            continue
+        fy = financial_year(row.dt)
+        desc = row.description
+        units = to_units(qty_delta)
+        
+        if classify(desc).fee:
+            trans_count['fee'] += 1
+            output_rows.append({
+                'FY': fy,
+                'Trans Ref': f'F_{trans_count["fee"]:03d}',
+                'Date': row.timestamp,
+                'Description': desc,
+                'Type': 'Fee',
+                'Lot Ref': '',
+                'Qty Change': fmt_qty(units),
+                'Unit Cost': '',
+                'Total Cost': '',
+                'Proceeds': '',
+                'Profit': '',
+            })
+            continue
+        
+        value_amount = to_amt(row.value_amount)
+        if units > 0:
+            trans_count['buy'] += 1
+            lots.append(units, value_amount, row.reference, desc)
+            output_rows.append({
+                'FY': fy,
+                'Trans Ref': f'B_{trans_count["buy"]:03d}',
+                'Date': row.timestamp,
+                'Description': desc,
+                'Type': 'Buy',
+                'Lot Ref': row.reference,
+                'Qty Change': fmt_qty(units),
+                'Unit Cost': fmt_amt(unit_cost(value_amount, units)),
+                'Total Cost': fmt_amt(value_amount),
+                'Proceeds': zero,
+                'Profit': zero,
+            })
+            continue
+        
+        if classify(desc).sell:
+            trans_count['sell'] += 1
+            trans_id = f'S_{trans_count["sell"]:03d}'
+            trans_type = 'Sell'
+        else:
+            trans_count['other'] += 1
+            trans_id = f'O_{trans_count["other"]:03d}'
+            trans_type = 'Other'
+        
+        sell_qty = -units
+        pieces, remaining = lots.consume(sell_qty)
+        splits = [(lot_ref, consume, unit_cost(lot_amt, lot_units), consume * lot_amt // lot_units)
+                  for lot_ref, consume, lot_amt, lot_units in pieces]
+        if remaining > 0:
+            splits.append(('N/A', remaining, 0, 0))
+        
+        for lot_ref, consume, uc, total_cost in splits:
+            if trans_type == 'Sell':
+                split_proceeds = value_amount * consume // sell_qty
+                profit = split_proceeds - total_cost
+            else:
+                split_proceeds = 0
+                profit = 0
+            output_rows.append({
+                'FY': fy,
+                'Trans Ref': trans_id,
+                'Date': row.timestamp,
+                'Description': desc,
+                'Type': trans_type,
+                'Lot Ref': lot_ref,
+                'Qty Change': fmt_qty(-consume),
+                'Unit Cost': fmt_amt(uc),
+                'Total Cost': fmt_amt(abs(total_cost)),
+                'Proceeds': fmt_amt(split_proceeds),
+                'Profit': fmt_amt(profit),
+            })
+    
+    return output_rows, len(lots)
+
+def build_rows_vector(rows):
+    # Same rows as build_rows_fixed with the consume loop done by
+    # vector_fifo.fifo_splits (NumPy)
+    events = []
+    lot_units, lot_amts, lot_rows = [], [], []
+    out_units, out_amts, out_rows = [], [], []
+    for row in rows:
+        if row.balance_delta == 0:
+            continue
+        units = to_units(row.balance_delta)
+        amt = to_amt(row.value_amount)
+        is_fee = classify(row.description).fee
+        if not is_fee:
+            if units > 0:
+                lot_units.append(units)
+                lot_amts.append(amt)
+                lot_rows.append(len(events))
+            else:
+                out_units.append(-units)
+                out_amts.append(amt)
+                out_rows.append(len(events))
+        events.append((row, units, amt, is_fee))
+    splits = vector_fifo.fifo_splits(lot_units, lot_amts, lot_rows, out_units, out_amts, out_rows)
+    lot_refs = [events[i][0].reference for i in lot_rows]
+    
+    output_rows = []
+    trans_count = {'buy': 0, 'sell': 0, 'other': 0, 'fee': 0}
+    zero = fmt_amt(0)
+    k = 0
+    
+    for row, units, value_amount, is_fee in events:
+        fy = financial_year(row.dt)
+        desc = row.description
+        
+        if is_fee:
+            trans_count['fee'] += 1
+            output_rows.append({
+                'FY': fy,
+                'Trans Ref': f'F_{trans_count["fee"]:03d}',
+                'Date': row.timestamp,
+                'Description': desc,
+                'Type': 'Fee',
+                'Lot Ref': '',
+                'Qty Change': fmt_qty(units),
+                'Unit Cost': '',
+                'Total Cost': '',
+                'Proceeds': '',
+                'Profit': '',
+            })
+            continue
+        
+        if units > 0:
+            trans_count['buy'] += 1
+            output_rows.append({
+                'FY': fy,
+                'Trans Ref': f'B_{trans_count["buy"]:03d}',
+                'Date': row.timestamp,
+                'Description': desc,
+                'Type': 'Buy',
+                'Lot Ref': row.reference,
+                'Qty Change': fmt_qty(units),
+                'Unit Cost': fmt_amt(unit_cost(value_amount, units)),
+                'Total Cost': fmt_amt(value_amount),
+                'Proceeds': zero,
+                'Profit': zero,
+            })
+            continue
+        
+        if classify(desc).sell:
+            trans_count['sell'] += 1
+            trans_id = f'S_{trans_count["sell"]:03d}'
+            trans_type = 'Sell'
+        else:
+            trans_count['other'] += 1
+            trans_id = f'O_{trans_count["other"]:03d}'
+            trans_type = 'Other'
+        
+        pieces = []
+        for j in range(splits.start[k], splits.start[k + 1]):
+            lot = splits.lot[j]
+            pieces.append((lot_refs[lot], splits.units[j], unit_cost(lot_amts[lot], lot_units[lot]),
+                           splits.cost[j], splits.proceeds[j]))
+        if splits.short_units[k]:
+            pieces.append(('N/A', splits.short_units[k], 0, 0, splits.short_proceeds[k]))
+        k += 1
+        
+        for lot_ref, consume, uc, total_cost, split_proceeds in pieces:
+            if trans_type == 'Sell':
+                profit = split_proceeds - total_cost
+            else:
+                split_proceeds = 0
+                profit = 0
+            output_rows.append({
+                'FY': fy,
+                'Trans Ref': trans_id,
+                'Date': row.timestamp,
+                'Description': desc,
+                'Type': trans_type,
+                'Lot Ref': lot_ref,
+                'Qty Change': fmt_qty(-consume),
+                'Unit Cost': fmt_amt(uc),
+                'Total Cost': fmt_amt(abs(total_cost)),
+                'Proceeds': fmt_amt(split_proceeds),
+                'Profit': fmt_amt(profit),
+            })
+    
+    return output_rows, splits.open_lots
+
+def main(fixed=False, vector=False, coalesce=False):
+    input_file = '../data/xbt.csv'
+    output_file = 'simple_fifo_xbt.csv'
+    
+    rows = load_file(input_file)
+    if vector and vector_fifo.available() and not coalesce:
+        output_rows, open_lots = build_rows_vector(rows)
+    elif fixed or vector or coalesce:
+        try:
+            output_rows, open_lots = build_rows_fixed(rows, coalesce)
+        except OverflowError:
+            # A lot past LotArray's 64-bit range (see lot_array.py)
+            print("Lot too large for the fixed-point queue; using Decimal")
+            output_rows, open_lots = build_rows(rows)
+    else:
+        output_rows, open_lots = build_rows(rows)
+    
     fieldnames = ['FY', 'Trans Ref', 'Date', 'Description', 'Type', 'Lot Ref', 'Qty Change', 'Unit Cost', 'Total Cost', 'Proceeds', 'Profit']
     with open(output_file, 'w', newline='') as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
@@ -189,7 +392,7 @@ def main():
             writer.writerow(orow)
     
     print(f"Wrote {output_file} with {len(output_rows)} rows")
-    print(f"Remaining lots: {len(lots)}")
+    print(f"Remaining lots: {open_lots}")
 
 if __name__ == '__main__':
-    main()
+    main(fixed='--fixed' in sys.argv, vector='--vector' in sys.argv, coalesce='--coalesce-dust' in sys.argv)
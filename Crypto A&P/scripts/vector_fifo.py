@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# NumPy FIFO matcher for a single currency. Lots and outflows are laid out on
+# one quantity line (fixed-point base units, see fixed_point.py): lot i covers
+# [L[i-1], L[i]) of cumulative bought units and outflow k takes
+# [C[k-1], C[k]) of cumulative consumed units, so every (outflow, lot) split
+# falls out of two searchsorted calls instead of a per-row consume loop.
+#
+# NumPy is optional: callers check `available()` and fall back to the scalar
+# engines when it is missing.
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Per-outflow split ranges plus per-split values, all plain Python lists:
+#   start[k]:start[k+1]  splits of outflow k, in FIFO lot order
+#   lot, units, cost, proceeds  per split (lot = index into the inflows)
+#   short_units, short_proceeds  per outflow, the part no lot covered ('N/A')
+#   open_lots  lots not fully consumed at the end
+Splits = namedtuple('Splits', ['start', 'lot', 'units', 'cost', 'proceeds', 'short_units', 'short_proceeds', 'open_lots'])
+
+
+def available():
+    return np is not None
+
+
+def fifo_splits(lot_units, lot_amts, lot_rows, out_units, out_amts, out_rows, block_on_empty=False):
+    # lot_units/out_units: positive base units; *_amts: sub-cent ints (may
+    # exceed int64, so costs are done on object arrays); *_rows: ledger
+    # positions, used to tell which lots exist before each outflow.
+    # block_on_empty reproduces fifo_report's zero-qty 'N/A' head lot: once an
+    # outflow finds the queue empty, nothing is consumed from then on.
+    lot_units = np.asarray(lot_units, dtype=np.int64)
+    out_units = np.asarray(out_units, dtype=np.int64)
+    n_out = len(out_units)
+
+    L = np.cumsum(lot_units)
+    bought = np.concatenate(([0], L))[np.searchsorted(np.asarray(lot_rows, dtype=np.int64), np.asarray(out_rows, dtype=np.int64))]
+    # Consumed after outflow k is min(C[k-1] + q[k], bought[k]); unrolled that
+    # is the cumulative demand plus the running minimum of its shortfall
+    demand = np.cumsum(out_units)
+    consumed = demand + np.minimum.accumulate(np.minimum(bought - demand, 0))
+    before = np.concatenate(([0], consumed))[:-1]
+    if block_on_empty and n_out:
+        empty = np.flatnonzero(before == bought)
+        if len(empty):
+            k = empty[0]
+            consumed[k:] = before[k]
+            before[k:] = before[k]
+    taken = consumed - before
+
+    first = np.searchsorted(L, before, side='right')
+    last = np.searchsorted(L, consumed - 1, side='right')
+    count = np.where(taken > 0, last - first + 1, 0)
+    start = np.concatenate(([0], np.cumsum(count)))
+    split_out = np.repeat(np.arange(n_out), count)
+    split_lot = np.repeat(first, count) + (np.arange(start[-1]) - np.repeat(start[:-1], count))
+    lot_end = L[split_lot]
+    split_units = np.minimum(lot_end, consumed[split_out]) - np.maximum(lot_end - lot_units[split_lot], before[split_out])
+
+    amts = np.asarray(lot_amts, dtype=object)
+    units_obj = split_units.astype(object)
+    split_cost = units_obj * amts[split_lot] // lot_units[split_lot].astype(object)
+    out_amts = np.asarray(out_amts, dtype=object)
+    out_total = out_units.astype(object)
+    split_proceeds = out_amts[split_out] * units_obj // out_total[split_out]
+    short = out_units - taken
+    short_proceeds = out_amts * short.astype(object) // out_total
+
+    open_lots = len(L) - int(np.searchsorted(L, consumed[-1], side='right')) if n_out else len(L)
+    return Splits(start.tolist(), split_lot.tolist(), split_units.tolist(), split_cost.tolist(),
+                  split_proceeds.tolist(), short.tolist(), short_proceeds.tolist(), open_lots)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Scaling benchmark for the report stages on synthetic ledgers (see
+# synth_ledger.py). Each stage runs in a fresh interpreter so its peak RSS is
+# its own; results go to ../benchmarks/<date>_<commit>.json.
+#
+#   python benchmark.py [--sizes 10k,100k,1M,10M] [--stages a,b] [--seed N]
+#       [--out FILE] [--work-dir DIR] [--keep] [--compare OLD.json]
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import synth_ledger
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(SCRIPTS_DIR, '..'))
+
+DEFAULT_SIZES = '10k,100k,1M,10M'
+# In run order: later stages read what earlier ones wrote (ledger cache,
+# buys_for_others.json, FY reports)
+STAGES = [
+    'ledger_parse',
+    'identify_buys_for_others',
+    'fifo_report.main',
+    'process_fy',
+    'process_fy_stream',
+    'overview_report',
+]
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {'k': 10 ** 3, 'm': 10 ** 6}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_stage(stage, work_dir):
+    # Runs in the child; cwd is <work_dir>/scripts so the scripts' own
+    # ../data and ../reports paths resolve into the work dir
+    import fifo_report
+    import identify_buys_for_others
+    import overview_report
+    from ledger import load_file
+
+    data_dir = os.path.join(work_dir, 'data')
+    output_dir = os.path.join(work_dir, 'reports', 'bench')
+    os.makedirs(output_dir, exist_ok=True)
+    csv_files = sorted(glob.glob(os.path.join(data_dir, '*.csv')))
+    mapping_file = os.path.join(data_dir, 'buys_for_others.json')
+    mapping = {}
+    if os.path.exists(mapping_file):
+        with open(mapping_file) as f:
+            mapping = json.load(f)
+    base_rss = _peak_rss_kb()
+
+    start = time.perf_counter()
+    if stage == 'ledger_parse':
+        for csv_file in csv_files:
+            load_file(csv_file)
+    elif stage == 'identify_buys_for_others':
+        identify_buys_for_others.main()
+    elif stage == 'fifo_report.main':
+        for csv_file in csv_files:
+            base = os.path.basename(csv_file).rsplit('.', 1)[0]
+            fifo_report.main(csv_file, os.path.join(output_dir, f"{base}_fifo.csv"))
+    elif stage == 'process_fy':
+        fifo_report.process_fy(csv_files, output_dir, 'bench', checkpoint_file=None, buys_for_others_mapping=mapping)
+    elif stage == 'process_fy_stream':
+        for _ in fifo_report.process_fy_stream(csv_files, output_dir, buys_for_others_mapping=mapping):
+            pass
+    elif stage == 'overview_report':
+        overview_report.main()
+    else:
+        raise SystemExit(f"unknown stage {stage!r}")
+    seconds = time.perf_counter() - start
+
+    return {'seconds': round(seconds, 4), 'base_rss_kb': base_rss, 'peak_rss_kb': _peak_rss_kb()}
+
+
+def _child(stage, work_dir):
+    env = dict(os.environ, LEDGER_CACHE_DIR=os.path.join(work_dir, '.cache', 'ledger'))
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (SCRIPTS_DIR, env.get('PYTHONPATH')) if p)
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-stage', stage, work_dir],
+        cwd=os.path.join(work_dir, 'scripts'), env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return {'error': (proc.stderr.strip().splitlines() or [f"exit {proc.returncode}"])[-1],
+                'returncode': proc.returncode}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=SCRIPTS_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def benchmark(sizes, stages, seed=0, work_root=None, keep=False):
+    results = []
+    for rows in sizes:
+        work_dir = tempfile.mkdtemp(prefix=f'fifo_bench_{rows}_', dir=work_root)
+        os.makedirs(os.path.join(work_dir, 'scripts'))
+        os.makedirs(os.path.join(work_dir, 'reports'))
+        start = time.perf_counter()
+        written = synth_ledger.generate(os.path.join(work_dir, 'data'), rows, seed=seed)
+        actual = sum(written.values())
+        print(f"{rows:>10,} rows: generated {actual:,} in {time.perf_counter() - start:.1f}s ({work_dir})")
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            result = _child(stage, work_dir)
+            result.update({'rows': actual, 'target_rows': rows, 'stage': stage})
+            if 'seconds' in result:
+                result['rows_per_sec'] = round(actual / result['seconds']) if result['seconds'] else None
+                print(f"{'':>12}{stage:<26}{result['seconds']:>10.2f}s {result['rows_per_sec'] or 0:>12,} rows/s"
+                      f" {result['peak_rss_kb'] / 1024:>9.1f} MiB peak")
+            else:
+                print(f"{'':>12}{stage:<26} FAILED: {result['error']}")
+            results.append(result)
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(old_file, results):
+    with open(old_file) as f:
+        old = {(r['target_rows'], r['stage']): r for r in json.load(f)['results']}
+    print(f"\nCompared with {old_file} (new / old):")
+    for r in results:
+        prev = old.get((r['target_rows'], r['stage']))
+        if not prev or 'seconds' not in prev or 'seconds' not in r:
+            continue
+        print(f"{r['target_rows']:>10,} {r['stage']:<26} time x{r['seconds'] / prev['seconds']:.2f}"
+              f"   peak RSS x{r['peak_rss_kb'] / prev['peak_rss_kb']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each report stage on synthetic ledgers.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    parser.add_argument('--work-dir', help='where the synthetic ledgers are written (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated ledgers and reports')
+    parser.add_argument('--compare', help='earlier results JSON to print ratios against')
+    parser.add_argument('--run-stage', nargs=2, metavar=('STAGE', 'WORK_DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        result = run_stage(*args.run_stage)
+        print(json.dumps(result))
+        return
+
+    stages = args.stages.split(',')
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"unknown stage(s) {', '.join(unknown)}; expected {', '.join(STAGES)}")
+
+    commit = _git('rev-parse', '--short', 'HEAD') or 'unknown'
+    started = datetime.now()
+    results = benchmark([parse_size(s) for s in args.sizes.split(',')], stages, args.seed, args.work_dir, args.keep)
+    report = {
+        'commit': commit,
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'started': started.isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    out = args.out or os.path.join(ROOT_DIR, 'benchmarks', f"{started.strftime('%Y_%m_%d_%H%M')}_{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Description classifier shared by every script. The rules in
+# classifier_rules.json are compiled into one regex of optional lookaheads, one
+# named group per rule, so a single match answers every rule at once:
+#
+#   {"name": "fee", "contains": ["fee"], "ignore_case": true}
+#   {"name": "buy", "prefix": ["Bought"]}
+#
+# classify(desc) returns a namedtuple of booleans, one field per rule name.
+# Results are memoized per description and, because no rule looks at digits,
+# per description shape ('Bought # XRP/ZAR @ #'), so a trade with new amounts
+# still costs only a dict hit once its shape has been seen.
+import json
+import os
+import re
+from collections import namedtuple
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classifier_rules.json')
+
+# Used when classifier_rules.json is missing; the scripts' historical tests
+DEFAULT_RULES = [
+    {'name': 'fee', 'contains': ['fee'], 'ignore_case': True},
+    {'name': 'buy', 'prefix': ['Bought']},
+    {'name': 'sell', 'prefix': ['Sold']},
+    {'name': 'receive', 'contains': ['Received']},
+]
+
+# Exact descriptions kept before the cache is cleared; shapes are few and kept
+MAX_CACHED = 1 << 16
+_NUMBERS = re.compile(r'[\d.,]+')
+
+
+def load_rules(rules_file=RULES_FILE):
+    if rules_file and os.path.exists(rules_file):
+        with open(rules_file) as f:
+            return json.load(f)['rules']
+    return DEFAULT_RULES
+
+
+def compile_rules(rules):
+    parts = []
+    for rule in rules:
+        alternatives = [re.escape(p) for p in rule.get('prefix', [])]
+        alternatives += ['.*?' + re.escape(p) for p in rule.get('contains', [])]
+        if not alternatives:
+            raise ValueError(f"classifier rule {rule['name']!r} has no prefix or contains patterns")
+        body = '|'.join(alternatives)
+        if rule.get('ignore_case'):
+            body = f"(?i:{body})"
+        parts.append(f"(?:(?=(?P<{rule['name']}>{body})))?")
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+class Classifier:
+    def __init__(self, rules=None):
+        rules = load_rules() if rules is None else rules
+        self.Flags = namedtuple('Flags', [rule['name'] for rule in rules])
+        self._match = compile_rules(rules).match
+        patterns = [p for rule in rules for p in rule.get('prefix', []) + rule.get('contains', [])]
+        # Shapes are only a safe cache key while no pattern has digits, dots or commas
+        self._by_shape = not any(_NUMBERS.search(p) for p in patterns)
+        self._cache = {}
+        self._shapes = {}
+
+    def classify(self, desc):
+        flags = self._cache.get(desc)
+        if flags is not None:
+            return flags
+        if self._by_shape:
+            shape = _NUMBERS.sub('#', desc)
+            flags = self._shapes.get(shape)
+            if flags is None:
+                flags = self._shapes[shape] = self._flags(desc)
+        else:
+            flags = self._flags(desc)
+        if len(self._cache) >= MAX_CACHED:
+            self._cache.clear()
+        self._cache[desc] = flags
+        return flags
+
+    def _flags(self, desc):
+        groups = self._match(desc).groupdict()
+        return self.Flags(*(groups[name] is not None for name in self.Flags._fields))
+
+
+# Module-level instance over classifier_rules.json
+classify = Classifier().classify
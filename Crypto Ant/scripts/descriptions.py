@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Parses trade descriptions into typed fields, stored on each LedgerRow as
+# row.trade (None for anything that is not a trade):
+#
+#   'Bought 0.20 BCH/BTC @ 0.02406'           -> buy  0.20 BCH priced in XBT
+#   'Sold 554.00 XRP/ZAR @ 4.00'              -> sell 554.00 XRP priced in ZAR
+#   'Bought BTC 0.00183333 for ZAR 1,000.00'  -> buy  0.00183333 XBT for R1000
+#
+# Each description shape (numbers replaced by '#') is matched against the
+# templates until one fits; later rows of that shape go straight to it.
+# Shapes no template fits are not remembered, since a malformed number can
+# give a valid description's shape.
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+# side: 'buy' or 'sell'; base/quote: ledger currency codes; qty: base units;
+# price: quote per base unit; counter: quote amount that changed hands
+Trade = namedtuple('Trade', ['side', 'base', 'quote', 'qty', 'price', 'counter'])
+
+# Descriptions say BTC where the exports' Currency column says XBT
+CURRENCY_ALIASES = {'BTC': 'XBT'}
+
+_NUM = r'(\d[\d,]*(?:\.\d+)?)'
+_CCY = r'([A-Z][A-Z0-9]{1,9})'
+# (regex, field order); the groups are side, then the fields in that order
+# (exports use non-breaking spaces in some of these, hence \s)
+TEMPLATES = [
+    (re.compile(rf'(Bought|Sold)\s+{_NUM}\s+{_CCY}/{_CCY}\s+@\s+{_NUM}$'), ('qty', 'base', 'quote', 'price')),
+    (re.compile(rf'(Bought|Sold)\s+{_CCY}\s+{_NUM}\s+for\s+{_CCY}\s+{_NUM}$'), ('base', 'qty', 'quote', 'counter')),
+]
+SIDES = {'Bought': 'buy', 'Sold': 'sell'}
+_NUMBERS = re.compile(r'[\d.,]+')
+
+_by_shape = {}
+
+
+def _template(desc):
+    for regex, fields in TEMPLATES:
+        if regex.match(desc):
+            return regex, fields
+    return None
+
+
+def _number(text):
+    return Decimal(text.replace(',', ''))
+
+
+def _ccy(code):
+    return CURRENCY_ALIASES.get(code, code)
+
+
+def parse_description(desc):
+    if not desc.startswith(('Bought', 'Sold')):
+        return None
+    shape = _NUMBERS.sub('#', desc)
+    template = _by_shape.get(shape)
+    m = template[0].match(desc) if template is not None else None
+    if m is None:
+        template = _template(desc)
+        if template is None:
+            return None
+        _by_shape[shape] = template
+        m = template[0].match(desc)
+    fields = template[1]
+    side, *values = m.groups()
+    parsed = dict(zip(fields, values))
+    qty = _number(parsed['qty'])
+    if 'price' in parsed:
+        price = _number(parsed['price'])
+        counter = qty * price
+    else:
+        counter = _number(parsed['counter'])
+        price = counter / qty if qty else Decimal('0')
+    return Trade(SIDES[side], _ccy(parsed['base']), _ccy(parsed['quote']), qty, price, counter)
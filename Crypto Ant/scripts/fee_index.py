@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Fee-to-trade attribution, built in one pass over the merged ledger, so a
+# fee's Trans Ref and "Fee for" description do not depend on which rows the
+# engine happened to process before it. A fee belongs to a trade with the same
+# (currency, timestamp, wallet): the last one before it, else the first one
+# after it. Failing that it goes to the nearest preceding trade of its
+# currency, found by bisect.
+#
+# Trans refs are counted as FYEngine numbers them (B_<CCY>_000 for inflows,
+# S_<CCY>_000 for outflows), so they can be resolved in any processing order.
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import groupby
+from operator import attrgetter
+
+from classifier import classify
+
+
+class FeeIndex:
+    def __init__(self):
+        # {ledger position of a fee: (trans ref, description, reference) of
+        # its trade}
+        self.fees = {}
+        self._counts = defaultdict(int)
+        # {currency: (trans ref, description, reference)} of the last trade
+        # seen
+        self._last = {}
+
+    def build(self, rows):
+        for _ in self.stream(rows):
+            pass
+        return self
+
+    def stream(self, rows):
+        # Passes rows through one timestamp at a time; each fee is indexed
+        # before it is yielded
+        pos = 0
+        for _, group in groupby(rows, attrgetter('dt')):
+            group = list(group)
+            self._index(pos, group)
+            pos += len(group)
+            yield from group
+
+    def _trans_ref(self, row):
+        prefix = f"{'B' if row.balance_delta > 0 else 'S'}_{row.currency.upper()}_"
+        n = self._counts[prefix]
+        self._counts[prefix] = n + 1
+        return f"{prefix}{n:03d}"
+
+    def _index(self, start, rows):
+        # rows share one timestamp; trades are (position, trans ref,
+        # description, reference)
+        by_wallet = defaultdict(list)
+        by_ccy = defaultdict(list)
+        fees = []
+        for pos, row in enumerate(rows, start):
+            if row.balance_delta == 0:
+                continue
+            if classify(row.description).fee:
+                fees.append((pos, row))
+                continue
+            trade = (pos, self._trans_ref(row), row.description, row.reference)
+            by_wallet[row.currency, row.wallet_id].append(trade)
+            by_ccy[row.currency].append(trade)
+
+        for pos, row in fees:
+            trades = by_wallet.get((row.currency, row.wallet_id))
+            if trades:
+                i = bisect_left(trades, (pos,))
+                trade = trades[i - 1] if i else trades[0]
+                self.fees[pos] = trade[1:]
+                continue
+            trades = by_ccy.get(row.currency, ())
+            i = bisect_left(trades, (pos,))
+            if i:
+                self.fees[pos] = trades[i - 1][1:]
+            else:
+                self.fees[pos] = self._last.get(row.currency, ('', '', ''))
+
+        for ccy, trades in by_ccy.items():
+            self._last[ccy] = trades[-1][1:]
@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 import csv
+import hashlib
 import json
+import pickle
 from decimal import Decimal, getcontext, ROUND_HALF_UP
 from datetime import datetime
-from collections import deque, defaultdict
+from collections import deque, defaultdict, namedtuple
 import sys
 import os
 import glob
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter, mul
+
+from ledger import load_file, load_ledger, iter_ledger
+from classifier import classify
+from trade_linker import TradeLinks
+from fee_index import FeeIndex
+from lot_store import LotStore
+from lot_array import LotArray
+import run_metrics
+from fixed_point import to_units, to_amt, unit_cost, share, qty_decimal, amt_decimal, round_cents, lot_cost, fmt_qty, fmt_amt
+import vector_fifo
 
 getcontext().prec = 28
 
+CHECKPOINT_VERSION = 4
+CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache', 'checkpoints', 'fifo_fy.pickle')
+
 def load_buys_for_others_mapping():
     mapping_file = os.path.join(os.path.dirname(__file__), '..', 'data', 'buys_for_others.json')
     if os.path.exists(mapping_file):
@@ -22,31 +40,38 @@ def load_buys_for_others_mapping():
 # Utility functions
 ALPHABET = [chr(c) for c in range(ord('A'), ord('Z')+1)]
 
-def gen_txn_ids(prefix):
-    # Yields prefix + 000, 001, ...
-    count = 0
-    while True:
-        yield f"{prefix}{count:03d}"
-        count += 1
+class gen_txn_ids:
+    # Yields prefix + 000, 001, ...; a class rather than a generator so the
+    # count can be checkpointed and resumed
+    __slots__ = ('prefix', 'count')
+    def __init__(self, prefix, count=0):
+        self.prefix = prefix
+        self.count = count
 
+    def __iter__(self):
+        return self
 
-def parse_dt(s):
-    # Example format: 2021-01-06 12:25:17
-    return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+    def __next__(self):
+        txn_id = f"{self.prefix}{self.count:03d}"
+        self.count += 1
+        return txn_id
 
 
-def financial_year(dt):
-    # FY runs Mar (3) .. Feb (2). If month >= 3, FY = year + 1; else year
-    return dt.year + 1 if dt.month >= 3 else dt.year
+# First month of the financial year (settings.financial_year_start in
+# config/config.yaml); the FY is named after the calendar year it ends in
+FY_START_MONTH = 3
+
 
+def set_financial_year_start(month):
+    global FY_START_MONTH
+    if not 1 <= month <= 12:
+        raise ValueError(f"financial_year_start must be a month number, got {month!r}")
+    FY_START_MONTH = month
 
-def dec(x):
-    if isinstance(x, Decimal):
-        return x
-    s = str(x).strip()
-    if s == '':
-        return Decimal('0')
-    return Decimal(s)
+
+def financial_year(dt):
+    # FY runs Mar (3) .. Feb (2) by default. If month >= start, FY = year + 1; else year
+    return dt.year + 1 if dt.month >= FY_START_MONTH else dt.year
 
 
 def q8(x: Decimal) -> str:
@@ -57,6 +82,10 @@ def r2(x: Decimal) -> Decimal:
     return x.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
 
+def r8(x: Decimal) -> Decimal:
+    return x.quantize(Decimal('0.00000001'), rounding=ROUND_HALF_UP)
+
+
 def s2(x: Decimal) -> str:
     return f"{r2(x)}"
 
@@ -68,93 +97,102 @@ class Lot:
         self.ref = ref
 
 
-def generate_fy_report(fy, buys, buys_for_others, sales, fees, others, lots_by_ccy, balance_units, balance_value, output_dir, timestamp):
+# Per-currency ledger rows are tuples in this column order
+FIFO_COLUMNS = [
+    'Financial Year', 'Trans Ref', 'Date', 'Description', 'Type', 'Lot Reference',
+    'Qty Change', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)',
+    'Fee (ZAR)', 'Balance Units', 'Balance Value (ZAR)',
+]
+
+
+def ccy_balance_rows(ccy, lots, units, total_value):
+    # Total row, then one row per open lot
+    rows = [[ccy, q8(units), s2(total_value), '', '', '', '']]
+    for lot in lots:
+        lot_value = lot.qty * r2(lot.unit_cost)
+        rows.append([ccy, '', '', lot.ref, q8(lot.qty), s2(lot.unit_cost), s2(lot_value)])
+    return rows
+
+
+def render_fy_report(fy, buy_rows, buys_for_others_rows, sale_rows, fee_rows, other_rows, balance_rows):
+    # fee_rows: (category, fee row) pairs in ledger order
+    rows = []
+    rows.append(['Boughts for FY', fy])
+    rows.append(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Bought', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
+    rows.extend(buy_rows)
+    rows.append([])
+
+    rows.append(['Solds for FY', fy])
+    rows.append(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Sold', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
+    rows.extend(sale_rows)
+    rows.append([])
+
+    rows.append(['Buys for Others FY', fy])
+    rows.append(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Bought', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
+    rows.extend(buys_for_others_rows)
+    rows.append([])
+
+    rows.append(['Others for FY', fy])
+    rows.append(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Other', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
+    rows.extend(other_rows)
+    rows.append([])
+    rows.append(['Balances at end of FY', fy])
+    rows.append(['Currency', 'Total Units', 'Total Value (ZAR)', 'Lot Ref', 'Lot Qty', 'Lot Unit Cost (ZAR)', 'Lot Total Value (ZAR)'])
+    rows.extend(balance_rows)
+
+
+    categories = {}
+    for cat, row in fee_rows:
+        if cat not in categories:
+            categories[cat] = []
+        categories[cat].append(row)
+    for cat in sorted(categories.keys()):
+        if cat == 'Buying':
+            title = 'Buying'
+        elif cat == 'Selling':
+            title = 'Selling'
+        else:
+            title = 'Other'
+        rows.append([f'{title} Fees'])
+        rows.append(['Date', 'Description', 'Trans Ref', 'Lot Ref', 'Fee (ZAR)'])
+        rows.extend(categories[cat])
+        total_fee = sum(Decimal(row[4]) for row in categories[cat])
+        rows.append([f'Total {title} Fees', '', '', '', s2(total_fee)])
+        rows.append([])
+    return rows
+
+
+def write_fy_report(fy, report_rows, output_dir):
     output_csv = os.path.join(output_dir, f"fy{fy}_report.csv")
-    with open(output_csv, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Boughts for FY', fy])
-        writer.writerow(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Bought', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
-        for buy in buys:
-            writer.writerow([buy['Date'], buy['Currency'], buy.get('Description', ''), buy['Trans Ref'], buy['Lot Ref'], buy['Qty Bought'], buy['Unit Cost'], buy['Total Cost'], buy['Proceeds'], buy['Profit'], buy.get('Fee (ZAR)', '0.00')])
-        writer.writerow([])
-
-        writer.writerow(['Solds for FY', fy])
-        writer.writerow(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Sold', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
-        for sale in sales:
-            writer.writerow([sale['Date'], sale['Currency'], sale.get('Description', ''), sale['Trans Ref'], sale['Lot Ref'], sale['Qty Sold'], sale['Unit Cost'], sale['Total Cost'], sale['Proceeds'], sale['Profit'], sale.get('Fee (ZAR)', '0.00')])
-        writer.writerow([])
-
-        writer.writerow(['Buys for Others FY', fy])
-        writer.writerow(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Bought', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
-        for buy in buys_for_others:
-            writer.writerow([buy['Date'], buy['Currency'], buy.get('Description', ''), buy['Trans Ref'], buy['Lot Ref'], buy['Qty Bought'], buy['Unit Cost'], buy['Total Cost'], buy['Proceeds'], buy['Profit'], buy.get('Fee (ZAR)', '0.00')])
-        writer.writerow([])
-
-        writer.writerow(['Others for FY', fy])
-        writer.writerow(['Date', 'Currency', 'Description', 'Trans Ref', 'Lot Ref', 'Qty Other', 'Unit Cost (ZAR)', 'Total Cost (ZAR)', 'Proceeds (ZAR)', 'Profit (ZAR)', 'Fee (ZAR)'])
-        for other in others:
-            writer.writerow([other['Date'], other['Currency'], other.get('Description', ''), other['Trans Ref'], other['Lot Ref'], other['Qty Sold'], other['Unit Cost'], other['Total Cost'], other['Proceeds'], other['Profit'], other.get('Fee (ZAR)', '0.00')])
-        writer.writerow([])
-        writer.writerow(['Balances at end of FY', fy])
-        writer.writerow(['Currency', 'Total Units', 'Total Value (ZAR)', 'Lot Ref', 'Lot Qty', 'Lot Unit Cost (ZAR)', 'Lot Total Value (ZAR)'])
-        for ccy in sorted(lots_by_ccy.keys()):
-            units = balance_units[ccy]
-            total_value = balance_value[ccy]
-            # Total row
-            writer.writerow([ccy, q8(units), s2(total_value), '', '', '', ''])
-            # Lot rows
-            for lot in lots_by_ccy[ccy]:
-                lot_value = lot.qty * r2(lot.unit_cost)
-                writer.writerow([ccy, '', '', lot.ref, q8(lot.qty), s2(lot.unit_cost), s2(lot_value)])
-
-
-        categories = {}
-        for fee in fees:
-            cat = fee['Category']
-            if cat not in categories:
-                categories[cat] = []
-            categories[cat].append(fee)
-        for cat in sorted(categories.keys()):
-            if cat == 'Buying':
-                writer.writerow(['Buying Fees'])
-                writer.writerow(['Date', 'Description', 'Trans Ref', 'Lot Ref', 'Fee (ZAR)'])
-                for fee in categories[cat]:
-                    writer.writerow([fee['Date'], fee['Description'], fee['Trans Ref'], fee['Lot Ref'], fee['Fee (ZAR)']])
-                total_fee = sum(Decimal(fee['Fee (ZAR)']) for fee in categories[cat])
-                writer.writerow(['Total Buying Fees', '', '', '', s2(total_fee)])
-            elif cat == 'Selling':
-                writer.writerow(['Selling Fees'])
-                writer.writerow(['Date', 'Description', 'Trans Ref', 'Lot Ref', 'Fee (ZAR)'])
-                for fee in categories[cat]:
-                    writer.writerow([fee['Date'], fee['Description'], fee['Trans Ref'], fee['Lot Ref'], fee['Fee (ZAR)']])
-                total_fee = sum(Decimal(fee['Fee (ZAR)']) for fee in categories[cat])
-                writer.writerow(['Total Selling Fees', '', '', '', s2(total_fee)])
-            else:
-                writer.writerow(['Other Fees'])
-                writer.writerow(['Date', 'Description', 'Trans Ref', 'Lot Ref', 'Fee (ZAR)'])
-                for fee in categories[cat]:
-                    writer.writerow([fee['Date'], fee['Description'], fee['Trans Ref'], fee['Lot Ref'], fee['Fee (ZAR)']])
-                total_fee = sum(Decimal(fee['Fee (ZAR)']) for fee in categories[cat])
-                writer.writerow(['Total Other Fees', '', '', '', s2(total_fee)])
-            writer.writerow([])
+    with run_metrics.writing(output_csv):
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerows(report_rows)
 
     print(f"Wrote {output_csv}")
 
 
-def main(input_csv, output_csv):
-    rows = []
-    with open(input_csv, newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            row['Balance delta'] = dec(row['Balance delta'])
-            row['Value amount'] = dec(row['Value amount'])
-            row['_dt'] = parse_dt(row['Timestamp (UTC)'])
-            rows.append(row)
+LINKED_TRADES_COLUMNS = [
+    'Financial Year', 'Date', 'Description', 'Reference', 'Inflow Coin', 'Inflow Qty', 'Outflow Coin',
+    'Outflow Qty', 'Disposal Value (ZAR)', 'Inflow Value (ZAR)',
+]
 
-    rows.sort(key=lambda r: r['_dt'])
 
+def write_linked_trades(links, output_dir):
+    output_csv = os.path.join(output_dir, 'linked_trades.csv')
+    with run_metrics.writing(output_csv):
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(LINKED_TRADES_COLUMNS)
+            writer.writerows([financial_year(inflow.dt), inflow.timestamp, inflow.description, inflow.reference,
+                              inflow.currency, q8(inflow.balance_delta), outflow.currency, q8(outflow.balance_delta),
+                              s2(outflow.value_amount), s2(inflow.value_amount)]
+                             for inflow, outflow in links)
+
+
+def build_fifo_rows(rows):
     if rows:
-        ccy = rows[0]['Currency']
+        ccy = rows[0].currency
     else:
         ccy = 'UNK'
 
@@ -171,41 +209,41 @@ def main(input_csv, output_csv):
     last_trans_ref = ''
 
     for row in rows:
-        ccy = row['Currency']
-        dt = row['_dt']
+        ccy = row.currency
+        dt = row.dt
         fy = financial_year(dt)
-        qty_delta = row['Balance delta']
-        desc = row['Description']
-        is_send = 'send' in desc.lower() or 'sent' in desc.lower() or 'transfer' in desc.lower() or 'ant' in desc.lower()
-        ref = row['Reference']
-        value_amount = row['Value amount']
+        qty_delta = row.balance_delta
+        desc = row.description
+        kind = classify(desc)
+        ref = row.reference
+        value_amount = row.value_amount
 
         if qty_delta == 0:
             continue
 
-        if 'fee' in desc.lower():
+        if kind.fee:
             # Treat as fee, include in inventory change
             balance_units[ccy] += qty_delta
             balance_value[ccy] -= value_amount
-            output_rows.append({
-                'Financial Year': fy,
-                'Trans Ref': last_trans_ref,
-                'Date': row['Timestamp (UTC)'],
-                'Description': f"Fee for {last_trans_desc}",
-                'Type': 'Fee',
-                'Lot Reference': '',
-                'Qty Change': q8(qty_delta),
-                'Unit Cost (ZAR)': '',
-                'Total Cost (ZAR)': '',
-                'Proceeds (ZAR)': '',
-                'Profit (ZAR)': '',
-                'Fee (ZAR)': s2(value_amount),
-                'Balance Units': q8(balance_units[ccy]),
-                'Balance Value (ZAR)': s2(balance_value[ccy]),
-            })
+            output_rows.append((
+                fy,
+                last_trans_ref,
+                row.timestamp,
+                f"Fee for {last_trans_desc}",
+                'Fee',
+                '',
+                q8(qty_delta),
+                '',
+                '',
+                '',
+                '',
+                s2(value_amount),
+                q8(balance_units[ccy]),
+                s2(balance_value[ccy]),
+            ))
             continue
 
-        if qty_delta > 0 and desc.startswith('Bought'):
+        if qty_delta > 0 and kind.buy:
              # Buy lot
              qty = qty_delta
              unit_cost = value_amount / qty if qty != 0 else Decimal('0')
@@ -219,22 +257,22 @@ def main(input_csv, output_csv):
              last_trans_ref = trans_id
 
 
-             output_rows.append({
-                 'Financial Year': fy,
-                 'Trans Ref': trans_id,
-                 'Date': row['Timestamp (UTC)'],
-                 'Description': desc,
-                 'Type': 'Buy',
-                 'Lot Reference': ref,
-                 'Qty Change': q8(qty),
-                 'Unit Cost (ZAR)': s2(unit_cost),
-                 'Total Cost (ZAR)': s2(total_cost),
-                 'Proceeds (ZAR)': s2(Decimal('0')),
-                 'Profit (ZAR)': s2(Decimal('0')),
-                 'Fee (ZAR)': s2(Decimal('0')),
-                 'Balance Units': q8(balance_units[ccy]),
-                 'Balance Value (ZAR)': s2(balance_value[ccy]),
-             })
+             output_rows.append((
+                 fy,
+                 trans_id,
+                 row.timestamp,
+                 desc,
+                 'Buy',
+                 ref,
+                 q8(qty),
+                 s2(unit_cost),
+                 s2(total_cost),
+                 s2(Decimal('0')),
+                 s2(Decimal('0')),
+                 s2(Decimal('0')),
+                 q8(balance_units[ccy]),
+                 s2(balance_value[ccy]),
+             ))
         elif qty_delta > 0:
               # Other positive delta - treat as buy to create lots
               qty = qty_delta
@@ -248,27 +286,27 @@ def main(input_csv, output_csv):
               trans_id = next(buy_id_gen)
               last_trans_ref = trans_id
 
-              output_rows.append({
-                  'Financial Year': fy,
-                  'Trans Ref': trans_id,
-                  'Date': row['Timestamp (UTC)'],
-                  'Description': desc,
-                  'Type': 'Buy',
-                  'Lot Reference': ref,
-                  'Qty Change': q8(qty),
-                  'Unit Cost (ZAR)': s2(unit_cost),
-                  'Total Cost (ZAR)': s2(total_cost),
-                  'Proceeds (ZAR)': s2(Decimal('0')),
-                  'Profit (ZAR)': s2(Decimal('0')),
-                  'Fee (ZAR)': s2(Decimal('0')),
-                  'Balance Units': q8(balance_units[ccy]),
-                  'Balance Value (ZAR)': s2(balance_value[ccy]),
-              })
+              output_rows.append((
+                  fy,
+                  trans_id,
+                  row.timestamp,
+                  desc,
+                  'Buy',
+                  ref,
+                  q8(qty),
+                  s2(unit_cost),
+                  s2(total_cost),
+                  s2(Decimal('0')),
+                  s2(Decimal('0')),
+                  s2(Decimal('0')),
+                  q8(balance_units[ccy]),
+                  s2(balance_value[ccy]),
+              ))
         else:
             # Sell or Send (any outflow)
             sell_qty = -qty_delta  # positive
             proceeds_total = value_amount
-            trans_type = 'Sell' if desc.startswith('Sold') else 'Other'
+            trans_type = 'Sell' if kind.sell else 'Other'
             # If there are no lots, we will create a negative inventory entry (allowed here)
             # But better: consume from empty -> create lot with zero cost to allow proceeds
             if not lots_by_ccy[ccy]:
@@ -306,22 +344,22 @@ def main(input_csv, output_csv):
                 balance_units[ccy] -= consume
                 balance_value[ccy] -= total_cost
 
-                output_rows.append({
-                    'Financial Year': fy,
-                    'Trans Ref': trans_id,
-                    'Date': row['Timestamp (UTC)'],
-                    'Description': desc,
-                'Type': trans_type,
-                'Lot Reference': lot.ref,
-                    'Qty Change': q8(-consume),
-                    'Unit Cost (ZAR)': s2(unit_cost),
-                    'Total Cost (ZAR)': s2(total_cost.copy_abs()),
-                    'Proceeds (ZAR)': s2(split_proceeds),
-                    'Profit (ZAR)': s2(profit),
-                    'Fee (ZAR)': s2(Decimal('0')),
-                    'Balance Units': q8(balance_units[ccy]),
-                    'Balance Value (ZAR)': s2(balance_value[ccy]),
-            })
+                output_rows.append((
+                    fy,
+                    trans_id,
+                    row.timestamp,
+                    desc,
+                trans_type,
+                lot.ref,
+                    q8(-consume),
+                    s2(unit_cost),
+                    s2(total_cost.copy_abs()),
+                    s2(split_proceeds),
+                    s2(profit),
+                    s2(Decimal('0')),
+                    q8(balance_units[ccy]),
+                    s2(balance_value[ccy]),
+            ))
 
                 remaining -= consume
             
@@ -336,232 +374,703 @@ def main(input_csv, output_csv):
                     profit = Decimal('0')
                 balance_units[ccy] -= remaining
                 # balance_value unchanged as zero cost
-                output_rows.append({
-                    'Financial Year': fy,
-                    'Trans Ref': trans_id,
-                    'Date': row['Timestamp (UTC)'],
-                    'Description': desc,
-                    'Type': trans_type,
-                    'Lot Reference': 'N/A',
-                    'Qty Change': q8(-remaining),
-                    'Unit Cost (ZAR)': s2(unit_cost),
-                    'Total Cost (ZAR)': s2(total_cost.copy_abs()),
-                    'Proceeds (ZAR)': s2(split_proceeds),
-                    'Profit (ZAR)': s2(profit),
-                    'Fee (ZAR)': s2(Decimal('0')),
-                    'Balance Units': q8(balance_units[ccy]),
-                    'Balance Value (ZAR)': s2(balance_value[ccy]),
-                })
+                output_rows.append((
+                    fy,
+                    trans_id,
+                    row.timestamp,
+                    desc,
+                    trans_type,
+                    'N/A',
+                    q8(-remaining),
+                    s2(unit_cost),
+                    s2(total_cost.copy_abs()),
+                    s2(split_proceeds),
+                    s2(profit),
+                    s2(Decimal('0')),
+                    q8(balance_units[ccy]),
+                    s2(balance_value[ccy]),
+                ))
                 remaining = Decimal('0')
 
             last_trans_desc = desc
 
-    # Write output CSV
-    fieldnames = [
-        'Financial Year','Trans Ref','Date','Description','Type','Lot Reference',
-        'Qty Change','Unit Cost (ZAR)','Total Cost (ZAR)','Proceeds (ZAR)','Profit (ZAR)',
-        'Fee (ZAR)','Balance Units','Balance Value (ZAR)'
-    ]
-    with open(output_csv, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for orow in output_rows:
-            writer.writerow(orow)
-
-    print(f"Wrote {output_csv} with {len(output_rows)} rows.")
+    return output_rows
 
 
-def find_lot_by_ref(lots_deque, ref):
-    for i, lot in enumerate(lots_deque):
-        if lot.ref == ref:
-            return i, lot
-    return None, None
+def build_fifo_rows_fixed(rows, coalesce=False):
+    # Same ledger as build_fifo_rows, computed on fixed-point integers (see
+    # fixed_point.py); strings are produced only for the output rows.
+    # coalesce merges same-cost dust lots (see lot_array.py), which changes
+    # the lot refs and split rows reported but not the costs.
+    ccy = rows[0].currency if rows else 'UNK'
+    buy_id_gen = gen_txn_ids(f'B_{ccy.upper()}_')
+    sell_id_gen = gen_txn_ids(f'S_{ccy.upper()}_')
 
-def process_fy(csv_files, output_dir, timestamp):
-    buys_for_others_mapping = load_buys_for_others_mapping()
-    
-    rows = []
-    for csv_file in csv_files:
-        with open(csv_file, newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                row['Balance delta'] = dec(row['Balance delta'])
-                row['Value amount'] = dec(row['Value amount'])
-                row['_dt'] = parse_dt(row['Timestamp (UTC)'])
-                rows.append(row)
+    # Costs are taken from each lot's own amount/units ratio so whole-lot
+    # consumption is exact
+    lots = LotArray(coalesce)
+    balance_units = 0
+    balance_value = 0
+    output_rows = []
+    last_trans_desc = ''
+    last_trans_ref = ''
+    zero = fmt_amt(0)
 
-    rows.sort(key=lambda r: r['_dt'])
+    for row in rows:
+        qty_delta = row.balance_delta
+        if qty_delta == 0:
+            continue
+        fy = financial_year(row.dt)
+        desc = row.description
+        kind = classify(desc)
+        units = to_units(qty_delta)
+        value_amount = to_amt(row.value_amount)
+
+        if kind.fee:
+            balance_units += units
+            balance_value -= value_amount
+            output_rows.append((
+                fy,
+                last_trans_ref,
+                row.timestamp,
+                f"Fee for {last_trans_desc}",
+                'Fee',
+                '',
+                fmt_qty(units),
+                '',
+                '',
+                '',
+                '',
+                fmt_amt(value_amount),
+                fmt_qty(balance_units),
+                fmt_amt(balance_value),
+            ))
+            continue
 
-    lots_by_ccy = defaultdict(deque)
-    balance_units = defaultdict(lambda: Decimal('0'))
-    balance_value = defaultdict(lambda: Decimal('0'))
+        if units > 0:
+            uc = unit_cost(value_amount, units)
+            total_cost = value_amount
+            lots.append(units, value_amount, row.reference, desc)
+            balance_units += units
+            balance_value += total_cost
+            trans_id = next(buy_id_gen)
+            last_trans_ref = trans_id
+            output_rows.append((
+                fy,
+                trans_id,
+                row.timestamp,
+                desc,
+                'Buy',
+                row.reference,
+                fmt_qty(units),
+                fmt_amt(uc),
+                fmt_amt(total_cost),
+                zero,
+                zero,
+                zero,
+                fmt_qty(balance_units),
+                fmt_amt(balance_value),
+            ))
+            continue
 
-    buys_per_fy = defaultdict(list)
-    buys_for_others_per_fy = defaultdict(list)
-    sales_per_fy = defaultdict(list)
-    fees_per_fy = defaultdict(list)
-    others_per_fy = defaultdict(list)
-    last_trans_per_ccy = defaultdict(str)
-    last_trans_ref_per_ccy = defaultdict(str)
+        sell_qty = -units
+        is_sell = kind.sell
+        trans_type = 'Sell' if is_sell else 'Other'
+        if not lots:
+            lots.append(0, 0, 'N/A')
+        trans_id = next(sell_id_gen)
+        last_trans_ref = trans_id
+
+        # Integers only; a zero-qty head lot stops consumption exactly like
+        # the Decimal engine's consume <= 0 check
+        pieces, remaining = lots.consume(sell_qty)
+        splits = []
+        for lot_ref, consume, lot_amt, lot_units in pieces:
+            total_cost = consume * lot_amt // lot_units
+            balance_units -= consume
+            balance_value -= total_cost
+            splits.append((lot_ref, consume, unit_cost(lot_amt, lot_units), total_cost, balance_units, balance_value))
+        if remaining > 0:
+            balance_units -= remaining
+            splits.append(('N/A', remaining, 0, 0, balance_units, balance_value))
+
+        proceeds_total = value_amount
+        for lot_ref, consume, uc, total_cost, units_after, value_after in splits:
+            if is_sell:
+                split_proceeds = proceeds_total * consume // sell_qty
+                profit = split_proceeds - total_cost
+            else:
+                split_proceeds = 0
+                profit = 0
+            output_rows.append((
+                fy,
+                trans_id,
+                row.timestamp,
+                desc,
+                trans_type,
+                lot_ref,
+                fmt_qty(-consume),
+                fmt_amt(uc),
+                fmt_amt(abs(total_cost)),
+                fmt_amt(split_proceeds),
+                fmt_amt(profit),
+                zero,
+                fmt_qty(units_after),
+                fmt_amt(value_after),
+            ))
+
+        last_trans_desc = desc
+
+    if run_metrics.active is not None:
+        run_metrics.active.lot_memory(ccy, lots.memory())
+    return output_rows
+
+
+def build_fifo_rows_vector(rows):
+    # Same ledger as build_fifo_rows_fixed, with the consume loop replaced by
+    # vector_fifo.fifo_splits (NumPy); this pass only assigns ids, running
+    # balances and strings
+    ccy = rows[0].currency if rows else 'UNK'
+    buy_id_gen = gen_txn_ids(f'B_{ccy.upper()}_')
+    sell_id_gen = gen_txn_ids(f'S_{ccy.upper()}_')
 
-    buy_refs_for_others = set()
-    for ccy, refs in buys_for_others_mapping.items():
-        for ref in refs.keys():
-            buy_refs_for_others.add((ccy, ref))
+    events = []
+    lot_units, lot_amts, lot_rows = [], [], []
+    out_units, out_amts, out_rows = [], [], []
+    for row in rows:
+        if row.balance_delta == 0:
+            continue
+        units = to_units(row.balance_delta)
+        amt = to_amt(row.value_amount)
+        is_fee = classify(row.description).fee
+        if not is_fee:
+            if units > 0:
+                lot_units.append(units)
+                lot_amts.append(amt)
+                lot_rows.append(len(events))
+            else:
+                out_units.append(-units)
+                out_amts.append(amt)
+                out_rows.append(len(events))
+        events.append((row, units, amt, is_fee))
+    splits = vector_fifo.fifo_splits(lot_units, lot_amts, lot_rows, out_units, out_amts, out_rows, block_on_empty=True)
+    lot_refs = [events[i][0].reference for i in lot_rows]
+
+    balance_units = 0
+    balance_value = 0
+    output_rows = []
+    last_trans_desc = ''
+    last_trans_ref = ''
+    zero = fmt_amt(0)
+    k = 0
+
+    for row, units, value_amount, is_fee in events:
+        fy = financial_year(row.dt)
+        desc = row.description
+
+        if is_fee:
+            balance_units += units
+            balance_value -= value_amount
+            output_rows.append((
+                fy,
+                last_trans_ref,
+                row.timestamp,
+                f"Fee for {last_trans_desc}",
+                'Fee',
+                '',
+                fmt_qty(units),
+                '',
+                '',
+                '',
+                '',
+                fmt_amt(value_amount),
+                fmt_qty(balance_units),
+                fmt_amt(balance_value),
+            ))
+            continue
 
-    current_fy = None
+        if units > 0:
+            balance_units += units
+            balance_value += value_amount
+            trans_id = next(buy_id_gen)
+            last_trans_ref = trans_id
+            output_rows.append((
+                fy,
+                trans_id,
+                row.timestamp,
+                desc,
+                'Buy',
+                row.reference,
+                fmt_qty(units),
+                fmt_amt(unit_cost(value_amount, units)),
+                fmt_amt(value_amount),
+                zero,
+                zero,
+                zero,
+                fmt_qty(balance_units),
+                fmt_amt(balance_value),
+            ))
+            continue
 
-    buy_id_gens = {}
-    sell_id_gens = {}
+        is_sell = classify(desc).sell
+        trans_type = 'Sell' if is_sell else 'Other'
+        trans_id = next(sell_id_gen)
+        last_trans_ref = trans_id
+        pieces = []
+        for j in range(splits.start[k], splits.start[k + 1]):
+            lot = splits.lot[j]
+            pieces.append((lot_refs[lot], splits.units[j], unit_cost(lot_amts[lot], lot_units[lot]),
+                           splits.cost[j], splits.proceeds[j]))
+        if splits.short_units[k]:
+            pieces.append(('N/A', splits.short_units[k], 0, 0, splits.short_proceeds[k]))
+        k += 1
+
+        for lot_ref, consume, uc, total_cost, split_proceeds in pieces:
+            balance_units -= consume
+            balance_value -= total_cost
+            if is_sell:
+                profit = split_proceeds - total_cost
+            else:
+                split_proceeds = 0
+                profit = 0
+            output_rows.append((
+                fy,
+                trans_id,
+                row.timestamp,
+                desc,
+                trans_type,
+                lot_ref,
+                fmt_qty(-consume),
+                fmt_amt(uc),
+                fmt_amt(abs(total_cost)),
+                fmt_amt(split_proceeds),
+                fmt_amt(profit),
+                zero,
+                fmt_qty(balance_units),
+                fmt_amt(balance_value),
+            ))
+
+        last_trans_desc = desc
+
+    return output_rows
+
+
+def main(input_csv, output_csv, rows=None, fixed=False, vector=False, coalesce=False, columns=None):
+    # One export's ledger on its own, without the buys-for-others matches,
+    # linked trade costs or fee index of the FY run (whose LedgerSink writes
+    # the pipeline's ledgers); benchmark.py and the differential checks use it
+    if rows is None:
+        rows = load_file(input_csv)
+
+    # vector needs NumPy; without it the fixed-point loop gives the same rows
+    if vector and vector_fifo.available() and not coalesce:
+        output_rows = build_fifo_rows_vector(rows)
+    elif fixed or vector or coalesce:
+        try:
+            output_rows = build_fifo_rows_fixed(rows, coalesce)
+        except OverflowError:
+            # A lot past LotArray's 64-bit range (see lot_array.py)
+            print(f"{os.path.basename(input_csv)}: lot too large for the fixed-point queue; using Decimal")
+            output_rows = build_fifo_rows(rows)
+    else:
+        output_rows = build_fifo_rows(rows)
+
+    # columns: another ledger column order (config/config.yaml's fifo order)
+    columns = columns or FIFO_COLUMNS
+    formatted = output_rows
+    if columns is not FIFO_COLUMNS:
+        from report_sinks import row_formatter
+        formatter = row_formatter(FIFO_COLUMNS, columns)
+        if formatter is not None:
+            formatted = map(formatter, output_rows)
+
+    with run_metrics.writing(output_csv):
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(formatted)
 
-    for row in rows:
-        ccy = row['Currency']
-        dt = row['_dt']
-        fy = financial_year(dt)
-        qty_delta = row['Balance delta']
-        desc = row['Description']
-        ref = row['Reference']
-        value_amount = row['Value amount']
+    print(f"Wrote {output_csv} with {len(output_rows)} rows.")
 
-        if qty_delta == 0:
-            continue
 
-        if 'fee' in desc.lower():
-            balance_units[ccy] += qty_delta
-            balance_value[ccy] -= value_amount
+def index_others_by_timestamp(buys_for_others_mapping):
+    # (ccy, other_timestamp) -> buy ref; the first mapping entry wins
+    index = {}
+    for ccy, refs in buys_for_others_mapping.items():
+        for buy_ref, match_info in refs.items():
+            index.setdefault((ccy, match_info['other_timestamp']), buy_ref)
+    return index
+
+
+def _advance_digest(h, rows, start, stop, buy_refs_for_others, other_refs_by_ts):
+    # Hash each row together with the buys-for-others decisions that apply to
+    # it, so a changed mapping invalidates only checkpoints after the change
+    for row in rows[start:stop]:
+        flag = 'B' if (row.currency, row.reference) in buy_refs_for_others else ''
+        matched = other_refs_by_ts.get((row.currency, row.timestamp), '')
+        h.update(f"{row.timestamp}\x1f{row.currency}\x1f{row.description}\x1f{row.reference}\x1f"
+                 f"{row.balance_delta}\x1f{row.value_amount}\x1f{flag}\x1f{matched}\n".encode('utf-8'))
+
+
+def load_checkpoints(checkpoint_file):
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return []
+    try:
+        with open(checkpoint_file, 'rb') as f:
+            data = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return []
+    if data.get('version') != CHECKPOINT_VERSION or data.get('fy_start') != FY_START_MONTH:
+        return []
+    return data['checkpoints']
+
+
+def save_checkpoints(checkpoint_file, checkpoints):
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    tmp = f"{checkpoint_file}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump({'version': CHECKPOINT_VERSION, 'fy_start': FY_START_MONTH, 'checkpoints': checkpoints}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, checkpoint_file)
+
+
+def find_resume_point(rows, checkpoints, buy_refs_for_others, other_refs_by_ts):
+    # Walk the saved FY boundaries in order and return how many of them still
+    # match the current input prefix, plus the running digest at the last one
+    h = hashlib.sha256()
+    pos = 0
+    matched = 0
+    for cp in checkpoints:
+        if cp['index'] > len(rows):
+            break
+        _advance_digest(h, rows, pos, cp['index'], buy_refs_for_others, other_refs_by_ts)
+        pos = cp['index']
+        if h.hexdigest() != cp['digest']:
+            break
+        matched += 1
+    if matched < len(checkpoints) or pos != (checkpoints[matched - 1]['index'] if matched else 0):
+        # Digest walked past the last good checkpoint; rewind to it
+        h = hashlib.sha256()
+        pos = checkpoints[matched - 1]['index'] if matched else 0
+        _advance_digest(h, rows, 0, pos, buy_refs_for_others, other_refs_by_ts)
+    return matched, h
+
+
+# One engine step as seen by the sinks. kind is 'open' (a lot is added),
+# 'consume' (a sale takes from a lot), 'other' (a send or other outflow takes
+# from a lot) or 'fee'. Consumptions come one per lot split, with lot_ref
+# 'N/A' for the part no lot covered; qty is signed like the balance delta.
+# balance_units/balance_value are the currency's running totals after the
+# step, pos is the row's position in the merged ledger, and note is the
+# description of the transaction a fee belongs to. for_other marks a buy
+# matched to an Other, and a fee whose trade is one. The numbers are in the
+# engine's Numbers: Decimals from FYEngine, integers from FixedFYEngine.
+LotEvent = namedtuple('LotEvent', ['kind', 'pos', 'row', 'fy', 'trans_id', 'lot_ref', 'qty', 'unit_cost', 'total_cost',
+                                   'proceeds', 'profit', 'balance_units', 'balance_value', 'note', 'for_other'])
+
+ZERO = Decimal('0')
+ZERO2 = s2(ZERO)
+
+
+def _as_decimal(x):
+    return x
+
+
+# How sinks format, round and total an engine's numbers, so the fixed-point
+# engine's events are rendered without going through Decimal. qty_str/amt_str
+# give the q8/s2 strings, round_amt rounds like r2, cost(qty, unit cost) is a
+# lot's cost, dust the qty at or below which a lot is used up, and
+# qty_decimal/amt_decimal convert to Decimal.
+Numbers = namedtuple('Numbers', ['zero', 'dust', 'qty_str', 'amt_str', 'round_amt', 'cost', 'qty_decimal', 'amt_decimal'])
+DECIMAL_NUMBERS = Numbers(ZERO, Decimal('0.0000000001'), q8, s2, r2, mul, _as_decimal, _as_decimal)
+FIXED_NUMBERS = Numbers(0, 0, fmt_qty, fmt_amt, round_cents, lot_cost, qty_decimal, amt_decimal)
+
+
+def bind_numbers(sinks, fixed):
+    for sink in sinks:
+        sink.numbers = FIXED_NUMBERS if fixed else DECIMAL_NUMBERS
+
+
+class FYReportSink:
+    # Renders lot events into the per-FY record lists of the FY reports. Each
+    # record is already the report's row tuple (fees: (category, row)).
+    numbers = DECIMAL_NUMBERS
+
+    def __init__(self):
+        self.buys_per_fy = defaultdict(list)
+        self.buys_for_others_per_fy = defaultdict(list)
+        self.sales_per_fy = defaultdict(list)
+        self.fees_per_fy = defaultdict(list)
+        self.others_per_fy = defaultdict(list)
+
+    def per_fy(self):
+        return (self.buys_per_fy, self.buys_for_others_per_fy, self.sales_per_fy, self.fees_per_fy, self.others_per_fy)
+
+    def event(self, ev):
+        row = ev.row
+        if ev.kind == 'fee':
             category = 'Other'
-            if 'Bought' in last_trans_per_ccy[ccy]:
+            if 'Bought' in ev.note:
                 category = 'Buying'
-            elif 'Sold' in last_trans_per_ccy[ccy]:
+            elif 'Sold' in ev.note:
                 category = 'Selling'
-            fees_per_fy[fy].append({
-                'Category': category,
-                'Date': row['Timestamp (UTC)'],
-                'Description': f"Fee for {last_trans_per_ccy[ccy]}",
-                'Trans Ref': last_trans_ref_per_ccy[ccy],
-                'Lot Ref': '',
-                'Fee (ZAR)': s2(value_amount),
-            })
-            continue
-
-        if current_fy is not None and fy != current_fy:
-            generate_fy_report(current_fy, buys_per_fy[current_fy], buys_for_others_per_fy[current_fy], sales_per_fy[current_fy], fees_per_fy[current_fy], others_per_fy[current_fy], lots_by_ccy, balance_units, balance_value, output_dir, timestamp)
-
-        current_fy = fy
-
-        if qty_delta > 0 and desc.startswith('Bought'):
-            qty = qty_delta
-            unit_cost = value_amount / qty if qty != 0 else Decimal('0')
-            lots_by_ccy[ccy].append(Lot(qty=qty, unit_cost=unit_cost, ref=ref))
-            balance_units[ccy] += qty
-            total_cost = qty * unit_cost
-            balance_value[ccy] += total_cost
-            if ccy not in buy_id_gens:
-                buy_id_gens[ccy] = gen_txn_ids(f'B_{ccy.upper()}_')
-            trans_id = next(buy_id_gens[ccy])
-            last_trans_per_ccy[ccy] = desc
-            last_trans_ref_per_ccy[ccy] = trans_id
-            
-            is_for_other = (ccy, ref) in buy_refs_for_others
-            buy_record = {
-                'Date': row['Timestamp (UTC)'],
-                'Currency': ccy,
-                'Description': desc,
-                'Trans Ref': trans_id,
-                'Lot Ref': ref,
-                'Qty Bought': q8(qty),
-                'Unit Cost': s2(unit_cost),
-                'Total Cost': s2(total_cost),
-                'Proceeds': s2(Decimal('0')),
-                'Profit': s2(Decimal('0')),
-                'Fee (ZAR)': s2(Decimal('0')),
-            }
-            if is_for_other:
-                buys_for_others_per_fy[fy].append(buy_record)
+            self.fees_per_fy[ev.fy].append(
+                (category, (row.timestamp, f"Fee for {ev.note}", ev.trans_id, '', s2(row.value_amount))))
+        elif ev.kind == 'open':
+            num = self.numbers
+            record = (row.timestamp, row.currency, row.description, ev.trans_id, ev.lot_ref, num.qty_str(ev.qty),
+                      num.amt_str(ev.unit_cost), num.amt_str(ev.total_cost), ZERO2, ZERO2, ZERO2)
+            if ev.for_other:
+                self.buys_for_others_per_fy[ev.fy].append(record)
             else:
-                buys_per_fy[fy].append(buy_record)
-                
-        elif qty_delta > 0:
+                self.buys_per_fy[ev.fy].append(record)
+        else:
+            num = self.numbers
+            record = (row.timestamp, row.currency, row.description, ev.trans_id, ev.lot_ref, num.qty_str(ev.qty),
+                      num.amt_str(ev.unit_cost), num.amt_str(abs(ev.total_cost)), num.amt_str(ev.proceeds),
+                      num.amt_str(ev.profit), ZERO2)
+            if ev.kind == 'consume':
+                self.sales_per_fy[ev.fy].append(record)
+            else:
+                self.others_per_fy[ev.fy].append(record)
+
+
+# One FY's overview figures, as its report rounds them: proceeds, base cost
+# and profit of the sale splits with a loss and with a gain (a split that
+# breaks even is in neither), and {currency: (units, value)} at FY end
+FYSummary = namedtuple('FYSummary', ['fy', 'proceeds_loss', 'cost_loss', 'profit_loss', 'proceeds_gain', 'cost_gain',
+                                     'profit_gain', 'balances'])
+
+
+def add_sale(totals, proceeds, cost, profit):
+    # totals: [proceeds, cost, profit] of losses, then of gains
+    if profit:
+        k = 0 if profit < 0 else 3
+        totals[k] += proceeds
+        totals[k + 1] += cost
+        totals[k + 2] += profit
+
+
+class FYTotalsSink:
+    # Running gain and loss totals per FY, kept as the engine consumes lots so
+    # the overview never has to read the FY reports back
+    numbers = DECIMAL_NUMBERS
+
+    def __init__(self):
+        self.totals = {}
+
+    def event(self, ev):
+        if ev.kind == 'consume':
+            num = self.numbers
+            totals = self.totals.get(ev.fy)
+            if totals is None:
+                totals = self.totals[ev.fy] = [num.zero] * 6
+            add_sale(totals, num.round_amt(ev.proceeds), num.round_amt(abs(ev.total_cost)), num.round_amt(ev.profit))
+
+    def fy_totals(self, fy):
+        # fy's six totals as Decimals
+        return [self.numbers.amt_decimal(total) for total in self.totals.get(fy, [self.numbers.zero] * 6)]
+
+
+class FYEngine:
+    # Cross-currency FIFO state. Every piece of state is keyed by currency,
+    # so one engine can also be fed a single currency's rows (see
+    # process_fy_parallel). Each step is emitted as LotEvents to the FY report
+    # sink and to any extra sinks (report_sinks.py), so every output is
+    # rendered from the same run. inherited_costs (trade_linker.TradeLinks.costs)
+    # replaces the Value amount of crypto-to-crypto inflows; fee_trades
+    # (fee_index.FeeIndex.fees) names the trade each fee belongs to, by ledger
+    # position, and fees missing from it fall back to the currency's last trade.
+    SECTIONS = ('buys', 'buys_for_others', 'sales', 'fees', 'others')
+    FIXED = False
+
+    def __init__(self, buys_for_others_mapping, sinks=(), inherited_costs=None, fee_trades=None):
+        self.lots_by_ccy = defaultdict(LotStore)
+        self.balance_units = defaultdict(lambda: Decimal('0'))
+        self.balance_value = defaultdict(lambda: Decimal('0'))
+
+        self.fy_sink = FYReportSink()
+        self.fy_totals = FYTotalsSink()
+        self.sinks = [self.fy_sink, self.fy_totals, *sinks]
+        bind_numbers(self.sinks, self.FIXED)
+        self.last_trans_per_ccy = defaultdict(str)
+        self.last_trans_ref_per_ccy = defaultdict(str)
+
+        self.buy_refs_for_others = set()
+        for ccy, refs in buys_for_others_mapping.items():
+            for ref in refs.keys():
+                self.buy_refs_for_others.add((ccy, ref))
+        self.other_refs_by_ts = index_others_by_timestamp(buys_for_others_mapping)
+
+        self.buy_id_gens = {}
+        self.sell_id_gens = {}
+        self.inherited_costs = {} if inherited_costs is None else inherited_costs
+        self.fee_trades = {} if fee_trades is None else fee_trades
+
+    def per_fy(self):
+        return self.fy_sink.per_fy()
+
+    def open_lots(self, ccy):
+        return self.lots_by_ccy[ccy]
+
+    def balance(self, ccy):
+        # (units, value) of ccy as Decimals
+        return self.balance_units[ccy], self.balance_value[ccy]
+
+    def ccy_balance(self, ccy):
+        # ccy's balance rows and rounded (units, value), or None before its
+        # first row
+        if ccy not in self.lots_by_ccy:
+            return None
+        units, value = self.balance(ccy)
+        return ccy_balance_rows(ccy, self.open_lots(ccy), units, value), (r8(units), r2(value))
+
+    def report(self, fy):
+        balance_rows = []
+        for ccy in sorted(self.lots_by_ccy):
+            balance_rows.extend(self.ccy_balance(ccy)[0])
+        return render_fy_report(fy, *(per_fy[fy] for per_fy in self.per_fy()), balance_rows)
+
+    def summary(self, fy):
+        return FYSummary(fy, *self.fy_totals.fy_totals(fy),
+                         {ccy: (r8(units), r2(value)) for ccy in sorted(self.lots_by_ccy)
+                          for units, value in [self.balance(ccy)]})
+
+    def close(self, fy):
+        # Drop the records of fy and earlier once its report is written
+        for per_fy in (*self.per_fy(), self.fy_totals.totals):
+            for k in [k for k in per_fy if k <= fy]:
+                del per_fy[k]
+
+    def snapshot(self, closed_fy):
+        # Everything needed to resume after closed_fy's report was written
+        return {
+            'lots_by_ccy': {c: [self.save_lot(lot) for lot in lots] for c, lots in self.lots_by_ccy.items()},
+            'balance_units': dict(self.balance_units),
+            'balance_value': dict(self.balance_value),
+            'last_trans_per_ccy': dict(self.last_trans_per_ccy),
+            'last_trans_ref_per_ccy': dict(self.last_trans_ref_per_ccy),
+            'buy_ids': {c: gen.count for c, gen in self.buy_id_gens.items()},
+            'sell_ids': {c: gen.count for c, gen in self.sell_id_gens.items()},
+            'pending': {name: {k: v for k, v in per_fy.items() if k > closed_fy}
+                        for name, per_fy in zip(self.SECTIONS, self.per_fy())},
+            'totals': {k: v for k, v in self.fy_totals.totals.items() if k > closed_fy},
+        }
+
+    def restore(self, state):
+        for ccy, lots in state['lots_by_ccy'].items():
+            self.lots_by_ccy[ccy] = LotStore(self.load_lot(*lot) for lot in lots)
+        self.balance_units.update(state['balance_units'])
+        self.balance_value.update(state['balance_value'])
+        self.last_trans_per_ccy.update(state['last_trans_per_ccy'])
+        self.last_trans_ref_per_ccy.update(state['last_trans_ref_per_ccy'])
+        self.buy_id_gens = {c: gen_txn_ids(f'B_{c.upper()}_', n) for c, n in state['buy_ids'].items()}
+        self.sell_id_gens = {c: gen_txn_ids(f'S_{c.upper()}_', n) for c, n in state['sell_ids'].items()}
+        for name, per_fy in zip(self.SECTIONS, self.per_fy()):
+            per_fy.update(state['pending'][name])
+        self.fy_totals.totals.update(state['totals'])
+
+    def save_lot(self, lot):
+        return lot.qty, lot.unit_cost, lot.ref
+
+    def load_lot(self, qty, unit_cost, ref):
+        return Lot(qty=qty, unit_cost=unit_cost, ref=ref)
+
+    def fee_trade(self, pos, ccy):
+        # (trans ref, description, reference) of the trade the fee at pos
+        # belongs to, and whether that trade is a buy matched to an Other
+        trade = self.fee_trades.pop(pos, None)
+        if trade is None:
+            trade = (self.last_trans_ref_per_ccy[ccy], self.last_trans_per_ccy[ccy], '')
+        return trade, classify(trade[1]).buy and (ccy, trade[2]) in self.buy_refs_for_others
+
+    def emit(self, *fields):
+        ev = LotEvent(*fields)
+        for sink in self.sinks:
+            sink.event(ev)
+
+    def process(self, row, pos=None):
+        ccy = row.currency
+        dt = row.dt
+        fy = financial_year(dt)
+        qty_delta = row.balance_delta
+        desc = row.description
+        ref = row.reference
+        value_amount = row.value_amount
+
+        if qty_delta == 0:
+            return
+        kind = classify(desc)
+
+        if kind.fee:
+            trade, for_other = self.fee_trade(pos, ccy)
+            self.balance_units[ccy] += qty_delta
+            self.balance_value[ccy] -= value_amount
+            self.emit('fee', pos, row, fy, trade[0], '', qty_delta, ZERO, ZERO, ZERO, ZERO,
+                      self.balance_units[ccy], self.balance_value[ccy], trade[1], for_other)
+            return
+
+        if qty_delta > 0:
+            # Buys, and any other inflow, open a lot
             qty = qty_delta
+            if row.trade is not None:
+                value_amount = self.inherited_costs.get((ccy, row.timestamp, ref), value_amount)
             unit_cost = value_amount / qty if qty != 0 else Decimal('0')
-            lots_by_ccy[ccy].append(Lot(qty=qty, unit_cost=unit_cost, ref=ref))
-            balance_units[ccy] += qty
+            self.lots_by_ccy[ccy].append(Lot(qty=qty, unit_cost=unit_cost, ref=ref))
+            if run_metrics.active is not None:
+                run_metrics.active.queue_depth(ccy, len(self.lots_by_ccy[ccy]))
+            self.balance_units[ccy] += qty
             total_cost = qty * unit_cost
-            balance_value[ccy] += total_cost
-            if ccy not in buy_id_gens:
-                buy_id_gens[ccy] = gen_txn_ids(f'B_{ccy.upper()}_')
-            trans_id = next(buy_id_gens[ccy])
-            last_trans_per_ccy[ccy] = desc
-            last_trans_ref_per_ccy[ccy] = trans_id
-
-            buys_per_fy[fy].append({
-                'Date': row['Timestamp (UTC)'],
-                'Currency': ccy,
-                'Description': desc,
-                'Trans Ref': trans_id,
-                'Lot Ref': ref,
-                'Qty Bought': q8(qty),
-                'Unit Cost': s2(unit_cost),
-                'Total Cost': s2(total_cost),
-                'Proceeds': s2(Decimal('0')),
-                'Profit': s2(Decimal('0')),
-                'Fee (ZAR)': s2(Decimal('0')),
-            })
+            self.balance_value[ccy] += total_cost
+            if ccy not in self.buy_id_gens:
+                self.buy_id_gens[ccy] = gen_txn_ids(f'B_{ccy.upper()}_')
+            trans_id = next(self.buy_id_gens[ccy])
+            self.last_trans_per_ccy[ccy] = desc
+            self.last_trans_ref_per_ccy[ccy] = trans_id
+
+            is_for_other = kind.buy and (ccy, ref) in self.buy_refs_for_others
+            self.emit('open', pos, row, fy, trans_id, ref, qty, unit_cost, total_cost, ZERO, ZERO,
+                      self.balance_units[ccy], self.balance_value[ccy], '', is_for_other)
 
         else:
             sell_qty = -qty_delta
             proceeds_total = value_amount
-            trans_type = 'Sell' if desc.startswith('Sold') else 'Other'
-            if not lots_by_ccy[ccy]:
-                lots_by_ccy[ccy].append(Lot(qty=Decimal('0'), unit_cost=Decimal('0'), ref='N/A'))
-
-            if ccy not in sell_id_gens:
-                sell_id_gens[ccy] = gen_txn_ids(f'S_{ccy.upper()}_')
-            trans_id = next(sell_id_gens[ccy])
-            last_trans_ref_per_ccy[ccy] = trans_id
+            trans_type = 'Sell' if kind.sell else 'Other'
+            kind = 'consume' if trans_type == 'Sell' else 'other'
+            if not self.lots_by_ccy[ccy]:
+                self.lots_by_ccy[ccy].append(Lot(qty=Decimal('0'), unit_cost=Decimal('0'), ref='N/A'))
+
+            if ccy not in self.sell_id_gens:
+                self.sell_id_gens[ccy] = gen_txn_ids(f'S_{ccy.upper()}_')
+            trans_id = next(self.sell_id_gens[ccy])
+            self.last_trans_ref_per_ccy[ccy] = trans_id
             remaining = sell_qty
             total_qty_for_sale = sell_qty
-            
+
             matched_lot_ref = None
-            if trans_type == 'Other' and ccy in buys_for_others_mapping:
-                for buy_ref, match_info in buys_for_others_mapping[ccy].items():
-                    if match_info['other_timestamp'] == row['Timestamp (UTC)']:
-                        matched_lot_ref = buy_ref
-                        break
-            
+            if trans_type == 'Other':
+                matched_lot_ref = self.other_refs_by_ts.get((ccy, row.timestamp))
+
             if matched_lot_ref:
-                idx, lot = find_lot_by_ref(lots_by_ccy[ccy], matched_lot_ref)
+                idx, lot = self.lots_by_ccy[ccy].find(matched_lot_ref)
                 if lot is not None:
                     consume = lot.qty if lot.qty <= remaining else remaining
                     unit_cost = lot.unit_cost
                     total_cost = consume * unit_cost
-                    split_proceeds = Decimal('0')
-                    profit = Decimal('0')
-                    
+
                     lot.qty -= consume
                     if lot.qty <= Decimal('0.0000000001'):
-                        del lots_by_ccy[ccy][idx]
-                    
-                    balance_units[ccy] -= consume
-                    balance_value[ccy] -= total_cost
-                    
-                    others_per_fy[fy].append({
-                        'Date': row['Timestamp (UTC)'],
-                        'Currency': ccy,
-                        'Description': desc,
-                        'Trans Ref': trans_id,
-                        'Lot Ref': matched_lot_ref,
-                        'Qty Sold': q8(-consume),
-                        'Unit Cost': s2(unit_cost),
-                        'Total Cost': s2(total_cost.copy_abs()),
-                        'Proceeds': s2(split_proceeds),
-                        'Profit': s2(profit),
-                        'Fee (ZAR)': s2(Decimal('0')),
-                    })
+                        self.lots_by_ccy[ccy].remove_at(idx)
+                    elif run_metrics.active is not None:
+                        run_metrics.active.lot_split(ccy)
+
+                    self.balance_units[ccy] -= consume
+                    self.balance_value[ccy] -= total_cost
+                    self.emit('other', pos, row, fy, trans_id, matched_lot_ref, -consume, unit_cost, total_cost, ZERO,
+                              ZERO, self.balance_units[ccy], self.balance_value[ccy], '', True)
                     remaining -= consume
-            
-            while remaining > Decimal('0.0000000001') and lots_by_ccy[ccy]:
-                lot = lots_by_ccy[ccy][0]
+
+            while remaining > Decimal('0.0000000001') and self.lots_by_ccy[ccy]:
+                lot = self.lots_by_ccy[ccy].first()
                 consume = lot.qty if lot.qty <= remaining else remaining
                 if consume <= 0:
                     break
@@ -576,93 +1085,440 @@ def process_fy(csv_files, output_dir, timestamp):
 
                 lot.qty -= consume
                 if lot.qty <= Decimal('0.0000000001'):
-                    lots_by_ccy[ccy].popleft()
-
-                balance_units[ccy] -= consume
-                balance_value[ccy] -= total_cost
-
-                if trans_type == 'Sell':
-                    sales_per_fy[fy].append({
-                        'Date': row['Timestamp (UTC)'],
-                        'Currency': ccy,
-                        'Description': desc,
-                        'Trans Ref': trans_id,
-                        'Lot Ref': lot.ref,
-                        'Qty Sold': q8(-consume),
-                        'Unit Cost': s2(unit_cost),
-                        'Total Cost': s2(total_cost.copy_abs()),
-                        'Proceeds': s2(split_proceeds),
-                        'Profit': s2(profit),
-                        'Fee (ZAR)': s2(Decimal('0')),
-                    })
-                else:
-                    others_per_fy[fy].append({
-                        'Date': row['Timestamp (UTC)'],
-                        'Currency': ccy,
-                        'Description': desc,
-                        'Trans Ref': trans_id,
-                        'Lot Ref': lot.ref,
-                        'Qty Sold': q8(-consume),
-                        'Unit Cost': s2(unit_cost),
-                        'Total Cost': s2(total_cost.copy_abs()),
-                        'Proceeds': s2(split_proceeds),
-                        'Profit': s2(profit),
-                        'Fee (ZAR)': s2(Decimal('0')),
-                    })
+                    self.lots_by_ccy[ccy].popleft()
+                elif run_metrics.active is not None:
+                    run_metrics.active.lot_split(ccy)
+
+                self.balance_units[ccy] -= consume
+                self.balance_value[ccy] -= total_cost
+                self.emit(kind, pos, row, fy, trans_id, lot.ref, -consume, unit_cost, total_cost, split_proceeds, profit,
+                          self.balance_units[ccy], self.balance_value[ccy], '', False)
                 remaining -= consume
 
             if remaining > Decimal('0.0000000001'):
-                unit_cost = Decimal('0')
-                total_cost = Decimal('0')
                 split_proceeds = proceeds_total * (remaining / total_qty_for_sale) if total_qty_for_sale > 0 else Decimal('0')
-                profit = split_proceeds - total_cost
+                profit = split_proceeds - ZERO
                 if trans_type == 'Other':
                     split_proceeds = Decimal('0')
                     profit = Decimal('0')
-                balance_units[ccy] -= remaining
-                if trans_type == 'Sell':
-                    sales_per_fy[fy].append({
-                        'Date': row['Timestamp (UTC)'],
-                        'Currency': ccy,
-                        'Description': desc,
-                        'Trans Ref': trans_id,
-                        'Lot Ref': 'N/A',
-                        'Qty Sold': q8(-remaining),
-                        'Unit Cost': s2(unit_cost),
-                        'Total Cost': s2(total_cost.copy_abs()),
-                        'Proceeds': s2(split_proceeds),
-                        'Profit': s2(profit),
-                        'Fee (ZAR)': s2(Decimal('0')),
-                    })
-                else:
-                    others_per_fy[fy].append({
-                        'Date': row['Timestamp (UTC)'],
-                        'Currency': ccy,
-                        'Description': desc,
-                        'Trans Ref': trans_id,
-                        'Lot Ref': 'N/A',
-                        'Qty Sold': q8(-remaining),
-                        'Unit Cost': s2(unit_cost),
-                        'Total Cost': s2(total_cost.copy_abs()),
-                        'Proceeds': s2(split_proceeds),
-                        'Profit': s2(profit),
-                        'Fee (ZAR)': s2(Decimal('0')),
-                    })
-
-            last_trans_per_ccy[ccy] = desc
+                self.balance_units[ccy] -= remaining
+                self.emit(kind, pos, row, fy, trans_id, 'N/A', -remaining, ZERO, ZERO, split_proceeds, profit,
+                          self.balance_units[ccy], self.balance_value[ccy], '', False)
+
+            self.last_trans_per_ccy[ccy] = desc
+
+
+class FixedLot:
+    # Units left, plus the amount and units the lot opened with, so every
+    # cost is taken from the lot's own ratio and whole-lot consumption is exact
+    __slots__ = ('qty', 'amt', 'units', 'ref')
+    def __init__(self, qty: int, amt: int, units: int, ref: str):
+        self.qty = qty
+        self.amt = amt
+        self.units = units
+        self.ref = ref
+
+
+class FixedFYEngine(FYEngine):
+    # FYEngine on fixed-point integers (fixed_point.py), as build_fifo_rows_fixed
+    # computes the per-file ledgers: quantities in 1e-8 coin, amounts in 1e-10
+    # ZAR. Events carry the integers too, and the sinks render them through
+    # FIXED_NUMBERS, so Decimals are only made for the FY-end balances.
+    FIXED = True
+
+    def __init__(self, buys_for_others_mapping, sinks=(), inherited_costs=None, fee_trades=None):
+        super().__init__(buys_for_others_mapping, sinks, inherited_costs, fee_trades)
+        self.balance_units = defaultdict(int)
+        self.balance_value = defaultdict(int)
+
+    def open_lots(self, ccy):
+        return [Lot(qty=qty_decimal(lot.qty), unit_cost=amt_decimal(unit_cost(lot.amt, lot.units)), ref=lot.ref)
+                for lot in self.lots_by_ccy[ccy]]
+
+    def balance(self, ccy):
+        return qty_decimal(self.balance_units[ccy]), amt_decimal(self.balance_value[ccy])
+
+    def save_lot(self, lot):
+        return lot.qty, lot.amt, lot.units, lot.ref
+
+    def load_lot(self, qty, amt, units, ref):
+        return FixedLot(qty, amt, units, ref)
+
+    def process(self, row, pos=None):
+        ccy = row.currency
+        qty_delta = row.balance_delta
+        if qty_delta == 0:
+            return
+        fy = financial_year(row.dt)
+        desc = row.description
+        ref = row.reference
+        kind = classify(desc)
+        units = to_units(qty_delta)
+
+        if kind.fee:
+            trade, for_other = self.fee_trade(pos, ccy)
+            self.balance_units[ccy] += units
+            self.balance_value[ccy] -= to_amt(row.value_amount)
+            self.emit('fee', pos, row, fy, trade[0], '', units, 0, 0, 0, 0, self.balance_units[ccy], self.balance_value[ccy],
+                      trade[1], for_other)
+            return
+
+        lots = self.lots_by_ccy[ccy]
+        if units > 0:
+            value_amount = row.value_amount
+            if row.trade is not None:
+                value_amount = self.inherited_costs.get((ccy, row.timestamp, ref), value_amount)
+            amt = to_amt(value_amount)
+            lots.append(FixedLot(units, amt, units, ref))
+            if run_metrics.active is not None:
+                run_metrics.active.queue_depth(ccy, len(lots))
+            self.balance_units[ccy] += units
+            self.balance_value[ccy] += amt
+            if ccy not in self.buy_id_gens:
+                self.buy_id_gens[ccy] = gen_txn_ids(f'B_{ccy.upper()}_')
+            trans_id = next(self.buy_id_gens[ccy])
+            self.last_trans_per_ccy[ccy] = desc
+            self.last_trans_ref_per_ccy[ccy] = trans_id
+            is_for_other = kind.buy and (ccy, ref) in self.buy_refs_for_others
+            self.emit('open', pos, row, fy, trans_id, ref, units, unit_cost(amt, units), amt, 0, 0, self.balance_units[ccy],
+                      self.balance_value[ccy], '', is_for_other)
+            return
+
+        sell_qty = -units
+        proceeds_total = to_amt(row.value_amount)
+        is_sell = kind.sell
+        kind = 'consume' if is_sell else 'other'
+        if not lots:
+            lots.append(FixedLot(0, 0, 0, 'N/A'))
+        if ccy not in self.sell_id_gens:
+            self.sell_id_gens[ccy] = gen_txn_ids(f'S_{ccy.upper()}_')
+        trans_id = next(self.sell_id_gens[ccy])
+        self.last_trans_ref_per_ccy[ccy] = trans_id
+        remaining = sell_qty
+
+        matched_lot_ref = None if is_sell else self.other_refs_by_ts.get((ccy, row.timestamp))
+        if matched_lot_ref:
+            idx, lot = lots.find(matched_lot_ref)
+            if lot is not None:
+                consume = lot.qty if lot.qty <= remaining else remaining
+                cost = share(lot.amt, consume, lot.units) if lot.units else 0
+                lot.qty -= consume
+                if lot.qty <= 0:
+                    lots.remove_at(idx)
+                elif run_metrics.active is not None:
+                    run_metrics.active.lot_split(ccy)
+                self.balance_units[ccy] -= consume
+                self.balance_value[ccy] -= cost
+                self.emit('other', pos, row, fy, trans_id, matched_lot_ref, -consume, unit_cost(lot.amt, lot.units), cost,
+                          0, 0, self.balance_units[ccy], self.balance_value[ccy], '', True)
+                remaining -= consume
+
+        # A zero-qty head lot stops consumption, as in FYEngine
+        while remaining > 0 and lots:
+            lot = lots.first()
+            consume = lot.qty if lot.qty <= remaining else remaining
+            if consume <= 0:
+                break
+            cost = share(lot.amt, consume, lot.units)
+            proceeds = share(proceeds_total, consume, sell_qty) if is_sell else 0
+            profit = proceeds - cost if is_sell else 0
+            lot.qty -= consume
+            if lot.qty <= 0:
+                lots.popleft()
+            elif run_metrics.active is not None:
+                run_metrics.active.lot_split(ccy)
+            self.balance_units[ccy] -= consume
+            self.balance_value[ccy] -= cost
+            self.emit(kind, pos, row, fy, trans_id, lot.ref, -consume, unit_cost(lot.amt, lot.units), cost, proceeds,
+                      profit, self.balance_units[ccy], self.balance_value[ccy], '', False)
+            remaining -= consume
+
+        if remaining > 0:
+            proceeds = share(proceeds_total, remaining, sell_qty) if is_sell else 0
+            self.balance_units[ccy] -= remaining
+            self.emit(kind, pos, row, fy, trans_id, 'N/A', -remaining, 0, 0, proceeds, proceeds, self.balance_units[ccy],
+                      self.balance_value[ccy], '', False)
+
+        self.last_trans_per_ccy[ccy] = desc
+
+
+def opens_fy(row):
+    # Only non-fee movements advance the current FY; fees never close a year
+    return row.balance_delta != 0 and not classify(row.description).fee
+
+
+def process_fy(csv_files, output_dir, timestamp, checkpoint_file=CHECKPOINT_FILE, buys_for_others_mapping=None, rows=None,
+               sinks=(), fixed=False):
+    # Returns {fy: FYSummary} for every FY written. sinks (report_sinks.py)
+    # see the same lot events and are written at the end. fixed runs the
+    # fixed-point engine (FixedFYEngine).
+    if buys_for_others_mapping is None:
+        buys_for_others_mapping = load_buys_for_others_mapping()
+    
+    if rows is None:
+        rows = load_ledger(csv_files)
+
+    links = TradeLinks().link(rows)
+    fees = FeeIndex().build(rows)
+    engine = (FixedFYEngine if fixed else FYEngine)(buys_for_others_mapping, sinks, links.costs, fees.fees)
+    current_fy = None
 
+    # Resume from the last FY boundary whose input prefix is unchanged: closed
+    # years are rewritten from their stored report rows and only the tail is
+    # replayed.
+    checkpoints = load_checkpoints(checkpoint_file)
+    # Only boundaries that also saved every requested sink, from the same
+    # engine, can be resumed from
+    sink_names = {sink.NAME for sink in sinks}
+    for n, cp in enumerate(checkpoints):
+        if not sink_names <= set(cp.get('sink_names', ())) or cp.get('fixed', False) != fixed:
+            checkpoints = checkpoints[:n]
+            break
+    kept, digest = find_resume_point(rows, checkpoints, engine.buy_refs_for_others, engine.other_refs_by_ts)
+    checkpoints = checkpoints[:kept]
+    start = 0
+    summaries = {}
+    if checkpoints:
+        for cp in checkpoints:
+            write_fy_report(cp['fy'], cp['report'], output_dir)
+            summaries[cp['fy']] = cp['summary']
+        if sinks:
+            saved = [pickle.loads(cp['sinks']) for cp in checkpoints]
+            for sink in sinks:
+                sink.restore([snaps[sink.NAME] for snaps in saved])
+        cp = checkpoints[-1]
+        engine.restore(pickle.loads(cp['state']))
+        start = cp['index']
+        if start < len(rows):
+            current_fy = financial_year(rows[start].dt)
+        print(f"Resumed from FY{cp['fy']} checkpoint at row {start} of {len(rows)}")
+    new_boundaries = []
+
+    for i in range(start, len(rows)):
+        row = rows[i]
+        if opens_fy(row):
+            fy = financial_year(row.dt)
+            if current_fy is not None and fy != current_fy:
+                report_rows = engine.report(current_fy)
+                write_fy_report(current_fy, report_rows, output_dir)
+                summaries[current_fy] = engine.summary(current_fy)
+                if checkpoint_file:
+                    state = engine.snapshot(current_fy)
+                    new_boundaries.append({'fy': current_fy, 'index': i, 'report': report_rows,
+                                           'summary': summaries[current_fy],
+                                           'state': pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL),
+                                           'sink_names': sorted(sink_names), 'fixed': fixed,
+                                           'sinks': pickle.dumps({sink.NAME: sink.snapshot() for sink in sinks},
+                                                                 protocol=pickle.HIGHEST_PROTOCOL)})
+                engine.close(current_fy)
+            current_fy = fy
+        engine.process(row, i)
+
+    if current_fy is not None:
+        write_fy_report(current_fy, engine.report(current_fy), output_dir)
+        summaries[current_fy] = engine.summary(current_fy)
+    for sink in sinks:
+        sink.write(output_dir)
+    write_linked_trades(links.links, output_dir)
+
+    if checkpoint_file:
+        pos = checkpoints[-1]['index'] if checkpoints else 0
+        for cp in new_boundaries:
+            _advance_digest(digest, rows, pos, cp['index'], engine.buy_refs_for_others, engine.other_refs_by_ts)
+            pos = cp['index']
+            cp['digest'] = digest.hexdigest()
+            checkpoints.append(cp)
+        save_checkpoints(checkpoint_file, checkpoints)
+
+    return summaries
+
+
+def process_fy_stream(csv_files, output_dir, buys_for_others_mapping=None, rows=None, sinks=(), fixed=False):
+    # Generator form of process_fy over a lazy, time-ordered row stream
+    # (ledger.iter_ledger by default): yields each FY's FYSummary as its report
+    # is written, so only open lots and the current FY's records are held:
+    # the sinks flush their rows to disk at every FY boundary too. No
+    # checkpoints, as those need the whole ledger up front.
+    if buys_for_others_mapping is None:
+        buys_for_others_mapping = load_buys_for_others_mapping()
+
+    if rows is None:
+        rows = iter_ledger(csv_files)
+
+    links = TradeLinks()
+    fees = FeeIndex()
+    engine = (FixedFYEngine if fixed else FYEngine)(buys_for_others_mapping, sinks, links.costs, fees.fees)
+    current_fy = None
+    for i, row in enumerate(fees.stream(links.stream(rows))):
+        if opens_fy(row):
+            fy = financial_year(row.dt)
+            if current_fy is not None and fy != current_fy:
+                write_fy_report(current_fy, engine.report(current_fy), output_dir)
+                summary = engine.summary(current_fy)
+                engine.close(current_fy)
+                for sink in sinks:
+                    sink.flush(output_dir)
+                yield summary
+            current_fy = fy
+        engine.process(row, i)
+
+    for sink in sinks:
+        sink.write(output_dir)
+    write_linked_trades(links.links, output_dir)
     if current_fy is not None:
-        generate_fy_report(current_fy, buys_per_fy[current_fy], buys_for_others_per_fy[current_fy], sales_per_fy[current_fy], fees_per_fy[current_fy], others_per_fy[current_fy], lots_by_ccy, balance_units, balance_value, output_dir, timestamp)
+        write_fy_report(current_fy, engine.report(current_fy), output_dir)
+        yield engine.summary(current_fy)
+
+
+def fy_boundaries(rows):
+    # [(index of the first row of the next FY, closed FY)], plus the last FY
+    boundaries = []
+    current_fy = None
+    for i, row in enumerate(rows):
+        if opens_fy(row):
+            fy = financial_year(row.dt)
+            if current_fy is not None and fy != current_fy:
+                boundaries.append((i, current_fy))
+            current_fy = fy
+    return boundaries, current_fy
+
+
+def _fy_currency_worker(task):
+    # Runs one currency through its own FYEngine. Records come back as
+    # (ledger index, csv row) pairs so the parent can merge currencies in
+    # ledger order, plus this currency's balance rows and (units, value) at
+    # every FY boundary and its gain and loss totals per FY.
+    ccy, indexed_rows, boundary_indexes, buys_for_others_mapping, sinks, inherited_costs, fee_trades, fixed, instrument = task
+    # Forked workers inherit the parent's metrics; start from a clean slate
+    run_metrics.enable() if instrument else run_metrics.disable()
+    engine = (FixedFYEngine if fixed else FYEngine)(buys_for_others_mapping, sinks, inherited_costs, fee_trades)
+    sections = {}
+    balances = []
+
+    b = 0
+    for i, row in indexed_rows:
+        while b < len(boundary_indexes) and boundary_indexes[b] <= i:
+            balances.append(engine.ccy_balance(ccy))
+            b += 1
+        fy = financial_year(row.dt)
+        lists = [per_fy[fy] for per_fy in engine.per_fy()]
+        before = [len(records) for records in lists]
+        engine.process(row, i)
+        out = sections.get(fy)
+        for k, records in enumerate(lists):
+            if len(records) == before[k]:
+                continue
+            if out is None:
+                out = sections[fy] = ([], [], [], [], [])
+            out[k].extend((i, record) for record in records[before[k]:])
+            del records[before[k]:]
+    while b <= len(boundary_indexes):
+        balances.append(engine.ccy_balance(ccy))
+        b += 1
+    totals = {fy: engine.fy_totals.fy_totals(fy) for fy in engine.fy_totals.totals}
+    return ccy, sections, balances, run_metrics.active and run_metrics.active.export(), sinks, totals
+
+
+def process_fy_parallel(csv_files, output_dir, timestamp, buys_for_others_mapping=None, rows=None, workers=None,
+                        sinks=(), fixed=False):
+    # Same reports as process_fy, with each currency's FIFO run on a worker
+    # process. Every piece of engine state is per currency; the only shared
+    # thing is where FYs close, which is fixed up front from the merged
+    # ledger. Always a full replay (no checkpoints).
+    if buys_for_others_mapping is None:
+        buys_for_others_mapping = load_buys_for_others_mapping()
+
+    if rows is None:
+        rows = load_ledger(csv_files)
+
+    boundaries, last_fy = fy_boundaries(rows)
+    boundary_indexes = [i for i, _ in boundaries]
+    indexed_by_ccy = defaultdict(list)
+    for i, row in enumerate(rows):
+        indexed_by_ccy[row.currency].append((i, row))
+    # Trades are linked and fees attributed across the whole ledger here; each
+    # worker gets its inflows' costs and its fees' trades
+    links = TradeLinks().link(rows)
+    costs_by_ccy = defaultdict(dict)
+    for key, cost in links.costs.items():
+        costs_by_ccy[key[0]][key] = cost
+    fee_trades_by_ccy = defaultdict(dict)
+    for pos, trade in FeeIndex().build(rows).fees.items():
+        fee_trades_by_ccy[rows[pos].currency][pos] = trade
+    instrument = run_metrics.active is not None
+    # Each worker fills its own copy of the sinks; they are merged back here
+    bind_numbers(sinks, fixed)
+    tasks = [(ccy, indexed_by_ccy[ccy], boundary_indexes, buys_for_others_mapping, sinks, costs_by_ccy[ccy],
+              fee_trades_by_ccy[ccy], fixed, instrument)
+             for ccy in sorted(indexed_by_ccy)]
+
+    workers = workers or os.cpu_count() or 1
+    # Workers are given the FY start too, for platforms that spawn rather than fork
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks))), initializer=set_financial_year_start,
+                             initargs=(FY_START_MONTH,)) as pool:
+        results = list(pool.map(_fy_currency_worker, tasks))
+    if instrument:
+        for result in results:
+            run_metrics.active.absorb(result[3])
+    for result in results:
+        for sink, filled in zip(sinks, result[4]):
+            sink.merge(filled)
+    for sink in sinks:
+        sink.write(output_dir)
+    write_linked_trades(links.links, output_dir)
+
+    summaries = {}
+    if last_fy is None:
+        return summaries
+    for k, fy in enumerate([fy for _, fy in boundaries] + [last_fy]):
+        merged = []
+        for section in range(5):
+            streams = [result[1][fy][section] for result in results if fy in result[1]]
+            merged.append([payload for _, payload in heapq.merge(*streams, key=itemgetter(0))])
+        balance_rows = []
+        balances = {}
+        totals = [ZERO] * 6
+        for ccy, _, ccy_balances, _, _, ccy_totals in results:
+            if ccy_balances[k] is not None:
+                balance_rows.extend(ccy_balances[k][0])
+                balances[ccy] = ccy_balances[k][1]
+            for j, total in enumerate(ccy_totals.get(fy, ())):
+                totals[j] += total
+        report_rows = render_fy_report(fy, merged[0], merged[1], merged[2], merged[3], merged[4], balance_rows)
+        write_fy_report(fy, report_rows, output_dir)
+        summaries[fy] = FYSummary(fy, *totals, balances)
+    return summaries
 
 
 if __name__ == '__main__':
+    import report_sinks
+    import report_store
+    import stage_cache
+    from ledger import scan_file, file_digest
+
     data_dir = '../data'
     csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
     timestamp = datetime.now().strftime('%Y_%m_%d_%H%M')
     output_dir = os.path.join('../reports', timestamp)
     os.makedirs(output_dir, exist_ok=True)
-    for csv_file in csv_files:
-        base = os.path.basename(csv_file).rsplit('.', 1)[0]
-        output_csv = os.path.join(output_dir, f"{base}_fifo.csv")
-        main(csv_file, output_csv)
-    process_fy(csv_files, output_dir, timestamp)
+    stage_cache.release_links(output_dir)
+    fixed = '--fixed' in sys.argv
+    parallel = '--parallel' in sys.argv
+    stream = '--stream' in sys.argv
+    if '--metrics' in sys.argv:
+        run_metrics.enable()
+    names = report_sinks.ledger_names({csv_file: scan_file(csv_file)[1] for csv_file in csv_files})
+    sinks = report_sinks.default_sinks(names)
+    with run_metrics.stage('fy_reports'):
+        if parallel:
+            process_fy_parallel(csv_files, output_dir, timestamp, sinks=sinks, fixed=fixed)
+        elif stream:
+            for _ in process_fy_stream(csv_files, output_dir, sinks=sinks, fixed=fixed):
+                pass
+        else:
+            process_fy(csv_files, output_dir, timestamp, sinks=sinks, fixed=fixed)
+    if run_metrics.active is not None:
+        run_metrics.active.write(output_dir)
+    # Committed as the pipeline does, so overview_report.py and the other
+    # latest-run readers find this run
+    report_store.commit_run(output_dir, {os.path.basename(csv_file): file_digest(csv_file) for csv_file in csv_files})
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# Point-in-time holdings: what was held of a currency at any moment, at what
+# base cost, and in which open lots. report_sinks.HoldingsSink writes
+# holdings.pickle to each report folder from the FIFO engine's lot events,
+# through HoldingsWriter (which stream mode feeds one FY at a time):
+#
+#   per currency, chunks of CHUNK_EVENTS consecutive lot events, each with the
+#   open lots and running balance at its start (a sparse snapshot), then a
+#   header mapping each currency to its chunks' first timestamps and file
+#   offsets; the file ends with the header's offset.
+#
+# A query reads the header, bisects to the chunk covering the timestamp, loads
+# only that chunk and replays its events up to the timestamp from the
+# snapshot, so it takes milliseconds however long the history is.
+#
+#   python holdings.py 2023-02-28                  # every currency, latest run
+#   python holdings.py "2023-02-28 12:00:00" XBT ETH --lots
+#   python holdings.py 2023-02-28 --run ../reports/2025_10_01_1200
+import argparse
+import csv
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+from bisect import bisect_right
+from collections import namedtuple
+from decimal import Decimal
+
+HOLDINGS_FILE = 'holdings.pickle'
+HOLDINGS_VERSION = 1
+CHUNK_EVENTS = 512
+# Event kinds: a lot opened, taken from, or neither (fees, and the part of an
+# outflow no lot covered, which only move the balance)
+OPEN, TAKE, BALANCE = 0, 1, 2
+DUST = Decimal('0.0000000001')
+ZERO = Decimal('0')
+_OFFSET = struct.Struct('<Q')
+
+# units/value: the engine's running balance (Balance Units / Balance Value);
+# cost: what the open lots cost, which differs from value by fees taken from it
+Position = namedtuple('Position', ['currency', 'timestamp', 'units', 'value', 'cost', 'lots'])
+OpenLot = namedtuple('OpenLot', ['ref', 'qty', 'unit_cost', 'cost'])
+
+
+class _Lots:
+    # Open lots in FIFO order, [ref, qty, unit cost] each, with the lots of
+    # each ref by open order. Takes come one per lot split and always hit the
+    # oldest open lot with their ref, as in FYEngine; a buy matched to an Other
+    # can sit deep in the queue, so it is found through the ref index
+    def __init__(self, lots=()):
+        self.lots = {}
+        self.by_ref = {}
+        self.opened = 0
+        for lot in lots:
+            self.open(*lot)
+
+    def __len__(self):
+        return len(self.lots)
+
+    def __iter__(self):
+        return iter(self.lots.values())
+
+    def open(self, ref, qty, unit_cost):
+        self.lots[self.opened] = [ref, qty, unit_cost]
+        self.by_ref.setdefault(ref, []).append(self.opened)
+        self.opened += 1
+
+    def apply(self, kind, ref, qty, unit_cost):
+        if kind == OPEN:
+            self.open(ref, qty, unit_cost)
+        elif kind == TAKE:
+            seqs = self.by_ref.get(ref)
+            if seqs:
+                lot = self.lots[seqs[0]]
+                lot[1] += qty
+                if lot[1] <= DUST:
+                    del self.lots[seqs.pop(0)]
+                    if not seqs:
+                        del self.by_ref[ref]
+
+
+def _dump(obj, f):
+    # Without the memo, the bytes depend only on the values, not on which
+    # objects happen to be shared, so every Decimal engine mode (and a
+    # checkpoint resume) writes an identical file. --fixed stores its unit
+    # costs and values at 1e-10, so its file differs in bytes, not positions
+    pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.fast = True
+    pickler.dump(obj)
+
+
+class _Spill:
+    # One currency's chunks, written to a temporary file as they fill up
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.chunks = []
+        self.lots = _Lots()
+        self.balance = ('0', '0')
+        self.pending = []
+
+    def dump(self, final=False):
+        # A chunk holds at least CHUNK_EVENTS events and at least as many as
+        # the lots open at its start, so snapshots never outweigh the events
+        # themselves; only the last chunk may be short
+        pending = self.pending
+        start = 0
+        while start < len(pending) and (final or len(pending) - start >= max(CHUNK_EVENTS, len(self.lots))):
+            chunk = pending[start:start + max(CHUNK_EVENTS, len(self.lots))]
+            self.chunks.append((chunk[0][0], self.file.tell()))
+            _dump({'lots': [(ref, str(qty), str(unit_cost)) for ref, qty, unit_cost in self.lots],
+                   'balance': self.balance,
+                   'events': [(ts, kind, ref, str(qty), str(unit_cost), str(units), str(value))
+                              for ts, kind, ref, qty, unit_cost, units, value in chunk]}, self.file)
+            for _, kind, ref, qty, unit_cost, _, _ in chunk:
+                self.lots.apply(kind, ref, qty, unit_cost)
+            self.balance = (str(chunk[-1][5]), str(chunk[-1][6]))
+            start += len(chunk)
+        del pending[:start]
+
+
+class HoldingsWriter:
+    # Takes each currency's events (timestamp, kind, lot ref, qty, unit cost,
+    # balance units, balance value) in ledger order, a batch at a time, and
+    # holds only the chunks still filling up: full ones go to a temporary file
+    # per currency, which close() joins in currency order, so the file is the
+    # same however the events were batched. Decimals are stored as strings,
+    # which load several times faster
+    def __init__(self, path):
+        self.path = path
+        self._spills = {}
+
+    def add(self, ccy, events):
+        spill = self._spills.get(ccy)
+        if spill is None:
+            spill = self._spills[ccy] = _Spill()
+        spill.pending.extend(events)
+        spill.dump()
+
+    def close(self):
+        header = {'version': HOLDINGS_VERSION, 'currencies': {}}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            for ccy in sorted(self._spills):
+                spill = self._spills.pop(ccy)
+                spill.dump(final=True)
+                base = f.tell()
+                header['currencies'][ccy] = [(ts, base + offset) for ts, offset in spill.chunks]
+                spill.file.seek(0)
+                shutil.copyfileobj(spill.file, f)
+                spill.file.close()
+            offset = f.tell()
+            _dump(header, f)
+            f.write(_OFFSET.pack(offset))
+        os.replace(tmp, self.path)
+
+
+def write_holdings(events_by_ccy, path):
+    # events_by_ccy: {currency: [event, ...]} in ledger order (HoldingsWriter)
+    writer = HoldingsWriter(path)
+    for ccy, events in events_by_ccy.items():
+        writer.add(ccy, events)
+    writer.close()
+
+
+def normalize_timestamp(text):
+    # A date, or a time without seconds, means the end of that day (hour,
+    # minute)
+    text = text.strip().replace('T', ' ')
+    return text + ' 23:59:59'[len(text) - 10:] if 10 <= len(text) < 19 else text
+
+
+class Holdings:
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, HOLDINGS_FILE)
+        self.path = path
+        self._file = open(path, 'rb')
+        self._file.seek(-_OFFSET.size, os.SEEK_END)
+        (offset,) = _OFFSET.unpack(self._file.read(_OFFSET.size))
+        self._file.seek(offset)
+        header = pickle.load(self._file)
+        if header.get('version') != HOLDINGS_VERSION:
+            raise ValueError(f"{path}: holdings version {header.get('version')}, expected {HOLDINGS_VERSION}")
+        self._chunks = header['currencies']
+        self._starts = {ccy: [ts for ts, _ in chunks] for ccy, chunks in self._chunks.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def currencies(self):
+        return list(self._chunks)
+
+    def at(self, timestamp, currency):
+        # Position of currency after every ledger row up to and including
+        # timestamp ('YYYY-MM-DD HH:MM:SS', or a date for the end of that day).
+        # Fees dated after an FY end but before the next year's first trade
+        # are in that FY report's closing balances, not in the position at
+        # its last day
+        timestamp = normalize_timestamp(timestamp)
+        starts = self._starts.get(currency)
+        c = bisect_right(starts, timestamp) - 1 if starts else -1
+        if c < 0:
+            return Position(currency, timestamp, ZERO, ZERO, ZERO, [])
+        self._file.seek(self._chunks[currency][c][1])
+        chunk = pickle.load(self._file)
+        lots = _Lots((ref, Decimal(qty), Decimal(unit_cost)) for ref, qty, unit_cost in chunk['lots'])
+        events = chunk['events']
+        n = bisect_right(events, (timestamp, sys.maxsize))
+        for _, kind, ref, qty, unit_cost, _, _ in events[:n]:
+            if kind != BALANCE:
+                lots.apply(kind, ref, Decimal(qty), Decimal(unit_cost))
+        units, value = map(Decimal, events[n - 1][5:7] if n else chunk['balance'])
+        open_lots = [OpenLot(ref, qty, unit_cost, qty * unit_cost) for ref, qty, unit_cost in lots]
+        return Position(currency, timestamp, units, value, sum((lot.cost for lot in open_lots), ZERO), open_lots)
+
+
+def main():
+    import report_store
+    from fifo_report import q8, s2
+
+    parser = argparse.ArgumentParser(description='Holdings and base cost at a point in time.')
+    parser.add_argument('timestamp', help="'YYYY-MM-DD' (end of day), 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument('currencies', nargs='*', help='default: every currency')
+    parser.add_argument('--run', help='report folder (default: the latest run)')
+    parser.add_argument('--lots', action='store_true', help='list the open lots')
+    args = parser.parse_args()
+
+    run_dir = args.run or report_store.latest_run(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reports'))
+    if run_dir is None or not os.path.exists(os.path.join(run_dir, HOLDINGS_FILE)):
+        raise SystemExit(f"no {HOLDINGS_FILE} in {run_dir or 'the report store'}; run main.py first")
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['Currency', 'Timestamp', 'Units', 'Balance Value (ZAR)', 'Lot Cost (ZAR)', 'Lot Ref', 'Lot Qty',
+                     'Lot Unit Cost (ZAR)'])
+    with Holdings(run_dir) as holdings:
+        for ccy in args.currencies or holdings.currencies():
+            pos = holdings.at(args.timestamp, ccy.upper())
+            writer.writerow([pos.currency, pos.timestamp, q8(pos.units), s2(pos.value), s2(pos.cost), '', '', ''])
+            if args.lots:
+                for lot in pos.lots:
+                    writer.writerow([pos.currency, '', '', '', s2(lot.cost), lot.ref, q8(lot.qty), s2(lot.unit_cost)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# FIFO queue of open lots with O(1) lookup by lot ref. Lots removed out of
+# order (buys matched to Others) become None tombstones that are skipped and
+# dropped on periodic compaction, so removal never shifts the queue.
+
+COMPACT_MIN_TOMBSTONES = 64
+
+
+class LotStore:
+    __slots__ = ('_lots', '_head', '_live', '_by_ref')
+
+    def __init__(self, lots=()):
+        self._lots = []
+        self._head = 0
+        self._live = 0
+        self._by_ref = {}
+        for lot in lots:
+            self.append(lot)
+
+    def __len__(self):
+        return self._live
+
+    def __iter__(self):
+        for i in range(self._head, len(self._lots)):
+            lot = self._lots[i]
+            if lot is not None:
+                yield lot
+
+    def append(self, lot):
+        pos = len(self._lots)
+        self._lots.append(lot)
+        self._live += 1
+        positions = self._by_ref.get(lot.ref)
+        if positions is None:
+            self._by_ref[lot.ref] = [pos]
+        else:
+            positions.append(pos)
+
+    def first(self):
+        if not self._live:
+            raise IndexError('first() on empty LotStore')
+        return self._lots[self._head]
+
+    def popleft(self):
+        lot = self.first()
+        self._remove(self._head)
+        return lot
+
+    def find(self, ref):
+        # (position, lot) of the oldest open lot with this ref, or (None, None)
+        for pos in self._by_ref.get(ref, ()):
+            if pos >= self._head and self._lots[pos] is not None:
+                return pos, self._lots[pos]
+        return None, None
+
+    def remove_at(self, pos):
+        if pos < self._head or self._lots[pos] is None:
+            raise IndexError(f'no open lot at position {pos}')
+        self._remove(pos)
+
+    def _remove(self, pos):
+        self._lots[pos] = None
+        self._live -= 1
+        lots = self._lots
+        head = self._head
+        while head < len(lots) and lots[head] is None:
+            head += 1
+        self._head = head
+        dead = len(lots) - self._live
+        if dead >= COMPACT_MIN_TOMBSTONES and dead > self._live:
+            self._compact()
+
+    def _compact(self):
+        lots = [lot for lot in self._lots[self._head:] if lot is not None]
+        self._lots = []
+        self._head = 0
+        self._live = 0
+        self._by_ref = {}
+        for lot in lots:
+            self.append(lot)
@@ -1,25 +1,20 @@
 #!/usr/bin/env python3
-import subprocess
 import sys
-import os
 
-def run_script(script_name):
-    script_path = os.path.join(os.path.dirname(__file__), script_name)
-    print(f"\n{'='*50}")
-    print(f"Running {script_name}...")
-    print('='*50)
-    result = subprocess.run([sys.executable, script_path], cwd=os.path.dirname(__file__))
-    if result.returncode != 0:
-        print(f"Error: {script_name} failed with return code {result.returncode}")
-        sys.exit(result.returncode)
+from pipeline import run_pipeline
 
 def main():
     print("Crypto FIFO Tax Report Generator")
     print("================================")
     
-    run_script('identify_buys_for_others.py')
-    run_script('fifo_report.py')
-    run_script('overview_report.py')
+    # --fixed: the FIFO engine runs on fixed-point integers (same reports)
+    # --parallel: FIFO runs one currency per worker process (no checkpoints)
+    # --stream: exports are read lazily and heap-merged (no checkpoints)
+    # --metrics: write stage timings and FIFO counters to metrics.json
+    # --no-cache: rerun every stage even if its inputs are unchanged
+    run_pipeline(fixed='--fixed' in sys.argv, parallel='--parallel' in sys.argv,
+                 stream='--stream' in sys.argv, metrics='--metrics' in sys.argv,
+                 memo='--no-cache' not in sys.argv)
     
     print(f"\n{'='*50}")
     print("All reports generated successfully!")
@@ -2,105 +2,127 @@
 import csv
 import os
 import glob
-from decimal import Decimal
-from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from operator import attrgetter
+
+import run_metrics
+import report_store
+from fifo_report import FYSummary, add_sale
+from valuation import read_valuations
+
+# The coins the overview had fixed columns for keep their places; any other
+# coin in the ledger follows in alphabetical order
+LEGACY_CURRENCY_ORDER = ['BCH', 'ETH', 'XBT', 'XRP', 'LTC']
+ZERO = Decimal('0')
+
 
 def parse_fy_report(filepath):
     fy = int(os.path.basename(filepath).split('_')[0][2:])
-    transactions = []
-    balances = defaultdict(lambda: {'units': Decimal('0'), 'value': Decimal('0')})
-
     with open(filepath, 'r') as f:
-        reader = csv.reader(f)
-        section = None
-        for row in reader:
-            if not row:
-                continue
-            if row[0] == 'Solds for FY':
-                section = 'transactions'
-            elif row[0] == 'Balances at end of FY':
-                section = 'balances'
-            elif section == 'transactions' and len(row) >= 10 and row[0] and row[0] != 'Date':
-                try:
-                    proceeds = Decimal(row[8].replace(',', ''))
-                    cost = Decimal(row[7].replace(',', ''))
-                    profit = Decimal(row[9].replace(',', ''))
-                    transactions.append((proceeds, cost, profit))
-                except:
-                    pass
-            elif section == 'balances' and len(row) >= 3 and row[0] and row[0] != 'Currency' and row[1] and row[2]:
-                ccy = row[0]
-                units_str = row[1].replace(',', '')
-                value_str = row[2].replace(',', '')
-                try:
-                    units = Decimal(units_str)
-                    value = Decimal(value_str)
-                    balances[ccy]['units'] = units
-                    balances[ccy]['value'] = value
-                except:
-                    pass
-
-    # For losses (profit < 0)
-    loss_trans = [t for t in transactions if t[2] < 0]
-    proceeds_loss = sum(t[0] for t in loss_trans)
-    cost_loss = sum(t[1] for t in loss_trans)
-    profit_loss = sum(t[2] for t in loss_trans)
-
-    # For gains (profit > 0)
-    gain_trans = [t for t in transactions if t[2] > 0]
-    proceeds_gain = sum(t[0] for t in gain_trans)
-    cost_gain = sum(t[1] for t in gain_trans)
-    profit_gain = sum(t[2] for t in gain_trans)
-
-    return fy, proceeds_loss, cost_loss, profit_loss, proceeds_gain, cost_gain, profit_gain, balances
+        return summarize_fy_report(fy, csv.reader(f))
 
-def main():
-    reports_dir = '../reports'
-    # Find latest folder
-    subdirs = [d for d in os.listdir(reports_dir) if os.path.isdir(os.path.join(reports_dir, d))]
-    subdirs.sort(reverse=True)
-    latest_dir = os.path.join(reports_dir, subdirs[0])
+def _decimal(fy, row, i):
+    try:
+        return Decimal(row[i].replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"FY{fy} report: column {i + 1} of {row!r} is not a number") from None
 
-    fy_files = glob.glob(os.path.join(latest_dir, 'fy*_report.csv'))
+def summarize_fy_report(fy, report_rows):
+    # Reads an FYSummary back from a written FY report (overview_report.py run
+    # on its own, or a pipeline run that reused the FIFO stage's reports); the
+    # pipeline otherwise takes it straight from the engine
+    totals = [ZERO] * 6
+    balances = {}
+
+    section = None
+    for row in report_rows:
+        if not row:
+            continue
+        if len(row) <= 2 and row[0].endswith((' FY', ' Fees')):
+            section = row[0]
+        elif row[0] in ('Date', 'Currency'):
+            continue
+        elif section == 'Solds for FY':
+            add_sale(totals, _decimal(fy, row, 8), _decimal(fy, row, 7), _decimal(fy, row, 9))
+        elif section == 'Balances at end of FY' and row[1]:
+            # A currency's total row; its lot rows leave the totals empty
+            balances[row[0]] = (_decimal(fy, row, 1), _decimal(fy, row, 2))
+
+    return FYSummary(fy, *totals, balances)
 
-    overview = []
-    for f in fy_files:
-        fy, proceeds_loss, cost_loss, profit_loss, proceeds_gain, cost_gain, profit_gain, balances = parse_fy_report(f)
-        net = profit_loss + profit_gain
-        total_value = sum(balances[ccy]['value'] for ccy in balances)
-        overview.append((fy, proceeds_loss, cost_loss, profit_loss, proceeds_gain, cost_gain, profit_gain, net, total_value, balances))
-
-    overview.sort(key=lambda x: x[0])
-
-    # Output CSV
-    output_file = os.path.join(latest_dir, 'overview_report.csv')
-    with open(output_file, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['FY', 'Losses Proceeds (ZAR)', 'Losses Base Cost (ZAR)', 'Losses Gain/Loss (ZAR)', 'Gains Proceeds (ZAR)', 'Gains Base Cost (ZAR)', 'Gains Gain/Loss (ZAR)', 'Net Gain/Loss (ZAR)', 'Total Coin Value (ZAR)', 'BCH Units', 'BCH Value (ZAR)', 'ETH Units', 'ETH Value (ZAR)', 'XBT Units', 'XBT Value (ZAR)', 'XRP Units', 'XRP Value (ZAR)', 'LTC Units', 'LTC Value (ZAR)'])
-        for fy, proceeds_loss, cost_loss, profit_loss, proceeds_gain, cost_gain, profit_gain, net, total_value, bal in overview:
-            writer.writerow([
-                fy,
-                f"{proceeds_loss:.2f}",
-                f"{cost_loss:.2f}",
-                f"{profit_loss:.2f}",
-                f"{proceeds_gain:.2f}",
-                f"{cost_gain:.2f}",
-                f"{profit_gain:.2f}",
-                f"{net:.2f}",
-                f"{total_value:.2f}",
-                f"{bal['BCH']['units']:.8f}",
-                f"{bal['BCH']['value']:.2f}",
-                f"{bal['ETH']['units']:.8f}",
-                f"{bal['ETH']['value']:.2f}",
-                f"{bal['XBT']['units']:.8f}",
-                f"{bal['XBT']['value']:.2f}",
-                f"{bal['XRP']['units']:.8f}",
-                f"{bal['XRP']['value']:.2f}",
-                f"{bal['LTC']['units']:.8f}",
-                f"{bal['LTC']['value']:.2f}",
-            ])
+def overview_currencies(summaries):
+    seen = {ccy for summary in summaries for ccy in summary.balances}
+    return [ccy for ccy in LEGACY_CURRENCY_ORDER if ccy in seen] + sorted(seen.difference(LEGACY_CURRENCY_ORDER))
+
+def _market_totals(valuation):
+    # (market value, unrealised gain) over every currency, or empty if any
+    # currency with open lots had no price
+    if valuation is None or any(market is None for market, _ in valuation.currencies.values()):
+        return ['', '']
+    return [f"{sum((market for market, _ in valuation.currencies.values()), ZERO):.2f}",
+            f"{sum((gain for _, gain in valuation.currencies.values()), ZERO):.2f}"]
+
+def build_overview(summaries, valuations=()):
+    # One row per FY from the engine's per-FY totals:
+    # O(#FY x #currencies), whatever the ledger's size. valuations
+    # (valuation.FYValuation) add market value columns when any FY end has a
+    # price
+    summaries = sorted(summaries, key=attrgetter('fy'))
+    currencies = overview_currencies(summaries)
+    valuations = {v.fy: v for v in valuations or ()}
+    priced = any(market is not None for v in valuations.values() for market, _ in v.currencies.values())
+    header = ['FY', 'Losses Proceeds (ZAR)', 'Losses Base Cost (ZAR)', 'Losses Gain/Loss (ZAR)', 'Gains Proceeds (ZAR)',
+              'Gains Base Cost (ZAR)', 'Gains Gain/Loss (ZAR)', 'Net Gain/Loss (ZAR)', 'Total Coin Value (ZAR)']
+    if priced:
+        header.extend(['Market Value (ZAR)', 'Unrealised Gain (ZAR)'])
+    for ccy in currencies:
+        header.extend([f'{ccy} Units', f'{ccy} Value (ZAR)'])
+        if priced:
+            header.append(f'{ccy} Market Value (ZAR)')
+    overview = [header]
+    for s in summaries:
+        row = [s.fy, f"{s.proceeds_loss:.2f}", f"{s.cost_loss:.2f}", f"{s.profit_loss:.2f}", f"{s.proceeds_gain:.2f}",
+               f"{s.cost_gain:.2f}", f"{s.profit_gain:.2f}", f"{s.profit_loss + s.profit_gain:.2f}",
+               f"{sum((value for _, value in s.balances.values()), ZERO):.2f}"]
+        valuation = valuations.get(s.fy)
+        if priced:
+            row.extend(_market_totals(valuation))
+        for ccy in currencies:
+            units, value = s.balances.get(ccy, (ZERO, ZERO))
+            row.extend([f"{units:.8f}", f"{value:.2f}"])
+            if priced:
+                market = valuation.currencies.get(ccy, (ZERO, ZERO))[0] if valuation is not None else None
+                row.append('' if market is None else f"{market:.2f}")
+        overview.append(row)
+    return overview
+
+def write_overview(overview, output_dir):
+    output_file = os.path.join(output_dir, 'overview_report.csv')
+    with run_metrics.writing(output_file):
+        with open(output_file, 'w', newline='') as f:
+            csv.writer(f).writerows(overview)
 
     print(f"Wrote {output_file}")
 
+def main():
+    reports_dir = '../reports'
+    latest_dir = report_store.latest_run(reports_dir)
+    newest = report_store.run_folders(reports_dir)[-1]
+    if latest_dir is None or os.path.basename(latest_dir) < newest:
+        # Runs from before the report store, or a newer folder nothing
+        # committed (a script run on its own): take the newest folder
+        latest_dir = os.path.join(reports_dir, newest)
+
+    fy_files = glob.glob(os.path.join(latest_dir, 'fy*_report.csv'))
+    report_store.detach(os.path.join(latest_dir, 'overview_report.csv'))
+    with run_metrics.stage('overview_report', rows=len(fy_files)):
+        write_overview(build_overview([parse_fy_report(f) for f in fy_files], read_valuations(latest_dir)), latest_dir)
+    return latest_dir
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import sys
+    if '--metrics' in sys.argv:
+        run_metrics.enable()
+    latest_dir = main()
+    if run_metrics.active is not None:
+        run_metrics.active.write(latest_dir)
\ No newline at end of file
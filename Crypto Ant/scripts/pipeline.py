@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# In-process report pipeline: identify buys for others -> FIFO (FY reports,
+# per-currency ledgers and the Go-style inventory/transfers/profit and loss
+# files, all from one engine run) -> FY-end valuation, when the root has a
+# price history (price_store.py) -> overview, all in one interpreter. Each
+# stage hands its result to the next in memory; intermediate files are still
+# written for auditing, and are read back only when the stage that wrote
+# them was skipped as unchanged (stage_cache.py).
+import glob
+import os
+from datetime import datetime
+from fnmatch import fnmatch
+
+from ledger import load_file, merge_rows, group_by_currency, iter_by_currency, scan_file, file_digest
+from identify_buys_for_others import find_buys_for_others, write_mapping, read_mapping, mapping_file
+import fifo_report
+import holdings
+import overview_report
+import report_sinks
+import report_store
+import run_metrics
+import stage_cache
+import valuation
+from price_store import PriceStore
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def stage(name):
+    print(f"\n{'='*50}")
+    print(f"Running {name}...")
+    print('='*50)
+
+
+def run_pipeline(root_dir=ROOT_DIR, timestamp=None, fixed=False, parallel=False, workers=None, stream=False,
+                 metrics=False, columns=None, fy_start=None, memo=True):
+    # columns: report column orders by report ({'fifo': [...], ...}); fy_start:
+    # first month of the financial year. scripts/batch.py takes both from the
+    # config.
+    # memo: skip stages whose inputs are unchanged since an earlier run and
+    # link that run's outputs instead (stage_cache.py). The finished run is
+    # committed to the report store, which deduplicates it against earlier runs
+    data_dir = os.path.join(root_dir, 'data')
+    reports_dir = os.path.join(root_dir, 'reports')
+    csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
+    if timestamp is None:
+        timestamp = datetime.now().strftime('%Y_%m_%d_%H%M')
+    output_dir = os.path.join(reports_dir, timestamp)
+    os.makedirs(output_dir, exist_ok=True)
+    stage_cache.release_links(output_dir)
+    if metrics:
+        run_metrics.enable()
+    if fy_start is not None:
+        fifo_report.set_financial_year_start(fy_start)
+    stages = stage_cache.StageCache(os.path.join(root_dir, '.cache', 'stages') if memo else None)
+    # Everything the FIFO stage's outputs depend on besides its input files
+    fifo_params = {'fixed': fixed, 'columns': columns,
+                   'fy_start': fifo_report.FY_START_MONTH}
+    sources = {os.path.basename(csv_file): file_digest(csv_file) for csv_file in csv_files}
+    prices = PriceStore(root_dir)
+
+    try:
+        if stream:
+            # Exports are read lazily and merged with a heap; nothing holds the
+            # whole ledger at once
+            run_streaming(csv_files, data_dir, output_dir, fixed, columns, stages, fifo_params, sources, prices)
+        else:
+            run_in_memory(csv_files, data_dir, output_dir, timestamp, root_dir, fixed, parallel, workers, columns, stages,
+                          fifo_params, sources, prices)
+        if run_metrics.active is not None:
+            run_metrics.active.write(output_dir)
+        digests = {}
+        for name in ('fifo', 'valuation', 'overview'):
+            digests.update(stages.outputs.get(name, {}))
+        report_store.commit_run(output_dir, sources, digests)
+    finally:
+        if metrics:
+            run_metrics.disable()
+
+    return output_dir
+
+
+def _load_rows(csv_files):
+    with run_metrics.stage('load_ledger') as st:
+        rows_by_file = {csv_file: load_file(csv_file) for csv_file in csv_files}
+        st['rows'] = sum(len(rows) for rows in rows_by_file.values())
+    return rows_by_file, st['rows']
+
+
+def _fifo_inputs(stages, sources):
+    return dict(sources, **stages.outputs.get('identify_buys_for_others', {}))
+
+
+def _run_valuation(stages, output_dir, prices):
+    # Values the open lots at every FY end from the FIFO stage's holdings
+    # index; returns the FYValuations, or () without a price history
+    if not prices:
+        return ()
+    stage('valuation')
+    inputs = {'holdings': stages.outputs.get('fifo', {}).get(holdings.HOLDINGS_FILE), 'prices': prices.digest()}
+    params = {'fy_start': fifo_report.FY_START_MONTH, 'max_gap': prices.max_gap}
+    if stages.reuse('valuation', inputs, params, output_dir):
+        return valuation.read_valuations(output_dir)
+    with run_metrics.stage('valuation') as st:
+        before = stage_cache.folder_state(output_dir)
+        valuations = valuation.run_valuation(output_dir, prices)
+        st['rows'] = len(valuations)
+        stages.record_written('valuation', output_dir, before)
+    return valuations
+
+
+def _run_overview(stages, output_dir, summaries=None, valuations=()):
+    # summaries: the FIFO engine's FYSummary per FY when the FIFO stage ran this
+    # time; FY reports it reused are read back from the report folder instead
+    fy_reports = {name: digest for name, digest in stages.outputs.get('fifo', {}).items()
+                  if fnmatch(name, 'fy*_report.csv')}
+    fy_reports.update(stages.outputs.get('valuation', {}))
+    if stages.reuse('overview', fy_reports, output_dir=output_dir):
+        return
+    with run_metrics.stage('overview_report') as st:
+        if summaries is None:
+            summaries = [overview_report.parse_fy_report(f) for f in glob.glob(os.path.join(output_dir, 'fy*_report.csv'))]
+        st['rows'] = len(summaries)
+        before = stage_cache.folder_state(output_dir)
+        overview_report.write_overview(overview_report.build_overview(summaries, valuations), output_dir)
+        stages.record_written('overview', output_dir, before)
+
+
+def run_in_memory(csv_files, data_dir, output_dir, timestamp, root_dir, fixed=False, parallel=False, workers=None,
+                  columns=None, stages=None, fifo_params=None, sources=None, prices=None):
+    columns = columns or {}
+    stages = stages or stage_cache.StageCache(None)
+    sources = sources or {}
+    rows_by_file = mapping = None
+
+    stage('identify_buys_for_others')
+    if not stages.reuse('identify_buys_for_others', sources):
+        rows_by_file, n_rows = _load_rows(csv_files)
+        with run_metrics.stage('identify_buys_for_others', n_rows):
+            mapping = find_buys_for_others(group_by_currency(rows_by_file.values()))
+            write_mapping(mapping, data_dir)
+        stages.record('identify_buys_for_others', [mapping_file(data_dir)])
+
+    stage('fifo_report')
+    summaries = None
+    if not stages.reuse('fifo', _fifo_inputs(stages, sources), fifo_params, output_dir):
+        if rows_by_file is None:
+            rows_by_file, n_rows = _load_rows(csv_files)
+        if mapping is None:
+            mapping = read_mapping(data_dir)
+        before = stage_cache.folder_state(output_dir)
+        summaries = run_fifo(rows_by_file, csv_files, output_dir, timestamp, root_dir, mapping, n_rows, fixed, parallel,
+                             workers, columns)
+        stages.record_written('fifo', output_dir, before)
+
+    valuations = _run_valuation(stages, output_dir, prices)
+
+    stage('overview_report')
+    _run_overview(stages, output_dir, summaries, valuations)
+
+
+def run_fifo(rows_by_file, csv_files, output_dir, timestamp, root_dir, mapping, n_rows, fixed=False, parallel=False,
+             workers=None, columns=None):
+    # The ledgers are rendered from the FY engine's own run, so they always
+    # agree with the FY reports
+    names = report_sinks.ledger_names({csv_file: list(dict.fromkeys(row.currency for row in rows))
+                                       for csv_file, rows in rows_by_file.items()})
+    sinks = report_sinks.default_sinks(names, columns=columns)
+    with run_metrics.stage('merge_rows', n_rows):
+        rows = merge_rows(rows_by_file.values())
+    with run_metrics.stage('fy_reports', n_rows):
+        if parallel:
+            summaries = fifo_report.process_fy_parallel(
+                csv_files, output_dir, timestamp,
+                buys_for_others_mapping=mapping,
+                rows=rows,
+                workers=workers,
+                sinks=sinks,
+                fixed=fixed,
+            )
+        else:
+            summaries = fifo_report.process_fy(
+                csv_files, output_dir, timestamp,
+                checkpoint_file=os.path.join(root_dir, '.cache', 'checkpoints', 'fifo_fy.pickle'),
+                buys_for_others_mapping=mapping,
+                rows=rows,
+                sinks=sinks,
+                fixed=fixed,
+            )
+    return list(summaries.values())
+
+
+def _counted(rows, entry):
+    for row in rows:
+        entry['rows'] += 1
+        yield row
+
+
+def run_streaming(csv_files, data_dir, output_dir, fixed=False, columns=None, stages=None, fifo_params=None, sources=None,
+                  prices=None):
+    stages = stages or stage_cache.StageCache(None)
+    sources = sources or {}
+    mapping = None
+    n_rows = None
+
+    stage('identify_buys_for_others')
+    if not stages.reuse('identify_buys_for_others', sources):
+        with run_metrics.stage('identify_buys_for_others', 0) as st:
+            rows_by_ccy = iter_by_currency(csv_files)
+            if run_metrics.active is not None:
+                rows_by_ccy = {ccy: _counted(rows, st) for ccy, rows in rows_by_ccy.items()}
+            mapping = find_buys_for_others(rows_by_ccy)
+            write_mapping(mapping, data_dir)
+        n_rows = st.get('rows')
+        stages.record('identify_buys_for_others', [mapping_file(data_dir)])
+
+    stage('fifo_report')
+    summaries = None
+    if not stages.reuse('fifo', _fifo_inputs(stages, sources), fifo_params, output_dir):
+        if mapping is None:
+            mapping = read_mapping(data_dir)
+        before = stage_cache.folder_state(output_dir)
+        names = report_sinks.ledger_names({csv_file: scan_file(csv_file)[1] for csv_file in csv_files})
+        sinks = report_sinks.default_sinks(names, columns=columns)
+        # Only each FY's summary is kept once its report is written
+        with run_metrics.stage('fy_reports', n_rows):
+            summaries = list(fifo_report.process_fy_stream(csv_files, output_dir, buys_for_others_mapping=mapping,
+                                                           sinks=sinks, fixed=fixed))
+        stages.record_written('fifo', output_dir, before)
+
+    valuations = _run_valuation(stages, output_dir, prices)
+
+    stage('overview_report')
+    _run_overview(stages, output_dir, summaries, valuations)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Local price history: per-coin USD prices and the USD/ZAR rate, each held as
+# a series of sorted timestamps with the price at each, for ZAR market values
+# at any moment (valuation.py values the open lots at every FY end with it).
+#
+# Sources, under a root:
+#   prices/<coin>_usd.csv  candles (or any price series) per coin, e.g.
+#                          prices/btc_usd.csv; XBT is looked up as BTC
+#   prices/usd_zar.csv     ZAR per USD
+#   exchange_templates/*/exchange_rates_template.yaml, and the same under
+#   reports/*/: the Go generate_exchange_rates tool's templates, once filled
+#   in (usd_prices per coin and usd_to_zar_rate per date; 0.00 placeholders
+#   are skipped)
+# A CSV needs a header with a time column (close_time, timestamp, time, date,
+# datetime or open_time; epoch seconds or milliseconds, or ISO dates) and a
+# price column (close, price or rate). Candles are keyed by their close time
+# when the file has one. Where a CSV and a template have the same moment, the
+# CSV wins. Times without a zone, the ledger's included, are read as UTC.
+#
+# A lookup takes the point nearest each timestamp, at most max_gap away:
+# searchsorted over the whole batch with NumPy, bisect per timestamp without.
+# Single lookups go through an LRU cache, as reports ask for the same few FY
+# ends over and over.
+#
+#   python price_store.py XBT 2023-02-28 2024-02-29
+import argparse
+import calendar
+import csv
+import glob
+import hashlib
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from ledger import file_digest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+PRICES_DIR = 'prices'
+TEMPLATE_GLOBS = [os.path.join('exchange_templates', '*', 'exchange_rates_template.yaml'),
+                  os.path.join('reports', '*', 'exchange_rates_template.yaml')]
+USD_ZAR = 'USD_ZAR'
+COIN_ALIASES = {'XBT': 'BTC'}
+TIME_COLUMNS = ['close_time', 'timestamp', 'time', 'date', 'datetime', 'open_time']
+PRICE_COLUMNS = ['close', 'price', 'rate']
+# Daily candles, with a weekend's slack for the exchange rate
+MAX_GAP = 3 * 86400
+CACHE_SIZE = 4096
+
+# price: ZAR per unit, or None if either series has no point within max_gap;
+# at: the later of the two points' times used
+Quote = namedtuple('Quote', ['price', 'at'])
+
+
+def to_epoch(value):
+    # Epoch seconds (or milliseconds), 'YYYY-MM-DD' or an ISO date and time
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        pass
+    else:
+        return int(number / 1000 if number > 1e11 else number)
+    text = text.replace('T', ' ').rstrip('Z')
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(datetime.strptime(text[:19], fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError(f"not a timestamp: {value!r}")
+
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(int(seconds), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class PriceSeries:
+    # points: {epoch seconds: Decimal price}
+    def __init__(self, points):
+        keys = sorted(points)
+        self.times = np.array(keys, dtype=np.int64) if np is not None else array('q', keys)
+        self.prices = [points[t] for t in keys]
+
+    def __len__(self):
+        return len(self.prices)
+
+    def nearest(self, times, max_gap=MAX_GAP):
+        # Index of the point nearest each of times (epoch seconds), or -1
+        n = len(self.prices)
+        if not n:
+            return [-1] * len(times)
+        if np is not None:
+            q = np.asarray(times, dtype=np.int64)
+            right = np.clip(np.searchsorted(self.times, q), 0, n - 1)
+            left = np.clip(right - 1, 0, n - 1)
+            pick = np.where(np.abs(self.times[left] - q) <= np.abs(self.times[right] - q), left, right)
+            return np.where(np.abs(self.times[pick] - q) <= max_gap, pick, -1).tolist()
+        found = []
+        for t in times:
+            i = bisect_left(self.times, t)
+            if i == n or (i and t - self.times[i - 1] <= self.times[i] - t):
+                i -= 1
+            found.append(i if abs(self.times[i] - t) <= max_gap else -1)
+        return found
+
+
+def _column(fieldnames, wanted):
+    names = {name.strip().lower(): name for name in fieldnames or ()}
+    for name in wanted:
+        if name in names:
+            return names[name]
+    return None
+
+
+def _price(text):
+    try:
+        price = Decimal(str(text).replace(',', '').strip())
+    except InvalidOperation:
+        return None
+    return price if price > 0 else None
+
+
+def load_csv(path):
+    points = {}
+    with open(path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        time_col = _column(reader.fieldnames, TIME_COLUMNS)
+        price_col = _column(reader.fieldnames, PRICE_COLUMNS)
+        if time_col is None or price_col is None:
+            raise ValueError(f"{path}: needs a time column ({', '.join(TIME_COLUMNS)}) and a price column "
+                             f"({', '.join(PRICE_COLUMNS)})")
+        for record in reader:
+            price = _price(record[price_col])
+            if price is not None and record[time_col]:
+                points[to_epoch(record[time_col])] = price
+    return points
+
+
+def read_template(text):
+    # The template's dates_required entries, each a mapping of date,
+    # usd_prices ({coin: price}) and usd_to_zar_rate. Without PyYAML, read
+    # line by line in the Go tool's layout: '- date:' starts an entry, and a
+    # key indented under one of its keys belongs to that key's mapping
+    if yaml is not None:
+        return (yaml.safe_load(text) or {}).get('dates_required') or []
+    entries = []
+    key_indent = None
+    section = None
+    for line in text.splitlines():
+        line = line.split(' #', 1)[0].rstrip()
+        body = line.lstrip()
+        key, sep, value = body.partition(':')
+        if not sep:
+            continue
+        indent = len(line) - len(body)
+        if key.startswith('- '):
+            key = key[2:]
+            indent += 2
+            key_indent = indent
+            entries.append({})
+        elif key_indent is None or indent < key_indent:
+            continue
+        key = key.strip().strip('"\'')
+        value = value.strip().strip('"\'')
+        if indent == key_indent:
+            section = key
+            entries[-1][key] = value if value else {}
+        elif isinstance(entries[-1].get(section), dict):
+            entries[-1][section][key] = value
+    return entries
+
+
+def load_template(path):
+    # {series: {epoch seconds: price}} from a filled-in exchange rates template
+    series = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = read_template(f.read())
+    for entry in entries:
+        at = to_epoch(entry['date'])
+        for coin, text in (entry.get('usd_prices') or {}).items():
+            price = _price(text)
+            if price is not None:
+                series.setdefault(str(coin).upper(), {})[at] = price
+        rate = _price(entry.get('usd_to_zar_rate'))
+        if rate is not None:
+            series.setdefault(USD_ZAR, {})[at] = rate
+    return series
+
+
+def price_sources(root_dir):
+    templates = sorted(p for pattern in TEMPLATE_GLOBS for p in glob.glob(os.path.join(root_dir, pattern)))
+    return templates + sorted(glob.glob(os.path.join(root_dir, PRICES_DIR, '*.csv')))
+
+
+class PriceStore:
+    def __init__(self, root_dir, max_gap=MAX_GAP, cache_size=CACHE_SIZE):
+        self.max_gap = max_gap
+        self.sources = price_sources(root_dir)
+        points = {}
+        for path in self.sources:
+            if path.endswith('.yaml'):
+                for name, series in load_template(path).items():
+                    points.setdefault(name, {}).update(series)
+            else:
+                name = os.path.basename(path).rsplit('.', 1)[0].upper()
+                if name != USD_ZAR:
+                    name = name[:-len('_USD')] if name.endswith('_USD') else name
+                points.setdefault(name, {}).update(load_csv(path))
+        self.series = {name: PriceSeries(p) for name, p in points.items()}
+        self.quote = lru_cache(maxsize=cache_size)(self._quote)
+
+    def __bool__(self):
+        return USD_ZAR in self.series and len(self.series) > 1
+
+    def digest(self):
+        # Changes whenever a source file's content does
+        h = hashlib.sha256()
+        for path in self.sources:
+            h.update(f"{os.path.basename(path)}\0{file_digest(path)}\n".encode('utf-8'))
+        return h.hexdigest()
+
+    def coin_series(self, ccy):
+        ccy = ccy.upper()
+        return self.series.get(COIN_ALIASES.get(ccy, ccy)) or self.series.get(ccy)
+
+    def quotes(self, ccy, timestamps):
+        # One Quote per timestamp ('YYYY-MM-DD HH:MM:SS' or epoch seconds)
+        times = [t if isinstance(t, int) else to_epoch(t) for t in timestamps]
+        coin = self.coin_series(ccy)
+        fx = self.series.get(USD_ZAR)
+        if coin is None or fx is None:
+            return [Quote(None, None)] * len(times)
+        quotes = []
+        for i, j in zip(coin.nearest(times, self.max_gap), fx.nearest(times, self.max_gap)):
+            if i < 0 or j < 0:
+                quotes.append(Quote(None, None))
+            else:
+                quotes.append(Quote(coin.prices[i] * fx.prices[j], from_epoch(max(coin.times[i], fx.times[j]))))
+        return quotes
+
+    def _quote(self, ccy, timestamp):
+        return self.quotes(ccy, [timestamp])[0]
+
+
+def main():
+    from fifo_report import s2
+
+    parser = argparse.ArgumentParser(description='ZAR prices from the local price history.')
+    parser.add_argument('currency')
+    parser.add_argument('timestamps', nargs='+')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    parser.add_argument('--max-gap-days', type=float, default=MAX_GAP / 86400)
+    args = parser.parse_args()
+
+    store = PriceStore(args.root, int(args.max_gap_days * 86400))
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['Currency', 'Timestamp', 'Price (ZAR)', 'Price At'])
+    for timestamp, quote in zip(args.timestamps, store.quotes(args.currency, args.timestamps)):
+        writer.writerow([args.currency.upper(), timestamp, '' if quote.price is None else s2(quote.price), quote.at or ''])
+
+
+if __name__ == '__main__':
+    main()
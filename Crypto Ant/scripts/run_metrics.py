@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Optional run instrumentation, written as metrics.json in the report folder.
+# Off unless enable() is called (main.py --metrics). Hot paths only test
+# `run_metrics.active is not None`, and only on lot appends and splits;
+# stage()/writing() hand back a no-op context when off.
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+active = None
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = []
+        self.lot_splits = defaultdict(int)
+        self.max_lot_queue = defaultdict(int)
+        self.lot_queues = {}
+        self.files = {}
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        entry = {'stage': name, 'rows': rows}
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = round(time.perf_counter() - start, 6)
+            if entry['rows'] and entry['seconds']:
+                entry['rows_per_sec'] = round(entry['rows'] / entry['seconds'])
+            self.stages.append(entry)
+
+    @contextmanager
+    def writing(self, path):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.files[os.path.abspath(path)] = {'bytes': os.path.getsize(path), 'seconds': round(seconds, 6)}
+
+    def lot_split(self, ccy):
+        self.lot_splits[ccy] += 1
+
+    def queue_depth(self, ccy, depth):
+        if depth > self.max_lot_queue[ccy]:
+            self.max_lot_queue[ccy] = depth
+
+    def lot_memory(self, ccy, info):
+        # LotArray.memory() of a per-currency ledger
+        self.lot_queues[ccy] = info
+
+    def export(self):
+        # What a worker process hands back to be absorbed by the parent
+        return {'lot_splits': dict(self.lot_splits), 'max_lot_queue': dict(self.max_lot_queue),
+                'lot_queues': self.lot_queues, 'files': self.files}
+
+    def absorb(self, exported):
+        for ccy, n in exported['lot_splits'].items():
+            self.lot_splits[ccy] += n
+        for ccy, depth in exported['max_lot_queue'].items():
+            self.queue_depth(ccy, depth)
+        self.lot_queues.update(exported['lot_queues'])
+        self.files.update(exported['files'])
+
+    def as_dict(self, output_dir=None):
+        files = {}
+        for path, info in sorted(self.files.items()):
+            if output_dir and os.path.dirname(path) == os.path.abspath(output_dir):
+                path = os.path.basename(path)
+            files[path] = info
+        peak_rss_kb = None
+        if resource is not None:
+            peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform == 'darwin':  # bytes there, KiB elsewhere
+                peak_rss_kb //= 1024
+        currencies = sorted(set(self.lot_splits) | set(self.max_lot_queue) | set(self.lot_queues))
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall_seconds': round(time.perf_counter() - self._t0, 6),
+            'peak_rss_kb': peak_rss_kb,
+            'stages': self.stages,
+            'currencies': {ccy: {'lot_splits': self.lot_splits[ccy], 'max_lot_queue': self.max_lot_queue[ccy],
+                                 'ledger_lot_queue': self.lot_queues.get(ccy)}
+                           for ccy in currencies},
+            'bytes_written': sum(info['bytes'] for info in self.files.values()),
+            'files': files,
+        }
+
+    def write(self, output_dir):
+        path = os.path.join(output_dir, 'metrics.json')
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(output_dir), f, indent=2)
+        print(f"Wrote {path}")
+        return path
+
+
+def enable():
+    global active
+    active = RunMetrics()
+    return active
+
+
+def disable():
+    global active
+    active = None
+
+
+def stage(name, rows=None):
+    if active is None:
+        return nullcontext({})
+    return active.stage(name, rows)
+
+
+def writing(path):
+    if active is None:
+        return nullcontext()
+    return active.writing(path)
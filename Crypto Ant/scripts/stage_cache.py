@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Memoizes the report pipeline's stages. The pipeline is a small DAG:
+#
+#   identify_buys_for_others -> fifo (FY reports, ledgers, inventory, ...) -> valuation -> overview
+#
+# A stage's key hashes its inputs' contents (the exports, or the files the
+# stage before it wrote), its parameters and the source of the modules it runs.
+# Once a stage has run, a manifest under <root>/.cache/stages records its
+# output files with their size, mtime and sha256. A later run whose key has a
+# manifest, and whose outputs are still on disk unmodified, skips the stage and
+# hardlinks those outputs into its own report folder.
+import hashlib
+import json
+import os
+import shutil
+
+from ledger import file_digest
+
+STAGE_VERSION = 1
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Modules whose source is part of each stage's key
+STAGE_MODULES = {
+    'identify_buys_for_others': ['identify_buys_for_others', 'ledger', 'classifier', 'descriptions'],
+    'fifo': ['fifo_report', 'report_sinks', 'holdings', 'trade_linker', 'fee_index', 'lot_store', 'lot_array', 'fixed_point',
+             'vector_fifo', 'ledger', 'classifier', 'descriptions'],
+    'valuation': ['valuation', 'price_store', 'holdings', 'fifo_report'],
+    'overview': ['overview_report', 'valuation'],
+}
+
+_code_versions = {}
+
+
+def code_version(stage):
+    try:
+        return _code_versions[stage]
+    except KeyError:
+        pass
+    h = hashlib.sha256()
+    for name in STAGE_MODULES[stage]:
+        h.update(name.encode('utf-8') + b'\0')
+        h.update(file_digest(os.path.join(SCRIPTS_DIR, f"{name}.py")).encode('ascii'))
+    version = _code_versions[stage] = h.hexdigest()
+    return version
+
+
+def folder_state(output_dir):
+    # {file name: (inode, mtime)} of a report folder, to tell which files a
+    # stage wrote
+    state = {}
+    for entry in os.scandir(output_dir):
+        if entry.is_file():
+            st = entry.stat()
+            state[entry.name] = (st.st_ino, st.st_mtime_ns)
+    return state
+
+
+def release_links(output_dir):
+    # Files in a reused report folder may be hardlinks into older runs or the
+    # report store; a stage writing over one would change those too, so
+    # unlink them first
+    for entry in os.scandir(output_dir):
+        if entry.is_file() and entry.stat().st_nlink > 1:
+            os.unlink(entry.path)
+
+
+def _link(src, dst):
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class StageCache:
+    # cache_dir=None turns memoization off: every stage runs and nothing is
+    # recorded
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        # stage -> its key, and {file name: sha256} of its outputs, this run
+        self.keys = {}
+        self.outputs = {}
+
+    def _manifest_path(self, stage, key):
+        return os.path.join(self.cache_dir, f"{stage}-{key[:20]}.json")
+
+    def key(self, stage, inputs, params=None):
+        payload = json.dumps({'version': STAGE_VERSION, 'stage': stage, 'code': code_version(stage),
+                              'inputs': inputs, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _load(self, stage, key):
+        try:
+            with open(self._manifest_path(stage, key), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('key') != key:
+            return None
+        for info in manifest['outputs'].values():
+            try:
+                st = os.stat(info['path'])
+            except OSError:
+                return None
+            if st.st_size != info['size']:
+                return None
+            # Touched but possibly unchanged: the content hash decides
+            if st.st_mtime_ns != info['mtime_ns'] and file_digest(info['path']) != info['sha256']:
+                return None
+        return manifest
+
+    def reuse(self, stage, inputs, params=None, output_dir=None):
+        # True if the stage can be skipped; its report folder outputs are then
+        # linked into output_dir (outputs elsewhere, like the buys for others
+        # mapping in data/, are already in place)
+        if self.cache_dir is None:
+            return False
+        key = self.key(stage, inputs, params)
+        self.keys[stage] = key
+        manifest = self._load(stage, key)
+        if manifest is None:
+            return False
+        paths = []
+        digests = {}
+        for name, info in manifest['outputs'].items():
+            path = info['path']
+            if info['linked'] and output_dir is not None:
+                dst = os.path.join(output_dir, name)
+                _link(path, dst)
+                path = dst
+            paths.append(path)
+            digests[name] = info['sha256']
+        # The manifest now points at this run, so older runs can be deleted
+        self.record(stage, paths, output_dir, digests)
+        print(f"Reusing {stage} outputs ({len(paths)} files, inputs unchanged)")
+        return True
+
+    def record(self, stage, paths, output_dir=None, digests=None):
+        if self.cache_dir is None:
+            return
+        digests = digests or {}
+        outputs = {}
+        for path in sorted(paths):
+            name = os.path.basename(path)
+            st = os.stat(path)
+            outputs[name] = {
+                'path': os.path.abspath(path),
+                'linked': output_dir is not None and os.path.dirname(os.path.abspath(path)) == os.path.abspath(output_dir),
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'sha256': digests.get(name) or file_digest(path),
+            }
+        self.outputs[stage] = {name: info['sha256'] for name, info in outputs.items()}
+        if stage not in self.keys:
+            return
+        key = self.keys[stage]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest_file = self._manifest_path(stage, key)
+        tmp = f"{manifest_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'stage': stage, 'outputs': outputs}, f, indent=2)
+        os.replace(tmp, manifest_file)
+
+    def record_written(self, stage, output_dir, before):
+        # Records the files in output_dir that are new or rewritten since
+        # folder_state(output_dir) returned before
+        after = folder_state(output_dir)
+        self.record(stage, [os.path.join(output_dir, name) for name, state in after.items() if before.get(name) != state],
+                    output_dir)
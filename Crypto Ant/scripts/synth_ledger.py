@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# Synthetic exchange exports in the same schema as data/*.csv, for scaling
+# tests. Rows are written one at a time, so even 10M-row ledgers need no
+# memory beyond the running balances.
+#
+#   python synth_ledger.py OUT_DIR ROWS [--currencies XBT,ETH] [--seed N]
+#       [--mix buy=0.4,sell=0.25,fee=0.2,send=0.05,receive=0.02]
+#       [--dust 0.05] [--for-others 0.03] [--years 5]
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+from ledger import EXPORT_HEADER
+
+HEADER = EXPORT_HEADER
+
+# Ledger currency -> (ticker used in trade descriptions, name used in sends)
+CURRENCIES = {
+    'XBT': ('BTC', 'Bitcoin'),
+    'ETH': ('ETH', 'Ethereum'),
+    'LTC': ('LTC', 'Litecoin'),
+    'XRP': ('XRP', 'XRP'),
+    'BCH': ('BCH', 'Bitcoin Cash'),
+}
+START_PRICES = {'XBT': 600000, 'ETH': 20000, 'LTC': 2000, 'XRP': 4, 'BCH': 6000}
+
+DEFAULT_MIX = {'buy': 0.40, 'sell': 0.25, 'fee': 0.20, 'send': 0.05, 'receive': 0.02}
+DEFAULT_DUST = 0.05        # share of buys that are dust lots
+DEFAULT_FOR_OTHERS = 0.03  # share of rows that start a buy-then-send pair
+QTY_STEP = 10 ** 8
+
+
+def _qty(units):
+    return f"{units // QTY_STEP}.{units % QTY_STEP:08d}"
+
+
+def _signed(units):
+    return '-' + _qty(-units) if units < 0 else _qty(units)
+
+
+def _price(p):
+    if p >= 1000:
+        return f"{p:,.0f}"
+    return f"{p:.2f}"
+
+
+class _Wallet:
+    def __init__(self, ccy, rng, mean_gap, start):
+        self.ccy = ccy
+        self.ticker, self.name = CURRENCIES.get(ccy, (ccy, ccy))
+        self.rng = rng
+        self.mean_gap = mean_gap
+        self.wallet_id = str(rng.randrange(10 ** 18, 10 ** 19))
+        self.row = 0
+        self.dt = start
+        self.price = float(START_PRICES.get(ccy, 100))
+        self.balance = 0
+        # Typical trade size: about R1,000 worth, in base units
+        self.lot = max(1, int(1000 / self.price * QTY_STEP))
+
+    def _tick(self, gap=None):
+        if gap is None:
+            gap = self.rng.expovariate(1 / self.mean_gap)
+        self.dt += timedelta(seconds=int(gap))
+        self.price = max(self.price * (1 + self.rng.gauss(0, 0.002)), 0.01)
+
+    def _row(self, desc, delta, value, address=''):
+        self.row += 1
+        self.balance += delta
+        return [
+            self.wallet_id, self.row, self.dt.strftime('%Y-%m-%d %H:%M:%S'), desc, self.ccy,
+            _signed(delta), _signed(delta if delta > 0 else 0), _qty(self.balance), _qty(self.balance),
+            '', address, 'ZAR', f"{value:.2f}", f"{self.rng.getrandbits(32):08x}",
+        ]
+
+    def _value(self, units):
+        return units / QTY_STEP * self.price
+
+    def _size(self):
+        return max(1, int(self.lot * self.rng.uniform(0.05, 3)))
+
+    def buy(self, units=None, dust=False):
+        if units is None:
+            units = self.rng.randint(1, 500) if dust else self._size()
+        desc = f"Bought {_qty(units)} {self.ticker}/ZAR @ {_price(self.price)}"
+        return [self._row(desc, units, self._value(units))]
+
+    def sell(self):
+        units = min(self._size(), self.balance)
+        if units <= 0:
+            return self.buy()
+        desc = f"Sold {_qty(units)} {self.ticker}/ZAR @ {_price(self.price)}"
+        rows = [self._row(desc, -units, self._value(units))]
+        return rows + self.fee('Trading fee', units)
+
+    def fee(self, desc='Trading fee', traded=None):
+        units = max(1, (traded or self.lot) // 1000)
+        if units > self.balance:
+            return []
+        self._tick(self.rng.randint(0, 2))
+        return [self._row(desc, -units, self._value(units))]
+
+    def send(self, units=None):
+        if units is None:
+            units = self._size()
+        units = min(units, self.balance)
+        if units <= 0:
+            return self.buy()
+        to = f"friend{self.rng.randint(1, 20)}@example.com"
+        rows = [self._row(f"Sent {self.name} to {to}", -units, self._value(units), to)]
+        return rows + self.fee(f"{self.name} send fee", units)
+
+    def receive(self):
+        units = self._size()
+        return [self._row(f"Received {self.name}", units, self._value(units))]
+
+    def buy_for_other(self):
+        # A buy followed within a few days by a send of 90-100% of it
+        units = self._size()
+        rows = self.buy(units)
+        self._tick(self.rng.uniform(60, 3 * 86400))
+        return rows + self.send(int(units * self.rng.uniform(0.9, 1.0)))
+
+    def next_rows(self, mix, dust, for_others):
+        self._tick()
+        r = self.rng.random()
+        if r < for_others:
+            return self.buy_for_other()
+        kind = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        if kind == 'buy':
+            return self.buy(dust=self.rng.random() < dust)
+        if kind == 'sell':
+            return self.sell()
+        if kind == 'fee':
+            return self.fee()
+        if kind == 'send':
+            return self.send()
+        return self.receive()
+
+
+def generate(out_dir, rows, currencies=('XBT', 'ETH', 'LTC', 'XRP'), mix=None, dust=DEFAULT_DUST,
+             for_others=DEFAULT_FOR_OTHERS, years=5, seed=0):
+    # Writes <out_dir>/<ccy>.csv for each currency, about rows in total.
+    # Returns {csv path: rows written}.
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    per_file = max(1, rows // len(currencies))
+    mean_gap = years * 365 * 86400 / per_file
+    written = {}
+    for ccy in currencies:
+        path = os.path.join(out_dir, f"{ccy.lower()}.csv")
+        wallet = _Wallet(ccy, random.Random(rng.getrandbits(64)), mean_gap, datetime(2021, 1, 1))
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(wallet.buy())
+            while wallet.row < per_file:
+                writer.writerows(wallet.next_rows(mix, dust, for_others))
+        written[path] = wallet.row
+    return written
+
+
+def _parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in text.split(','):
+        if part:
+            key, value = part.split('=')
+            if key not in DEFAULT_MIX:
+                raise SystemExit(f"unknown mix kind {key!r}; expected one of {', '.join(DEFAULT_MIX)}")
+            mix[key] = float(value)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic exchange CSV exports.')
+    parser.add_argument('out_dir')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--currencies', default='XBT,ETH,LTC,XRP')
+    parser.add_argument('--mix', default='', help='e.g. buy=0.4,sell=0.25,fee=0.2,send=0.05,receive=0.02')
+    parser.add_argument('--dust', type=float, default=DEFAULT_DUST)
+    parser.add_argument('--for-others', type=float, default=DEFAULT_FOR_OTHERS)
+    parser.add_argument('--years', type=float, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    written = generate(args.out_dir, args.rows, args.currencies.split(','), _parse_mix(args.mix),
+                       args.dust, args.for_others, args.years, args.seed)
+    for path, n in written.items():
+        print(f"Wrote {path} with {n} rows.")
+
+
+if __name__ == '__main__':
+    main()
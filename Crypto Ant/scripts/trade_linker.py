@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Links the two legs of a crypto-to-crypto trade. 'Bought 0.20 BCH/BTC @ 0.02406'
+# is an inflow in bch.csv and an outflow ("Other") in xbt.csv; both rows have
+# the same timestamp, description and reference, so one pass over the merged,
+# time-ordered ledger hash-joins them on (timestamp, pair, reference).
+#
+# The inflow lot then takes its ZAR cost from the outflow leg's disposal value
+# rather than from its own Value amount: costs maps (currency, timestamp,
+# reference) of each linked inflow to that value, for FYEngine.
+from collections import namedtuple
+from itertools import groupby
+from operator import attrgetter
+
+LinkedTrade = namedtuple('LinkedTrade', ['inflow', 'outflow'])
+
+
+def link_key(row):
+    return (row.timestamp, row.trade.base, row.trade.quote, row.reference)
+
+
+def cost_key(row):
+    return (row.currency, row.timestamp, row.reference)
+
+
+def _link_group(rows):
+    # Legs of one timestamp; a leg waits in pending until the other currency's
+    # leg with the same key arrives
+    pending = {}
+    for row in rows:
+        trade = row.trade
+        if trade is None or row.balance_delta == 0 or row.currency not in (trade.base, trade.quote):
+            continue
+        key = link_key(row)
+        other = pending.get(key)
+        if other is None or other.currency == row.currency:
+            pending[key] = row
+            continue
+        del pending[key]
+        if (row.balance_delta > 0) == (other.balance_delta > 0):
+            continue
+        yield LinkedTrade(row, other) if row.balance_delta > 0 else LinkedTrade(other, row)
+
+
+class TradeLinks:
+    def __init__(self):
+        self.links = []
+        self.costs = {}
+
+    def add(self, link):
+        self.links.append(link)
+        self.costs[cost_key(link.inflow)] = link.outflow.value_amount
+
+    def link(self, rows):
+        # Whole ledger at once (a list, or anything iterable in time order)
+        for _, group in groupby(rows, attrgetter('dt')):
+            for link in _link_group(group):
+                self.add(link)
+        return self
+
+    def stream(self, rows):
+        # Passes a lazy ledger through, holding back one timestamp's rows at a
+        # time so costs already has their links when they are yielded
+        for _, group in groupby(rows, attrgetter('dt')):
+            group = list(group)
+            for link in _link_group(group):
+                self.add(link)
+            yield from group
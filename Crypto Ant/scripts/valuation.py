@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Market value and unrealised gain of the open lots at every FY end, written
+# next to each FY report as fy<FY>_valuation.csv. The lots come from the run's
+# holdings index (holdings.py), the prices from the local price history
+# (price_store.py): one batched lookup per currency covers every FY end, and
+# all of a currency's lots share its price, so nothing is searched per lot.
+# A currency with no price near an FY end keeps its cost columns and leaves
+# the market ones empty. Totals are over the open lots.
+#
+#   python valuation.py                   # latest run
+#   python valuation.py --run ../reports/2025_10_01_1200
+import argparse
+import csv
+import glob
+import os
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+import fifo_report
+import run_metrics
+from fifo_report import q8, r2, s2
+from holdings import Holdings
+from price_store import PriceStore
+
+ZERO = Decimal('0')
+VALUATION_COLUMNS = ['Currency', 'Total Units', 'Total Cost (ZAR)', 'Lot Ref', 'Lot Qty', 'Lot Unit Cost (ZAR)',
+                     'Lot Cost (ZAR)', 'Price (ZAR)', 'Price At', 'Market Value (ZAR)', 'Unrealised Gain (ZAR)']
+
+# {currency: (market value, unrealised gain)} at one FY end, both None where
+# the currency had no price
+FYValuation = namedtuple('FYValuation', ['fy', 'at', 'currencies'])
+
+
+def fy_end(fy):
+    # Last second of the FY: the day before the FY start month in the year
+    # the FY is named after (fifo_report.financial_year)
+    return f"{date(fy, fifo_report.FY_START_MONTH, 1) - timedelta(days=1)} 23:59:59"
+
+
+def report_years(output_dir):
+    return sorted(int(os.path.basename(f)[2:].split('_')[0]) for f in glob.glob(os.path.join(output_dir, 'fy*_report.csv')))
+
+
+def value_fys(holdings, prices, fys):
+    # {fy: (rows, FYValuation)} for each FY in fys
+    ends = [fy_end(fy) for fy in fys]
+    quotes = {ccy: prices.quotes(ccy, ends) for ccy in holdings.currencies()}
+    out = {}
+    for k, (fy, end) in enumerate(zip(fys, ends)):
+        rows = []
+        totals = {}
+        for ccy in sorted(quotes):
+            position = holdings.at(end, ccy)
+            if not position.lots:
+                continue
+            price, at = quotes[ccy][k]
+            units = sum((lot.qty for lot in position.lots), ZERO)
+            lot_rows = []
+            for lot in position.lots:
+                market = ['', ''] if price is None else [s2(lot.qty * price), s2(lot.qty * price - lot.cost)]
+                lot_rows.append([ccy, '', '', lot.ref, q8(lot.qty), s2(lot.unit_cost), s2(lot.cost), '', ''] + market)
+            if price is None:
+                totals[ccy] = (None, None)
+                rows.append([ccy, q8(units), s2(position.cost), '', '', '', '', '', '', '', ''])
+            else:
+                # Rounded as the file has them, so the overview adds up the same
+                # whether it gets these or reads the file back
+                market = r2(units * price)
+                gain = r2(units * price - position.cost)
+                totals[ccy] = (market, gain)
+                rows.append([ccy, q8(units), s2(position.cost), '', '', '', '', s2(price), at, f"{market}", f"{gain}"])
+            rows.extend(lot_rows)
+        out[fy] = (rows, FYValuation(fy, end, totals))
+    return out
+
+
+def write_valuation(fy, at, rows, output_dir):
+    output_csv = os.path.join(output_dir, f"fy{fy}_valuation.csv")
+    with run_metrics.writing(output_csv):
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Market value at end of FY', fy, at])
+            writer.writerow(VALUATION_COLUMNS)
+            writer.writerows(rows)
+    print(f"Wrote {output_csv}")
+
+
+def run_valuation(output_dir, prices, fys=None):
+    # Writes every FY's valuation for the run in output_dir; returns the
+    # FYValuations for the overview
+    fys = report_years(output_dir) if fys is None else sorted(fys)
+    with Holdings(output_dir) as holdings:
+        valued = value_fys(holdings, prices, fys)
+    for fy, (rows, valuation) in valued.items():
+        write_valuation(fy, valuation.at, rows, output_dir)
+    return [valuation for _, valuation in valued.values()]
+
+
+def _amount(text):
+    try:
+        return Decimal(text) if text else None
+    except InvalidOperation:
+        return None
+
+
+def parse_valuation(filepath):
+    # FYValuation of a written valuation file (a reused valuation stage, or
+    # overview_report.py run on its own)
+    with open(filepath, 'r', newline='') as f:
+        reader = csv.reader(f)
+        title = next(reader)
+        next(reader)
+        totals = {row[0]: (_amount(row[9]), _amount(row[10])) for row in reader if row and row[1]}
+    return FYValuation(int(title[1]), title[2], totals)
+
+
+def read_valuations(output_dir):
+    return [parse_valuation(f) for f in sorted(glob.glob(os.path.join(output_dir, 'fy*_valuation.csv')))]
+
+
+def main():
+    import report_store
+
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Market value of the open lots at every FY end.')
+    parser.add_argument('--run', help='report folder (default: the latest run)')
+    parser.add_argument('--root', default=os.path.join(scripts_dir, '..'), help='root with the price history')
+    args = parser.parse_args()
+
+    run_dir = args.run or report_store.latest_run(os.path.join(args.root, 'reports'))
+    if run_dir is None:
+        raise SystemExit('no report run found; run main.py first')
+    prices = PriceStore(args.root)
+    if not prices:
+        raise SystemExit(f"no prices under {os.path.abspath(args.root)} (see price_store.py)")
+    for fy in report_years(run_dir):
+        report_store.detach(os.path.join(run_dir, f"fy{fy}_valuation.csv"))
+    run_valuation(run_dir, prices)
+
+
+if __name__ == '__main__':
+    main()
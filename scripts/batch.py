@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# Runs the Python report pipeline for several roots, one worker process per
+# root. A root only needs its data/ folder and an entry in the config's roots:
+# list; every root runs on one shared scripts tree (--scripts, by default the
+# first configured root that has one), which is handed the root's folder.
+# --roots takes a comma-separated subset and --root one alias or root folder
+# (repeatable); without either every configured root runs. A root's
+# config.yaml, if it has one, overrides the shared config's settings
+# (financial_year_start) and report_column_order for that root. The
+# parsed-ledger cache is shared by all roots (.cache/ledger in the repo, or
+# --cache-dir); checkpoints stay under each root's own .cache.
+#
+#   python scripts/batch.py                              # every configured root
+#   python scripts/batch.py --roots cap,cal --parallel
+#   python scripts/batch.py --root "Crypto Ant"
+#
+# PyYAML is optional. Without it the config is read by a small parser for the
+# block-style subset it uses: nested mappings, lists of scalars and lists of
+# mappings, with plain or quoted scalars and # comments.
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_CONFIG = os.path.join(REPO_DIR, 'config', 'config.yaml')
+DEFAULT_CACHE_DIR = os.path.join(REPO_DIR, '.cache', 'ledger')
+ROOT_CONFIG = 'config.yaml'
+DEFAULT_FY_START = 3
+
+_KEY = re.compile(r'''("[^"]*"|'[^']*'|[^\s#'"-][^:#]*?|-[^\s:#][^:#]*?)\s*:(?:\s+|$)''')
+
+
+def _strip_comment(line):
+    quote = None
+    for i, ch in enumerate(line):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch == '#' and (i == 0 or line[i - 1].isspace()):
+            return line[:i].rstrip()
+    return line.rstrip()
+
+
+def _scalar(text):
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    if text in ('', '~', 'null', 'Null', 'NULL'):
+        return None
+    if text in ('true', 'True', 'TRUE'):
+        return True
+    if text in ('false', 'False', 'FALSE'):
+        return False
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _is_item(text):
+    return text == '-' or text.startswith('- ')
+
+
+def _block(lines, i, indent):
+    # lines: [line number, indent, text]; parses the block starting at
+    # lines[i], whose lines sit at indent, and returns (value, next index)
+    if _is_item(lines[i][2]):
+        return _list(lines, i, indent)
+    return _mapping(lines, i, indent)
+
+
+def _nested(lines, i, indent, allow_items=False):
+    # Value of a 'key:' or '-' line with nothing after it: the deeper block
+    # that follows, if any (a mapping's list may sit at the key's own indent)
+    if i < len(lines):
+        _, deeper, text = lines[i]
+        if deeper > indent or (allow_items and deeper == indent and _is_item(text)):
+            return _block(lines, i, deeper)
+    return None, i
+
+
+def _list(lines, i, indent):
+    items = []
+    while i < len(lines) and lines[i][1] == indent and _is_item(lines[i][2]):
+        number, _, text = lines[i]
+        rest = text[1:].lstrip()
+        if not rest:
+            value, i = _nested(lines, i + 1, indent)
+        elif _KEY.match(rest) or _is_item(rest):
+            # '- alias: cap': a mapping (or list) whose first line starts
+            # after the dash, with the rest of it at that column
+            lines[i] = [number, indent + len(text) - len(rest), rest]
+            value, i = _block(lines, i, lines[i][1])
+        else:
+            value, i = _scalar(rest), i + 1
+        items.append(value)
+    return items, i
+
+
+def _mapping(lines, i, indent):
+    mapping = {}
+    while i < len(lines) and lines[i][1] == indent and not _is_item(lines[i][2]):
+        number, _, text = lines[i]
+        m = _KEY.match(text)
+        if m is None:
+            raise ValueError(f"line {number}: expected 'key: value', got {text!r}")
+        key = _scalar(m.group(1))
+        rest = text[m.end():]
+        if rest:
+            mapping[key] = _scalar(rest)
+            i += 1
+        else:
+            mapping[key], i = _nested(lines, i + 1, indent, allow_items=True)
+    return mapping, i
+
+
+def parse_yaml(text):
+    lines = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.lstrip().startswith(('---', '...')) and not line[0].isspace():
+            continue
+        line = _strip_comment(line.replace('\t', '    '))
+        if line.strip():
+            stripped = line.lstrip()
+            lines.append([number, len(line) - len(stripped), stripped])
+    if not lines:
+        return {}
+    value, i = _block(lines, 0, lines[0][1])
+    if i < len(lines):
+        raise ValueError(f"line {lines[i][0]}: unexpected indentation")
+    return value
+
+
+def load_config(path=DEFAULT_CONFIG):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    config = yaml.safe_load(text) if yaml is not None else parse_yaml(text)
+    return config or {}
+
+
+def resolve_root(path, config_path=DEFAULT_CONFIG):
+    # Relative paths are taken from the repo (the config directory's parent).
+    # An absolute path from another machine that does not exist here falls
+    # back to the repo directory of the same name
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(config_path)))
+    resolved = os.path.normpath(os.path.join(repo_dir, os.path.expanduser(path)))
+    if os.path.isdir(resolved):
+        return resolved
+    local = os.path.join(repo_dir, os.path.basename(resolved))
+    return local if os.path.isdir(local) else resolved
+
+
+def configured_roots(config, config_path=DEFAULT_CONFIG):
+    # {alias: root directory}, in config order
+    return {str(root['alias']): resolve_root(str(root['path']), config_path) for root in config.get('roots') or []}
+
+
+def root_config(root_dir, config):
+    # The shared config, with the root's own config.yaml laid over it
+    path = os.path.join(root_dir, ROOT_CONFIG)
+    if not os.path.isfile(path):
+        return config
+    return dict(config, **load_config(path))
+
+
+def financial_year_start(config):
+    return int((config.get('settings') or {}).get('financial_year_start') or DEFAULT_FY_START)
+
+
+def column_orders(config):
+    # {report: [column, ...]} for the reports that have one configured
+    return {name: [str(c) for c in columns] for name, columns in (config.get('report_column_order') or {}).items()
+            if columns}
+
+
+def pick_roots(wanted, roots):
+    # --root values (aliases, or root folders from the current directory or
+    # the repo) -> {name: root directory}
+    picked = {}
+    for name in wanted:
+        if name in roots:
+            picked[name] = roots[name]
+            continue
+        for base in (os.getcwd(), REPO_DIR):
+            path = os.path.abspath(os.path.join(base, os.path.expanduser(name)))
+            if os.path.isdir(path):
+                picked[name] = path
+                break
+        else:
+            raise SystemExit(f"unknown root {name!r}; expected a root folder or one of {', '.join(roots) or 'no aliases'}")
+    return picked
+
+
+def find_scripts(roots):
+    # scripts/ of the first root that has a pipeline
+    for path in roots.values():
+        scripts_dir = os.path.join(path, 'scripts')
+        if os.path.isfile(os.path.join(scripts_dir, 'pipeline.py')):
+            return scripts_dir
+    return None
+
+
+def run_root(task):
+    name, root_dir, scripts_dir, options = task
+    # A fresh process per root (max_tasks_per_child=1), so no module state
+    # such as the financial year start carries over from another root
+    sys.path.insert(0, scripts_dir)
+    from pipeline import run_pipeline
+    print(f"\n[{name}] {root_dir}")
+    return run_pipeline(root_dir, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate reports for several roots.')
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help='shared config with the roots: list')
+    parser.add_argument('--roots', help='comma-separated root aliases or folders (default: every configured root)')
+    parser.add_argument('--root', action='append', default=[], help='one root alias or folder; repeatable')
+    parser.add_argument('--scripts', help='scripts tree to run (default: the first configured root\'s scripts/)')
+    parser.add_argument('--workers', type=int, help='roots processed at once (default: one per root, up to the CPU count)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='parsed-ledger cache shared by all roots')
+    parser.add_argument('--timestamp', help='report directory name (default: now)')
+    parser.add_argument('--fixed', action='store_true')
+    parser.add_argument('--parallel', action='store_true', help='also run each root\'s FIFO one currency per process')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--metrics', action='store_true')
+    parser.add_argument('--no-cache', action='store_true', help='rerun every stage even if its inputs are unchanged')
+    args = parser.parse_args()
+
+    config = load_config(args.config) if os.path.isfile(args.config) else {}
+    configured = configured_roots(config, args.config)
+    wanted = [name.strip() for name in (args.roots or '').split(',') if name.strip()] + args.root
+    roots = pick_roots(wanted, configured) if wanted else configured
+    if not roots:
+        raise SystemExit(f"no roots configured in {args.config}; pass --roots or --root")
+    missing = [f"{name} ({path})" for name, path in roots.items() if not os.path.isdir(os.path.join(path, 'data'))]
+    if missing:
+        raise SystemExit(f"no data directory for root(s) {', '.join(missing)}")
+    scripts_dir = os.path.abspath(args.scripts) if args.scripts else find_scripts({**configured, **roots})
+    if scripts_dir is None or not os.path.isfile(os.path.join(scripts_dir, 'pipeline.py')):
+        raise SystemExit(f"no pipeline.py in {scripts_dir or 'any configured root'}; pass --scripts")
+
+    os.environ['LEDGER_CACHE_DIR'] = os.path.abspath(args.cache_dir)
+    options = {
+        'timestamp': args.timestamp or datetime.now().strftime('%Y_%m_%d_%H%M'),
+        'fixed': args.fixed,
+        'parallel': args.parallel,
+        'stream': args.stream,
+        'metrics': args.metrics,
+        'memo': not args.no_cache,
+    }
+    tasks = []
+    for name, path in roots.items():
+        cfg = root_config(path, config)
+        tasks.append((name, path, scripts_dir, dict(options, columns=column_orders(cfg), fy_start=financial_year_start(cfg))))
+
+    results = {}
+    failed = {}
+    workers = args.workers or min(len(tasks), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context('spawn'),
+                             max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_root, task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as exc:
+                failed[name] = exc
+
+    print(f"\n{'='*50}")
+    for name in roots:
+        if name in results:
+            print(f"{name}: {results[name]}")
+        else:
+            print(f"{name}: failed: {failed[name]!r}")
+    print('='*50)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()